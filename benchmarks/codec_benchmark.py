@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of the codecs in core/codec.py on task and message payloads.
+
+Usage:
+    python benchmarks/codec_benchmark.py [--iterations 20000] [--output results.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from core import codec as codecs # noqa: E402
+
+
+def make_task(code_lines: int = 40):
+    """
+    A task as it looks after the junior dev stage, with generated code in its output
+    """
+    return {
+        'task_id': str(uuid.uuid4()),
+        'context_id': str(uuid.uuid4()),
+        'description': 'Create a basic python script that prints "Hello, World!" and handles command line arguments',
+        'dependencies': [str(uuid.uuid4()) for _ in range(3)],
+        'status': 'pending',
+        'assigned_agent': str(uuid.uuid4()),
+        'priority': 1,
+        'deadline': time.time() + 600,
+        'resource_requirements': {'model': 'llama-2-13b'},
+        'output': {'code': "\n".join(f"def function_{i}(value):\n    return value * {i}" for i in range(code_lines))}
+    }
+
+
+def make_message():
+    """
+    A task_update message as published by the agents
+    """
+    return {'task_id': str(uuid.uuid4()), 'status': 'completed', 'agent_id': str(uuid.uuid4())}
+
+
+def time_it(func, iterations: int) -> float:
+    """
+    Returns operations per second
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed if elapsed else float('inf')
+
+
+def bench_codec(codec, payload, iterations: int):
+    """
+    Benchmark one codec on one payload, encoded as the task queue stores it
+    """
+    encoded = codec.encode(payload)
+    assert codecs.decode(encoded) == payload, f"{codec.name} did not round trip the payload"
+    body = memoryview(encoded)[1:] if codecs.codec_for_tag(encoded[0]) else memoryview(encoded) # without a tag byte
+    return {
+        'size_bytes': len(encoded),
+        'encode_ops_per_sec': time_it(lambda: codec.encode(payload), iterations),
+        # Same as codecs.decode, but pinned to this codec so the stdlib and orjson variants are measured separately
+        'decode_ops_per_sec': time_it(lambda: codec.loads(body), iterations)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    candidates = [('stdlib json', codecs.JSONCodec(fast=False))]
+    if codecs.orjson is not None:
+        candidates.append(('orjson', codecs.JSONCodec()))
+    if codecs.msgpack is not None:
+        candidates.append(('msgpack', codecs.MsgpackCodec()))
+    missing = [name for name, module in (('orjson', codecs.orjson), ('msgpack', codecs.msgpack)) if module is None]
+
+    payloads = {'task': make_task(), 'task_large': make_task(code_lines=800), 'message': make_message()}
+    results = {}
+    print(f"{'codec':<12} {'payload':<11} {'bytes':>8} {'encode/s':>12} {'decode/s':>12}")
+    for name, codec in candidates:
+        for payload_name, payload in payloads.items():
+            result = bench_codec(codec, payload, args.iterations)
+            results.setdefault(name, {})[payload_name] = result
+            print(f"{name:<12} {payload_name:<11} {result['size_bytes']:>8} {result['encode_ops_per_sec']:>12,.0f} {result['decode_ops_per_sec']:>12,.0f}")
+    if missing:
+        print(f"Not installed, skipped: {', '.join(missing)}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'iterations': args.iterations, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+Local fake of the Ollama HTTP API (/api/generate and /api/ps) with configurable timing, for benchmarks.
+
+The time a request takes is a sampled base latency, plus the load time on the first request for a model (and again
+after `keep_alive` seconds idle), plus prompt and completion tokens at the configured rates. The response carries the
+same timing fields as Ollama, so the client telemetry works as with a real server.
+
+Run on its own:
+    python benchmarks/fake_ollama.py [--port 11435] [--latency lognormal:0.05] [--load-time 2] [--tokens-per-sec 50]
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_distribution(spec: str):
+    """
+    Returns a function sampling seconds from a spec such as 'constant:0.05', 'uniform:0.01:0.1',
+    'exponential:0.05' (mean) or 'lognormal:0.05:0.5' (median and sigma)
+    """
+    kind, *params = spec.split(':')
+    values = [float(param) for param in params]
+    if kind == 'constant':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'exponential':
+        return lambda: random.expovariate(1 / values[0])
+    if kind == 'lognormal':
+        median, sigma = values[0], values[1] if len(values) > 1 else 0.5
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+class FakeOllamaServer:
+    """
+    Serves the fake API on a background thread.
+    """
+    def __init__(self, host: str = 'localhost', port: int = 0, latency: str = 'constant:0.01', load_time: float = 0.0,
+                 keep_alive: float = 300.0, tokens_per_sec: float = 100.0, prompt_tokens_per_sec: float = 2000.0,
+                 completion_tokens: int = 64, error_rate: float = 0.0, response_text: str = None):
+        self.sample_latency = parse_distribution(latency)
+        self.load_time = load_time # seconds to load a model that isn't loaded
+        self.keep_alive = keep_alive # idle seconds after which a model is unloaded
+        self.tokens_per_sec = tokens_per_sec
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate # share of requests answered with a 500
+        self.response_text = response_text or "First subtask\nSecond subtask\n```python\nprint('Hello, World!')\n```"
+        self.loaded = {} # model -> time of the last request
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _FakeOllamaHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def generate(self, request: dict) -> tuple[int, dict]:
+        """
+        Sleeps for the simulated duration of a request and returns the status and the response
+        """
+        model = request.get('model', 'default')
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return 500, {'error': 'simulated failure'}
+            last_used = self.loaded.get(model)
+            cold = last_used is None or now - last_used > self.keep_alive
+            self.loaded[model] = now
+        prompt_tokens = math.ceil(len(request.get('prompt', '') + request.get('system', '')) / 4)
+        load_duration = self.load_time if cold else 0.0
+        prompt_duration = prompt_tokens / self.prompt_tokens_per_sec
+        eval_duration = self.completion_tokens / self.tokens_per_sec
+        time.sleep(self.sample_latency() + load_duration + prompt_duration + eval_duration)
+        context = list(request.get('context') or []) + list(range(prompt_tokens + self.completion_tokens))[-64:]
+        return 200, {
+            'model': model,
+            'response': self.response_text,
+            'done': True,
+            'context': context,
+            'load_duration': int(load_duration * 1e9),
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(prompt_duration * 1e9),
+            'eval_count': self.completion_tokens,
+            'eval_duration': int(eval_duration * 1e9),
+            'total_duration': int((time.time() - now) * 1e9)
+        }
+
+    def get_status(self) -> dict:
+        return {'requests': self.requests, 'errors': self.errors}
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/api/generate':
+            self._send(404, {'error': 'not found'})
+            return
+        if request.get('stream', True):
+            self._send(400, {'error': 'the fake server does not stream'})
+            return
+        self._send(*self.server.fake.generate(request))
+
+    def do_GET(self):
+        if self.path == '/api/ps':
+            self._send(200, {'models': [{'name': model} for model in list(self.server.fake.loaded)]})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', default='constant:0.01')
+    parser.add_argument('--load-time', type=float, default=0.0)
+    parser.add_argument('--tokens-per-sec', type=float, default=100.0)
+    parser.add_argument('--completion-tokens', type=int, default=64)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeOllamaServer(port=args.port, latency=args.latency, load_time=args.load_time, tokens_per_sec=args.tokens_per_sec,
+                              completion_tokens=args.completion_tokens, error_rate=args.error_rate).start()
+    print(f"Fake ollama listening on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""
+In-memory stand-in for the subset of redis-py that RedisTaskQueue uses, so benchmarks run without a Redis server.
+
+Every command is counted, and so is every round trip: a command, a script call or an executed pipeline is one round
+trip. That gives the number of operations per task a real server would have seen. Lua scripts can't run here, so the
+scripts of the task queue are mirrored by Python functions with the same effect.
+"""
+import fnmatch
+import threading
+import time
+from collections import Counter
+
+from core import task_queue
+
+
+def _key(key):
+    return key.encode('utf-8') if isinstance(key, str) else key
+
+
+def _value(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return str(value).encode('utf-8')
+
+
+class FakeRedis:
+    """
+    Strings, hashes and sorted sets in a dict, guarded by one lock like the single threaded server.
+    """
+    def __init__(self):
+        self.data = {}
+        self.commands = Counter() # command name -> times run
+        self.round_trips = 0
+        self._lock = threading.RLock()
+        self.scripts = {
+            task_queue.SET_SCRIPT: self._set_task,
+            task_queue.DELETE_SCRIPT: self._delete_task,
+            task_queue.ACQUIRE_LEASE_SCRIPT: self._acquire_lease,
+            task_queue.RENEW_LEASE_SCRIPT: self._renew_lease,
+            task_queue.RELEASE_LEASE_SCRIPT: self._release_lease,
+            task_queue.EXPIRED_LEASES_SCRIPT: self._expired_leases
+        }
+
+    def _count(self, command: str, round_trip: bool = True):
+        self.commands[command] += 1
+        if round_trip:
+            self.round_trips += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.commands.clear()
+            self.round_trips = 0
+
+    # Strings
+
+    def get(self, key, _round_trip=True):
+        with self._lock:
+            self._count('GET', _round_trip)
+            value = self.data.get(_key(key))
+            return value if isinstance(value, bytes) else None
+
+    def set(self, key, value, _round_trip=True):
+        with self._lock:
+            self._count('SET', _round_trip)
+            self.data[_key(key)] = _value(value)
+            return True
+
+    def mget(self, keys, _round_trip=True):
+        with self._lock:
+            self._count('MGET', _round_trip)
+            return [value if isinstance(value, bytes) else None for value in (self.data.get(_key(key)) for key in keys)]
+
+    def delete(self, *keys, _round_trip=True):
+        with self._lock:
+            self._count('DEL', _round_trip)
+            return sum(1 for key in keys if self.data.pop(_key(key), None) is not None)
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            self._count('KEYS')
+            return [key for key in self.data if fnmatch.fnmatchcase(key.decode('utf-8'), pattern)]
+
+    def scan_iter(self, match=None, count=None):
+        with self._lock:
+            keys = list(self.data)
+        count = count or 10
+        for start in range(0, max(len(keys), 1), count):
+            with self._lock:
+                self._count('SCAN')
+            for key in keys[start:start + count]:
+                if match is None or fnmatch.fnmatchcase(key.decode('utf-8'), match):
+                    yield key
+
+    def flushdb(self):
+        with self._lock:
+            self._count('FLUSHDB')
+            self.data.clear()
+            return True
+
+    # Hashes
+
+    def _hash(self, key, create=False):
+        key = _key(key)
+        value = self.data.get(key)
+        if value is None and create:
+            value = self.data[key] = {}
+        if value is not None and not isinstance(value, dict):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def hget(self, key, field, _round_trip=True):
+        with self._lock:
+            self._count('HGET', _round_trip)
+            return (self._hash(key) or {}).get(_key(field))
+
+    def hgetall(self, key, _round_trip=True):
+        with self._lock:
+            self._count('HGETALL', _round_trip)
+            return dict(self._hash(key) or {})
+
+    def hmget(self, key, *fields, _round_trip=True):
+        with self._lock:
+            self._count('HMGET', _round_trip)
+            values = self._hash(key) or {}
+            return [values.get(_key(field)) for field in fields]
+
+    def hlen(self, key, _round_trip=True):
+        with self._lock:
+            self._count('HLEN', _round_trip)
+            return len(self._hash(key) or {})
+
+    def hset(self, key, field=None, value=None, mapping=None, _round_trip=True):
+        with self._lock:
+            self._count('HSET', _round_trip)
+            values = self._hash(key, create=True)
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            for item_field, item_value in items.items():
+                values[_key(item_field)] = _value(item_value)
+            return len(items)
+
+    def hincrby(self, key, field, amount=1, _round_trip=True):
+        with self._lock:
+            self._count('HINCRBY', _round_trip)
+            values = self._hash(key, create=True)
+            result = int(values.get(_key(field), b'0')) + amount
+            values[_key(field)] = str(result).encode('utf-8')
+            return result
+
+    def hdel(self, key, *fields, _round_trip=True):
+        with self._lock:
+            self._count('HDEL', _round_trip)
+            values = self._hash(key) or {}
+            return sum(1 for field in fields if values.pop(_key(field), None) is not None)
+
+    # Sorted sets, kept as member -> score
+
+    def _zset(self, key, create=False):
+        return self._hash(key, create) # same storage as a hash, the values are scores
+
+    def zadd(self, key, mapping, _round_trip=True):
+        with self._lock:
+            self._count('ZADD', _round_trip)
+            values = self._zset(key, create=True)
+            added = sum(1 for member in mapping if _key(member) not in values)
+            for member, score in mapping.items():
+                values[_key(member)] = float(score)
+            return added
+
+    def zscore(self, key, member, _round_trip=True):
+        with self._lock:
+            self._count('ZSCORE', _round_trip)
+            return (self._zset(key) or {}).get(_key(member))
+
+    def zrangebyscore(self, key, min, max, start=None, num=None, _round_trip=True):
+        with self._lock:
+            self._count('ZRANGEBYSCORE', _round_trip)
+            low = float('-inf') if min == '-inf' else float(min)
+            high = float('inf') if max == '+inf' else float(max)
+            members = sorted((score, member) for member, score in (self._zset(key) or {}).items() if low <= score <= high)
+            members = [member for _, member in members]
+            if start is not None:
+                members = members[start:start + num]
+            return members
+
+    def zrem(self, key, *members, _round_trip=True):
+        with self._lock:
+            self._count('ZREM', _round_trip)
+            values = self._zset(key) or {}
+            return sum(1 for member in members if values.pop(_key(member), None) is not None)
+
+    def zcard(self, key, _round_trip=True):
+        with self._lock:
+            self._count('ZCARD', _round_trip)
+            return len(self._zset(key) or {})
+
+    def time(self):
+        self._count('TIME')
+        now = time.time()
+        return int(now), int((now % 1) * 1e6)
+
+    # Scripts
+
+    def register_script(self, script: str):
+        if script not in self.scripts:
+            raise NotImplementedError("FakeRedis has no Python version of this script")
+        function = self.scripts[script]
+
+        def call(keys=(), args=(), client=None):
+            with self._lock:
+                self._count('EVALSHA')
+                return function(list(keys), list(args))
+        return call
+
+    def _set_task(self, keys, args):
+        task_key, counts_key, index_key = keys
+        value, task_id, status = args
+        old = self.hget(index_key, task_id, _round_trip=False)
+        self.set(task_key, value, _round_trip=False)
+        if old != _value(status):
+            if old is not None:
+                self.hincrby(counts_key, old, -1, _round_trip=False)
+            self.hincrby(counts_key, status, 1, _round_trip=False)
+            self.hset(index_key, task_id, status, _round_trip=False)
+        return old
+
+    def _delete_task(self, keys, args):
+        task_key, counts_key, index_key, leases_key, owners_key, checkpoint_key = keys
+        task_id = args[0]
+        old = self.hget(index_key, task_id, _round_trip=False)
+        self.delete(task_key, checkpoint_key, _round_trip=False)
+        self.zrem(leases_key, task_id, _round_trip=False)
+        self.hdel(owners_key, task_id, _round_trip=False)
+        if old is not None:
+            self.hincrby(counts_key, old, -1, _round_trip=False)
+            self.hdel(index_key, task_id, _round_trip=False)
+        return old
+
+    @staticmethod
+    def _now_ms():
+        return int(time.time() * 1000)
+
+    def _acquire_lease(self, keys, args):
+        leases_key, owners_key = keys
+        task_id, owner, ttl = args
+        current = self.hget(owners_key, task_id, _round_trip=False)
+        if current is not None and current != _value(owner):
+            expiry = self.zscore(leases_key, task_id, _round_trip=False)
+            if expiry is not None and expiry > self._now_ms():
+                return 0
+        self.hset(owners_key, task_id, owner, _round_trip=False)
+        self.zadd(leases_key, {task_id: self._now_ms() + int(ttl)}, _round_trip=False)
+        return 1
+
+    def _renew_lease(self, keys, args):
+        leases_key, owners_key = keys
+        task_id, owner, ttl = args
+        if self.hget(owners_key, task_id, _round_trip=False) != _value(owner):
+            return 0
+        self.zadd(leases_key, {task_id: self._now_ms() + int(ttl)}, _round_trip=False)
+        return 1
+
+    def _release_lease(self, keys, args):
+        leases_key, owners_key = keys
+        task_id, owner = args
+        if self.hget(owners_key, task_id, _round_trip=False) != _value(owner):
+            return 0
+        self.zrem(leases_key, task_id, _round_trip=False)
+        self.hdel(owners_key, task_id, _round_trip=False)
+        return 1
+
+    def _expired_leases(self, keys, args):
+        leases_key, owners_key = keys
+        result = []
+        for task_id in self.zrangebyscore(leases_key, '-inf', self._now_ms(), 0, int(args[0]), _round_trip=False):
+            result += [task_id, self.hget(owners_key, task_id, _round_trip=False) or b'']
+            self.zrem(leases_key, task_id, _round_trip=False)
+            self.hdel(owners_key, task_id, _round_trip=False)
+        return result
+
+    # Pipelines
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    Buffers commands and runs them in one round trip
+    """
+    def __init__(self, redis_client: FakeRedis):
+        self.redis = redis_client
+        self.buffered = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+
+        def buffer(*args, **kwargs):
+            self.buffered.append((command, args, kwargs))
+            return self
+        return buffer
+
+    def execute(self):
+        with self.redis._lock:
+            self.redis.round_trips += 1
+            results = [command(*args, _round_trip=False, **kwargs) for command, args, kwargs in self.buffered]
+        self.buffered = []
+        return results
@@ -0,0 +1,82 @@
+"""
+Measures the startup cost of the resource manager: import time and peak memory of a fresh interpreter that imports
+the module and builds a ResourceManager, once per GPU provider. The 'eager torch' row imports torch up front the way
+resource_manager.py used to, for comparison.
+
+Usage:
+    python benchmarks/import_time_benchmark.py [--runs 5] [--output results.json]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Runs in a fresh interpreter, prints the elapsed seconds and the peak RSS in MB as JSON
+PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+{setup}
+import core.resource_manager
+manager = core.resource_manager.ResourceManager({config!r}, logger=__import__('logging').getLogger('bench'))
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{'seconds': elapsed, 'max_rss_mb': rss / 1024 if sys.platform != 'darwin' else rss / 1024 ** 2}}))
+"""
+
+
+def run_case(setup: str, config: dict, runs: int):
+    """
+    Runs the probe `runs` times and returns the medians
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(src=SRC, setup=setup, config=config)],
+                                capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'seconds': statistics.median(sample['seconds'] for sample in samples),
+        'max_rss_mb': statistics.median(sample['max_rss_mb'] for sample in samples)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec('psutil') is None:
+        sys.exit("The resource manager needs psutil, install it to run this benchmark")
+
+    torch_installed = importlib.util.find_spec('torch') is not None
+    cases = [
+        ('none', '', {'gpu_provider': 'none'}),
+        ('auto', '', {'gpu_provider': 'auto'}),
+        ('nvidia-smi', '', {'gpu_provider': 'nvidia-smi'})
+    ]
+    if torch_installed:
+        cases.append(('torch', '', {'gpu_provider': 'torch'}))
+        cases.append(('eager torch', 'import torch', {'gpu_provider': 'none'}))
+
+    results = {}
+    print(f"{'provider':<12} {'seconds':>9} {'max rss MB':>11}")
+    for name, setup, config in cases:
+        result = run_case(setup, config, args.runs)
+        results[name] = result
+        print(f"{name:<12} {result['seconds']:>9.3f} {result['max_rss_mb']:>11.1f}")
+    if not torch_installed:
+        print("torch is not installed, skipped the torch rows")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': args.runs, 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+End to end benchmark of the scheduler, task store and ollama client on a synthetic project.
+
+Runs the scheduler and the dev agents in this process against a fake Ollama server (fake_ollama.py) and an in-memory
+Redis stand-in (fake_redis.py), seeds a generated task DAG (project_generator.py) and waits until every task has
+finished. The architect is left out, it breaks projects down rather than running the generated tasks.
+
+Reports tasks/sec, makespan, scheduling latency percentiles (from a task becoming ready to being assigned) and
+Redis operations per task. Save the results with --output and pass them as --baseline to a later run to compare.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--width 4] [--depth 4] [--models llama-2-7b:3,gpt-4:1,unit-test:1]
+        [--latency lognormal:0.05:0.5] [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'src'))
+sys.path.insert(0, os.path.join(BENCHMARKS, '..', 'src', 'agents')) # the agents import their base class as a top level module
+
+from core import metrics # noqa: E402
+from core.task_queue import RedisTaskQueue, STATUS_COUNTS_KEY # noqa: E402
+from core.message_pipeline import HTTPMessagePipeline # noqa: E402
+from core.resource_manager import ResourceManager # noqa: E402
+from core.scheduler import Scheduler # noqa: E402
+from api.ollama_client import OllamaClient # noqa: E402
+from agents.senior_dev_agent import SeniorDevAgent # noqa: E402
+from agents.junior_dev_agent import JuniorDevAgent # noqa: E402
+from agents.test_dev_agent import TestDevAgent # noqa: E402
+from fake_ollama import FakeOllamaServer # noqa: E402
+from fake_redis import FakeRedis # noqa: E402
+from project_generator import generate_project # noqa: E402
+
+# Metrics compared against a baseline, and whether higher is better
+COMPARED = {
+    'tasks_per_sec': True,
+    'makespan_seconds': False,
+    'scheduling_latency.p50': False,
+    'scheduling_latency.p95': False,
+    'redis_round_trips_per_task': False,
+    'redis_commands_per_task': False
+}
+
+
+def percentile(values: list, p: float) -> float | None:
+    """
+    Nearest rank percentile
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def status_counts(fake: FakeRedis) -> dict:
+    """
+    Status counts read straight from the stand-in, so watching the run doesn't add to the measured operations
+    """
+    with fake._lock:
+        counts = dict(fake.data.get(STATUS_COUNTS_KEY.encode('utf-8'), {}))
+    return {status.decode('utf-8'): int(count) for status, count in counts.items()}
+
+
+def run(args) -> dict:
+    quiet = logging.getLogger('benchmark')
+    quiet.setLevel(logging.ERROR)
+    quiet.addHandler(logging.StreamHandler())
+
+    fake_redis = FakeRedis()
+    task_queue = RedisTaskQueue(redis_client=fake_redis)
+    message_pipeline = HTTPMessagePipeline(logger=quiet) # publish works without the http server
+    ollama = FakeOllamaServer(latency=args.latency, load_time=args.load_time, tokens_per_sec=args.tokens_per_sec,
+                              completion_tokens=args.completion_tokens, error_rate=args.error_rate).start()
+    ollama_client = OllamaClient(host=ollama.url, logger=quiet)
+    resource_manager = ResourceManager({'gpu_provider': 'none'}, logger=quiet)
+    # The fake server loads nothing, so only the scheduling is measured and not whether this machine fits the models
+    resource_manager.model_resource_map = {'default': {'memory': 0.0, 'vram': 0.0}}
+    resource_manager.start_sampling()
+
+    common = dict(message_pipeline=message_pipeline, task_queue=task_queue, logger=quiet, ollama_client=ollama_client,
+                  resource_manager=resource_manager, poll_interval=args.poll_interval)
+    senior_dev = SeniorDevAgent(name="Senior Dev", model="gpt-4", **common)
+    junior_devs = [JuniorDevAgent(name=f"Junior Dev {i + 1}", model="llama-2-7b", **common) for i in range(args.junior_devs)]
+    test_dev = TestDevAgent(name="Test Dev", model="llama-2-13b", **common)
+    scheduler = Scheduler(task_queue, resource_manager, pools=[('gpt-4', [senior_dev]), ('llama', junior_devs), ('', [test_dev])],
+                          logger=quiet, interval=args.scheduler_interval, message_pipeline=message_pipeline)
+
+    tasks = generate_project(args.width, args.depth, args.fan_in, args.models, args.seed)
+    for task in tasks:
+        task_queue.set(task['task_id'], task)
+    fake_redis.reset_stats() # measure the work of running the project, not of seeding it
+
+    started = time.time()
+    for task in tasks:
+        task['created_at'] = started
+        task_queue.set(task['task_id'], task)
+    for agent in [senior_dev, test_dev] + junior_devs:
+        thread = threading.Thread(target=agent.run)
+        thread.daemon = True # the agents have no stop, they end with the process
+        thread.start()
+    scheduler.start()
+
+    finished = 0
+    timed_out = True
+    while time.time() - started < args.timeout:
+        counts = status_counts(fake_redis)
+        finished = counts.get('completed', 0) + counts.get('failed', 0)
+        unfinished = sum(counts.values()) - finished - counts.get('paused', 0)
+        if unfinished <= 0 and finished:
+            timed_out = False
+            break
+        time.sleep(0.01)
+    makespan = time.time() - started
+    round_trips = fake_redis.round_trips
+    commands = dict(fake_redis.commands)
+    scheduler.running = False # stop without waiting for the current pass
+    resource_manager.stop_sampling()
+
+    # Scheduling latency: from the last dependency finishing (or the start) to the task being assigned
+    all_tasks = {task['task_id']: task for task in task_queue.values()}
+    latencies = []
+    for task in all_tasks.values():
+        if 'assigned_at' not in task:
+            continue
+        dependencies = [all_tasks.get(dep, {}).get('finished_at') for dep in task.get('dependencies') or []]
+        ready_at = max([task.get('created_at') or started] + [at for at in dependencies if at])
+        latencies.append(max(0.0, task['assigned_at'] - ready_at))
+    tick = metrics.SCHEDULER_TICK.labels().snapshot()
+    ollama.stop()
+
+    return {
+        'timed_out': timed_out,
+        'seeded_tasks': len(tasks),
+        'finished_tasks': finished,
+        'status_counts': status_counts(fake_redis),
+        'makespan_seconds': makespan,
+        'tasks_per_sec': finished / makespan if makespan else None,
+        'scheduling_latency': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None
+        },
+        'scheduler_ticks': tick['count'],
+        'scheduler_tick_mean_seconds': tick['sum'] / tick['count'] if tick['count'] else None,
+        'llm_requests': ollama.get_status()['requests'],
+        'redis_round_trips': round_trips,
+        'redis_round_trips_per_task': round_trips / finished if finished else None,
+        'redis_commands_per_task': sum(commands.values()) / finished if finished else None,
+        'redis_commands': commands
+    }
+
+
+def lookup(results: dict, path: str):
+    for part in path.split('.'):
+        results = (results or {}).get(part)
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Prints the change of the main metrics against a baseline run
+    """
+    print(f"\n{'metric':<30} {'baseline':>12} {'current':>12} {'change':>9}")
+    for path, higher_is_better in COMPARED.items():
+        before, after = lookup(baseline, path), lookup(results, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        better = (change > 0) == higher_is_better or change == 0
+        print(f"{path:<30} {before:>12.4f} {after:>12.4f} {change:>+8.1f}% {'' if better else '(worse)'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--width', type=int, default=4, help="tasks per layer of the project")
+    parser.add_argument('--depth', type=int, default=4, help="layers of the project")
+    parser.add_argument('--fan-in', type=int, default=2, help="dependencies of a task on the layer before it")
+    parser.add_argument('--models', default='llama-2-7b:3,gpt-4:1,unit-test:1', help="weighted model mix of the tasks")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--junior-devs', type=int, default=2)
+    parser.add_argument('--latency', default='lognormal:0.05:0.5', help="base latency of the fake ollama, see fake_ollama.py")
+    parser.add_argument('--load-time', type=float, default=0.2, help="seconds to load a model on its first request")
+    parser.add_argument('--tokens-per-sec', type=float, default=500.0)
+    parser.add_argument('--completion-tokens', type=int, default=64)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--poll-interval', type=float, default=0.05, help="seconds between task queue checks of the agents")
+    parser.add_argument('--scheduler-interval', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps({key: value for key, value in results.items() if key != 'redis_commands'}, indent=2))
+    if results['timed_out']:
+        print(f"Timed out after {args.timeout}s with tasks unfinished")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f)['results'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Synthetic projects for benchmarks: layered task DAGs of configurable width and depth.
+
+Every task of a layer depends on up to `fan_in` random tasks of the layer before it. Models are drawn from a weighted
+mix such as 'llama-2-7b:3,gpt-4:1,unit-test:1', which decides the agent pool a task is scheduled to.
+"""
+import random
+import time
+import uuid
+
+
+def parse_models(spec: str) -> list:
+    """
+    Returns [(model, weight)] from 'model:weight,...', the weight defaults to 1
+    """
+    models = []
+    for part in spec.split(','):
+        model, _, weight = part.strip().partition(':')
+        models.append((model, float(weight or 1)))
+    return models
+
+
+def generate_project(width: int = 4, depth: int = 4, fan_in: int = 2, models: str = 'llama-2-7b', seed: int = None) -> list:
+    """
+    Returns the tasks of a project, in dependency order
+    """
+    rng = random.Random(seed)
+    model_mix = parse_models(models)
+    names = [model for model, _ in model_mix]
+    weights = [weight for _, weight in model_mix]
+    tasks = []
+    previous_layer = []
+    now = time.time()
+    for layer in range(depth):
+        current_layer = []
+        for index in range(width):
+            task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            dependencies = rng.sample(previous_layer, min(fan_in, len(previous_layer))) if previous_layer else []
+            tasks.append({
+                'task_id': task_id,
+                'description': f"Implement part {index} of layer {layer}: a function that processes the output of its dependencies",
+                'dependencies': dependencies,
+                'status': 'pending',
+                'assigned_agent': None,
+                'priority': 1,
+                'resource_requirements': {'model': rng.choices(names, weights)[0]},
+                # Reviews need code to look at, so every task carries some
+                'output': {'code': "\n".join(f"def step_{layer}_{index}_{i}(value):\n    return value + {i}" for i in range(10))},
+                'context_id': task_id,
+                'created_at': now
+            })
+            current_layer.append(task_id)
+        previous_layer = current_layer
+    return tasks
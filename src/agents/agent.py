@@ -1,29 +1,36 @@
 import uuid
-import logging
+import time
+import hashlib
+import threading
 from abc import ABC, abstractmethod
 from typing import Dict, Any
+from utils.prompt_builder import PromptBuilder, PromptResult
+from core.metrics import QUEUE_WAIT, STAGE_TIME
+from utils.logger import get_logger, log_context
 
 class Agent(ABC):
     """
     Abstract base class for all agents.
     """
 
-    def __init__(self, name: str, model: str, message_pipeline, task_queue, confidence_threshold: float = 0.6, logger=None):
-        self.id = str(uuid.uuid4())
+    def __init__(self, name: str, model: str, message_pipeline, task_queue, confidence_threshold: float = 0.6, logger=None, max_task_attempts: int = 3,
+                 prompt_builder: PromptBuilder = None, resource_manager=None, role: str = None, poll_interval: float = 1.0,
+                 agent_id: str = None, lease_ttl: float = 60.0):
+        self.id = agent_id or str(uuid.uuid4()) # keep the id stable across restarts to pick up the tasks assigned before
         self.name = name
         self.model = model  # Model name or identifier
         self.message_pipeline = message_pipeline  # Communication channel
         self.task_queue = task_queue
         self.confidence_threshold = confidence_threshold # Confidence required to move forward
-        if logger:
-            self.logger = logger
-        else:
-            self.logger = logging.getLogger(f"agent_{self.name}_{self.id}")
-            self.logger.setLevel(logging.DEBUG) # Default log level can be changed as needed
-            ch = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            ch.setFormatter(formatter)
-            self.logger.addHandler(ch)
+        self.logger = get_logger(f"agent_{self.name}_{self.id}", logger)
+        self.prompt_builder = prompt_builder or PromptBuilder() # keeps prompts within the context window of the model
+        self.max_task_attempts = max_task_attempts # times a task is handed back for a retry before it is failed
+        self.resource_manager = resource_manager # receives the usage of every task the agent runs
+        self.role = role or type(self).__name__ # agents with the same role are summarised together
+        self.task_usage = None # accounting of the task being processed, see handle_task
+        self.poll_interval = poll_interval # seconds between checks of the task queue for new work
+        self.lease_ttl = lease_ttl # seconds the lease on the current task lasts, renewed every third of that
+        self._heartbeat_stop = None
         self.current_task_id = None
         self.is_active = False
 
@@ -34,11 +41,123 @@ class Agent(ABC):
         """
         pass
 
+    def handle_task(self, task_details: Dict[str, Any]):
+        """
+        Runs process_task on a task and reports what it cost to the resource manager: wall time, CPU time of the
+        agent's thread, LLM tokens and wait, and how long the task waited in the queue before the agent picked it up.
+        A task started with start_task is leased to the agent and marked in_progress, the lease is renewed in the
+        background until the task ends. Everything logged meanwhile is tagged with the task and agent ids.
+        """
+        with log_context(task_id=(task_details or {}).get('task_id'), agent_id=self.id, agent=self.name):
+            self._handle_task(task_details)
+
+    def _handle_task(self, task_details: Dict[str, Any]):
+        leased = self.current_task_id is not None and self.current_task_id == (task_details or {}).get('task_id')
+        if leased and not self.task_queue.acquire_lease(self.current_task_id, self.id, self.lease_ttl):
+            self.logger.warning("Task %s is leased to another agent, skipping it", self.current_task_id)
+            self.is_active = False
+            self.current_task_id = None
+            return
+        if leased:
+            self.update_task_status('in_progress')
+            self._start_heartbeat(self.current_task_id)
+        started = time.time()
+        cpu_started = time.thread_time()
+        self.task_usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'llm_wait': 0.0, 'outcome': 'unfinished'}
+        try:
+            self.process_task(task_details)
+        except Exception:
+            self.task_usage['outcome'] = 'error'
+            raise
+        finally:
+            self._stop_heartbeat()
+            usage = self.task_usage
+            self.task_usage = None
+            queued_at = (task_details or {}).get('queued_at') or (task_details or {}).get('created_at')
+            usage.update({
+                'task_id': (task_details or {}).get('task_id'),
+                'agent_name': self.name,
+                'role': self.role,
+                'wall_time': time.time() - started,
+                'cpu_time': time.thread_time() - cpu_started,
+                'queue_wait': max(0.0, started - queued_at) if queued_at else 0.0
+            })
+            STAGE_TIME.labels(self.role, usage['outcome']).observe(usage['wall_time'])
+            if queued_at:
+                QUEUE_WAIT.labels(self.role).observe(usage['queue_wait'])
+            if self.resource_manager:
+                self.resource_manager.track_agent_resource(self.id, usage)
+
+    def _start_heartbeat(self, task_id: str):
+        """
+        Renews the lease on a task in a background thread until _stop_heartbeat is called
+        """
+        stop = threading.Event()
+        self._heartbeat_stop = stop
+        thread = threading.Thread(target=self._heartbeat, args=(task_id, stop))
+        thread.daemon = True
+        thread.start()
+
+    def _heartbeat(self, task_id: str, stop: threading.Event):
+        while not stop.wait(self.lease_ttl / 3):
+            try:
+                if not self.task_queue.renew_lease(task_id, self.id, self.lease_ttl):
+                    self.logger.warning("Lost the lease on task %s, it may be running elsewhere", task_id)
+                    return
+            except Exception as e:
+                self.logger.error("Could not renew the lease on task %s: %s", task_id, e) # try again on the next beat
+
+    def _stop_heartbeat(self):
+        if self._heartbeat_stop:
+            self._heartbeat_stop.set()
+            self._heartbeat_stop = None
+
+    def _release_lease(self, task_id: str):
+        """
+        Gives up the lease on a task the agent is done with
+        """
+        self._stop_heartbeat()
+        if task_id:
+            self.task_queue.release_lease(task_id, self.id)
+
+    def generate_text(self, model: str, prompt: str, **kwargs) -> str | None:
+        """
+        Calls the LLM through the agent's ollama client, counting the tokens and the wait against the current task.
+        Takes the same arguments as OllamaClient.generate_text.
+        Responses are checkpointed against the current task, a later attempt at the task reuses them instead of
+        paying for the same call again.
+        """
+        step = None
+        if self.current_task_id:
+            step = hashlib.sha256(f"{model}\0{kwargs.get('system') or ''}\0{prompt}".encode('utf-8')).hexdigest()[:16]
+            checkpoint = self.task_queue.get_checkpoint(self.current_task_id, step)
+            if checkpoint is not None:
+                self.logger.info("Reusing the checkpointed response of an earlier attempt at task %s", self.current_task_id)
+                return checkpoint
+        if self.task_usage is None:
+            response = self.ollama_client.generate_text(model, prompt, **kwargs)
+        else:
+            started = time.time()
+            try:
+                response = self.ollama_client.generate_text(model, prompt, usage=self.task_usage, **kwargs)
+            finally:
+                self.task_usage['llm_wait'] += time.time() - started
+        if response and step:
+            self.task_queue.save_checkpoint(self.current_task_id, step, response)
+        return response
+
+    def _record_outcome(self, outcome: str):
+        """
+        Notes how the current task ended for the usage accounting
+        """
+        if self.task_usage is not None:
+            self.task_usage['outcome'] = outcome
+
     def start_task(self, task_id):
         """
         Called when the scheduler sends a task to the agent.
         """
-        self.logger.info(f"Starting task: {task_id}")
+        self.logger.info("Starting task: %s", task_id)
         self.current_task_id = task_id
         self.is_active = True
 
@@ -46,29 +165,76 @@ class Agent(ABC):
         """
         Called after an agent has completed the current task
         """
-        self.logger.info(f"Task {self.current_task_id} complete")
+        self.logger.info("Task %s complete", self.current_task_id)
+        self._record_outcome('completed')
+        self.update_task_status('completed', result)
+        self._release_lease(self.current_task_id)
+        self.task_queue.clear_checkpoints(self.current_task_id)
         self.is_active = False
         self.current_task_id = None
-        self.update_task_status('completed', result)
 
 
     def fail_task(self, error_message: str):
         """
         Called if the agent cannot complete a task.
         """
-        self.logger.error(f"Task {self.current_task_id} failed: {error_message}")
+        self.logger.error("Task %s failed: %s", self.current_task_id, error_message)
+        self._record_outcome('failed')
+        self.update_task_status('failed', error_message)
+        self._release_lease(self.current_task_id)
+        self.task_queue.clear_checkpoints(self.current_task_id)
         self.is_active = False
         self.current_task_id = None
-        self.update_task_status('failed', error_message)
+
+
+    def release_task(self, message: str):
+        """
+        Called when the agent could not finish a task because of a transient error, such as the LLM backend timing out.
+        Hands the task back to the scheduler so it can be retried, and only fails it once it runs out of attempts.
+        """
+        task = self.task_queue.get(self.current_task_id)
+        if not task or (task.get('assigned_agent') and task['assigned_agent'] != self.id):
+            if task:
+                self.logger.warning("Task %s was reassigned, not releasing it", self.current_task_id)
+            else:
+                self.logger.error("Could not find task %s", self.current_task_id)
+            self._release_lease(self.current_task_id)
+            self.is_active = False
+            self.current_task_id = None
+            return
+        attempts = task.get('attempts', 0) + 1
+        if attempts >= self.max_task_attempts:
+            self.fail_task(f"{message} (gave up after {attempts} attempts)")
+            return
+        self.logger.warning("Task %s released for retry (%s/%s): %s", self.current_task_id, attempts, self.max_task_attempts, message)
+        self._record_outcome('released')
+        task['attempts'] = attempts
+        task['status'] = 'pending'
+        task['assigned_agent'] = None
+        task['queued_at'] = time.time() # queue wait of the next attempt counts from here
+        task.pop('deadline', None) # the scheduler sets a fresh deadline when it assigns the task again
+        task_id = self.current_task_id
+        self.is_active = False
+        self.current_task_id = None
+        self.task_queue.set(task_id, task)
+        self._release_lease(task_id) # checkpoints are kept for the next attempt
+        self.message_pipeline.publish('task_update', {
+            'task_id': task_id,
+            'status': task['status'],
+            'agent_id': self.id,
+            'role': task.get('role') # lets agents that pick their own tasks see it is open again
+        })
 
 
     def pause_task(self, message: str = ""):
         """
         Called when the agent gets stuck and can't proceed without input.
         """
-        self.logger.warning(f"Task {self.current_task_id} paused, {message}")
+        self.logger.warning("Task %s paused, %s", self.current_task_id, message)
+        self._record_outcome('paused')
         self.is_active = False
         self.update_task_status('paused', message)
+        self._release_lease(self.current_task_id) # a paused task waits for help, not for its lease to expire
 
 
     def update_task_status(self, status: str, output: Any = None):
@@ -76,8 +242,13 @@ class Agent(ABC):
         Updates the task status in the task queue.
         """
         task = self.task_queue.get(self.current_task_id)
-        if task:
+        if task and task.get('assigned_agent') and task['assigned_agent'] != self.id:
+            # The lease ran out and the task was handed to another agent, its result wins
+            self.logger.warning("Task %s was reassigned, dropping the '%s' update", self.current_task_id, status)
+        elif task:
             task['status'] = status
+            if status in ('completed', 'failed'):
+                task['finished_at'] = time.time()
             if output:
                 task['output'] = output
             self.task_queue.set(self.current_task_id, task)
@@ -87,23 +258,38 @@ class Agent(ABC):
                 'agent_id': self.id
             })
         else:
-             self.logger.error(f"Could not find task {self.current_task_id}")
+             self.logger.error("Could not find task %s", self.current_task_id)
+
+
+    def annotate_task(self, **fields):
+        """
+        Stores extra fields on the current task, e.g. the result of verifying its output
+        """
+        task = self.task_queue.get(self.current_task_id)
+        if task:
+            task.update(fields)
+            self.task_queue.set(self.current_task_id, task)
+        else:
+            self.logger.error("Could not find task %s", self.current_task_id)
 
 
     def request_help(self, message: str):
         """
         Requests assistance from another agent.
         """
-        self.logger.info(f"Requesting help for task {self.current_task_id}: {message}")
+        self.logger.info("Requesting help for task %s: %s", self.current_task_id, message)
         self.message_pipeline.publish("request_help", {
             "task_id": self.current_task_id,
             "agent_id": self.id,
             "message": message
         })
 
-    def create_task(self, description: str, dependencies: list = None, priority: int = 1, resource_requirements: dict = None, output: any = None):
+    def create_task(self, description: str, dependencies: list = None, priority: int = 1, resource_requirements: dict = None, output: any = None,
+                    context_id: str = None, role: str = None):
          """
-         Creates a new task and adds it to the task queue
+         Creates a new task and adds it to the task queue.
+         Pass the context_id of the parent task to let follow up stages continue the same LLM conversation.
+         Pass a role, e.g. 'TestDevAgent', to have the task scheduled to agents of that role whatever its model.
          """
          if not dependencies:
             dependencies = []
@@ -117,13 +303,41 @@ class Agent(ABC):
             'assigned_agent': None,
             'priority': priority,
             'resource_requirements': resource_requirements,
-            'output': output
+            'output': output,
+            'created_at': time.time()
         }
+         task['context_id'] = context_id or task['task_id']
+         if role:
+             task['role'] = role
          self.task_queue.set(task['task_id'], task)
-         self.logger.info(f"Created new task: {task['task_id']}")
+         self.message_pipeline.publish('task_update', {
+            'task_id': task['task_id'],
+            'status': task['status'],
+            'agent_id': self.id,
+            'role': role
+         })
+         self.logger.info("Created new task: %s", task['task_id'])
          return task['task_id']
 
 
+    def build_prompt(self, model: str, instruction: str, **kwargs) -> PromptResult:
+        """
+        Builds a prompt within the token budget of the model, see PromptBuilder.build for the arguments
+        """
+        result = self.prompt_builder.build(model, instruction, **kwargs)
+        if result.truncated:
+            self.logger.warning("Prompt for task %s truncated by ~%s tokens to fit the %s token budget of %s", self.current_task_id, result.truncated_tokens, result.budget, model)
+        return result
+
+
+    @staticmethod
+    def get_context_id(task_details: Dict[str, Any]) -> str:
+        """
+        Returns the id of the LLM conversation a task belongs to, tasks created before contexts existed use their own id
+        """
+        return task_details.get('context_id') or task_details['task_id']
+
+
     @abstractmethod
     def process_task(self, task_details):
         """
@@ -1,39 +1,109 @@
 from agent import Agent
 import time
-import uuid
+import re
+import json
+import heapq
+import queue
 from typing import Dict, Any
 from api.ollama_client import OllamaClient
 
 class ArchitectAgent(Agent):
     """
     Agent responsible for breaking down project into smaller tasks.
+
+    Takes the pending tasks meant for its role, highest priority and then largest first, and asks the LLM for a
+    JSON breakdown into any number of subtasks with dependencies between them. Every subtask becomes a code task for
+    the junior devs, depending on the code tasks of the subtasks it needs.
+
+    New tasks reach the backlog through their 'task_update' events. The whole task queue is only scanned at startup
+    and then every `rescan_interval` seconds, for tasks whose event was missed.
     """
-    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.7):
-        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold)
-        self.ollama_client = OllamaClient(logger=self.logger)
+    DECOMPOSE_INSTRUCTION = ("Break down the following task: '{description}' into as many subtasks as it needs, each small enough to code in one step. "
+                             "Respond with JSON only, in the form {\"subtasks\": [{\"id\": \"1\", \"description\": \"...\", \"depends_on\": []}]}, "
+                             "where depends_on lists the ids of the subtasks that have to be done first.")
+
+    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.7, ollama_client=None, prompt_builder=None, resource_manager=None, poll_interval=1.0,
+                 agent_id=None, lease_ttl=60.0, subtask_model='llama-2-7b', subtask_role='JuniorDevAgent', max_subtasks=20, rescan_interval=300.0):
+        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold,
+                         prompt_builder=prompt_builder, resource_manager=resource_manager,
+                         poll_interval=poll_interval, agent_id=agent_id, lease_ttl=lease_ttl)
+        self.ollama_client = ollama_client or OllamaClient(logger=self.logger) # share a client between agents so load balancing sees all requests
+        self.subtask_model = subtask_model # model and role the code tasks are scheduled with
+        self.subtask_role = subtask_role
+        self.max_subtasks = max_subtasks # a longer breakdown is cut off, it is more likely a parsing problem than a plan
+        self.backlog = [] # heap of (-priority, -description length, created_at, task_id) of the tasks to break down
+        self.queued = set() # task ids in the backlog
+        self.arrivals = queue.SimpleQueue() # ids of tasks announced as pending for this role, added to the backlog by run
+        self.rescan_interval = rescan_interval # seconds between full scans of the task queue
+        self.last_rescan = None
+        self.message_pipeline.subscribe('task_update', self.on_task_update)
 
     def run(self):
         """
-        Main loop for the Architect. Currently just a placeholder.
+        Main loop for the Architect.
         """
         self.logger.info(f"{self.name} is running...")
         while True:
-            # Check for any unassigned tasks, break up the largest one
             # This could also be set to fire on user input to start the process, or on a timer
             self.logger.debug("Checking tasks...")
-            unassigned_tasks = [task for task in self.task_queue.values() if task['assigned_agent'] is None]
-            if unassigned_tasks:
-                # Get the largest task, and break it up
-                self.logger.debug("found an unassigned task...")
-                # Sort by the length of the description, so largest tasks are at the end
-                largest_task = sorted(unassigned_tasks, key=lambda task: len(task['description']))[-1]
-                self.process_task(largest_task) # pass the largest task to the processing function
-            time.sleep(1) # Wait 1 second, not to overwhelm the system
+            task = self.next_task()
+            if task and self.task_queue.acquire_lease(task['task_id'], self.id, self.lease_ttl):
+                task['assigned_agent'] = self.id # claimed, the lease keeps other architects off it
+                self.task_queue.set(task['task_id'], task)
+                self.start_task(task['task_id'])
+                self.handle_task(task)
+            time.sleep(self.poll_interval) # Wait, not to overwhelm the system
 
+    def is_open(self, task: Dict[str, Any]) -> bool:
+        """
+        Returns true for a pending task for this role that nobody has taken
+        """
+        return task['status'] == 'pending' and not task['assigned_agent'] and task.get('role') == self.role
+
+    def on_task_update(self, data: Dict[str, Any]):
+        """
+        Notes the tasks that became pending for this role, called by the message pipeline
+        """
+        if isinstance(data, dict) and data.get('status') == 'pending' and data.get('role') == self.role:
+            self.arrivals.put(data['task_id'])
+
+    def enqueue(self, task: Dict[str, Any] | None):
+        """
+        Adds a task to the backlog if it is open and not in it yet
+        """
+        if task and task['task_id'] not in self.queued and self.is_open(task):
+            heapq.heappush(self.backlog, (-(task.get('priority') or 1), -len(task.get('description') or ''),
+                                          task.get('created_at') or 0, task['task_id']))
+            self.queued.add(task['task_id'])
+
+    def next_task(self) -> Dict[str, Any] | None:
+        """
+        Adds the announced tasks to the backlog and returns the first one that is still open.
+        Tasks taken or finished elsewhere are dropped when they come up.
+        """
+        now = time.time()
+        if self.last_rescan is None or now - self.last_rescan >= self.rescan_interval:
+            self.last_rescan = now
+            for task in self.task_queue.values():
+                self.enqueue(task)
+        while True:
+            try:
+                task_id = self.arrivals.get_nowait()
+            except queue.Empty:
+                break
+            if task_id not in self.queued:
+                self.enqueue(self.task_queue.get(task_id))
+        while self.backlog:
+            task_id = heapq.heappop(self.backlog)[-1]
+            self.queued.discard(task_id)
+            task = self.task_queue.get(task_id)
+            if task and self.is_open(task):
+                return task
+        return None
 
     def process_task(self, task_details: Dict[str, Any]):
         """
-        Example implementation to break up a large task using an LLM
+        Breaks up a large task using an LLM
         """
         if not task_details:
             self.logger.error("No task details provided for processing.")
@@ -41,50 +111,107 @@ class ArchitectAgent(Agent):
 
         if 'description' not in task_details:
              self.logger.error("Task description not provided")
+             self.fail_task("No task description given.")
              return
 
         description = task_details['description']
 
         self.logger.info(f"Breaking down task: {description}")
-         # Placeholder: Replace with actual task breakdown logic (LLM call here)
-        prompt = f"Break down the following task: '{description}' into 2 subtasks. Provide each subtask description on its own line"
         model_name = task_details.get('resource_requirements', {}).get('model', self.model) # Get model name from task, or use default
-        response = self.ollama_client.generate_text(model_name, prompt) # make ollama API call
+        prompt = self.build_prompt(model_name, self.DECOMPOSE_INSTRUCTION, description=description).prompt
+        response = self.generate_text(model_name, prompt, deadline=task_details.get('deadline'), agent=self.name) # make ollama API call
         if not response:
             self.logger.error("Could not get response from Ollama")
-            self.fail_task("Could not get response for task")
-            return
-        
-        subtask_descriptions = response.split('\n') # Split into different subtasks
-        if len(subtask_descriptions) < 2:
-            self.logger.error(f"Could not parse enough subtasks: {subtask_descriptions}")
-            self.fail_task(f"Could not parse enough subtasks: {subtask_descriptions}")
+            self.release_task("Could not get response for task") # the backend may recover, let the scheduler retry
             return
 
-        subtask_1_id = self.create_task(
-             description=subtask_descriptions[0],
-             dependencies=[task_details['task_id']],
-            priority= task_details.get('priority', 1),
-             resource_requirements={
-                 'model': self.model
-            }
-        )
-        subtask_2_id = self.create_task(
-            description=subtask_descriptions[1],
-            dependencies=[task_details['task_id']],
-            priority= task_details.get('priority', 1),
-             resource_requirements={
-                 'model': self.model
-            }
-        )
+        subtasks = self.parse_subtasks(response)
+        if not subtasks:
+            self.logger.error(f"Could not parse any subtasks: {response[:200]}")
+            self.fail_task(f"Could not parse any subtasks: {response[:200]}")
+            return
+        if len(subtasks) > self.max_subtasks:
+            self.logger.warning(f"Breakdown of task {task_details['task_id']} has {len(subtasks)} subtasks, keeping the first {self.max_subtasks}")
+            subtasks = subtasks[:self.max_subtasks]
+        ordered = self.order_subtasks(subtasks)
+        if ordered is None:
+            self.fail_task("The dependencies between the subtasks form a cycle")
+            return
 
+        task_ids = {} # subtask id from the response -> task id
+        for subtask in ordered:
+            task_ids[subtask['id']] = self.create_task(
+                description=subtask['description'],
+                dependencies=[task_details['task_id']] + [task_ids[dep] for dep in subtask['depends_on'] if dep in task_ids],
+                priority=task_details.get('priority', 1),
+                resource_requirements={
+                    'model': self.subtask_model
+                },
+                role=self.subtask_role
+            )
 
         # Set the old task as complete
         self.complete_task({
             'message': 'Task has been broken down and subtasks have been created',
-             'subtasks': [subtask_1_id, subtask_2_id]
+            'subtasks': [task_ids[subtask['id']] for subtask in subtasks]
         })
 
+    @staticmethod
+    def parse_subtasks(response: str) -> list:
+        """
+        Returns [{'id', 'description', 'depends_on'}] from the JSON of a response.
+        A response without usable JSON is read as one independent subtask per line.
+        """
+        start, end = response.find('{'), response.rfind('}')
+        try:
+            parsed = json.loads(response[start:end + 1]) if start != -1 else None
+        except ValueError:
+            parsed = None
+        items = parsed.get('subtasks') if isinstance(parsed, dict) else None
+        if not isinstance(items, list):
+            text = re.sub(r"```.*?(```|$)", "", response, flags=re.DOTALL) # code isn't a subtask
+            lines = [line.strip().lstrip('-*0123456789.) ').strip() for line in text.splitlines()]
+            return [{'id': str(index), 'description': line, 'depends_on': []} for index, line in enumerate(line for line in lines if line)]
+
+        subtasks = []
+        seen = set()
+        for index, item in enumerate(items):
+            if isinstance(item, str):
+                item = {'description': item}
+            if not isinstance(item, dict) or not str(item.get('description') or '').strip():
+                continue
+            depends_on = item.get('depends_on') or []
+            subtask_id = str(item.get('id', index))
+            if subtask_id in seen:
+                subtask_id = f"{subtask_id}-{index}" # keep both, the dependencies point at the first
+            seen.add(subtask_id)
+            subtasks.append({
+                'id': subtask_id,
+                'description': str(item['description']).strip(),
+                'depends_on': [str(dep) for dep in (depends_on if isinstance(depends_on, list) else [depends_on])]
+            })
+        return subtasks
+
+    @staticmethod
+    def order_subtasks(subtasks: list) -> list | None:
+        """
+        Returns the subtasks with every subtask after the ones it depends on, None if the dependencies form a cycle.
+        Dependencies on unknown ids are ignored.
+        """
+        by_id = {subtask['id']: subtask for subtask in subtasks}
+        waiting_on = {subtask['id']: {dep for dep in subtask['depends_on'] if dep in by_id and dep != subtask['id']} for subtask in subtasks}
+        ordered = []
+        ready = [subtask['id'] for subtask in subtasks if not waiting_on[subtask['id']]]
+        while ready:
+            subtask_id = ready.pop(0)
+            ordered.append(by_id[subtask_id])
+            for other, deps in waiting_on.items():
+                if subtask_id in deps:
+                    deps.discard(subtask_id)
+                    if not deps:
+                        ready.append(other)
+        return ordered if len(ordered) == len(by_id) else None
+
     def get_status(self):
         """
         Returns the status of the architect.
@@ -9,13 +9,21 @@ class JuniorDevAgent(Agent):
     """
     DEFAULT_SYSTEM_PROMPT = "You are a python software developer responsible for successfully completing small coding subtasks.\
         Complete your task to the best of your ability and provide a confidence level from 0-1 that your response will accomplish the task."
-    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.6, system_prompt=None):
-        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold)
-        self.ollama_client = OllamaClient(logger=self.logger) # create a new instance of ollama client
+    # (role, model) of the stages that check the code, side by side, a model of None is the model the code was
+    # generated with. Only a stage on that model continues the LLM conversation instead of sending the code again,
+    # so the tests do by default while the review gets a second opinion from a bigger model.
+    DEFAULT_FOLLOW_UPS = (('SeniorDevAgent', 'gpt-4'), ('TestDevAgent', None))
+    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.6, system_prompt=None, ollama_client=None, prompt_builder=None, resource_manager=None, poll_interval=1.0,
+                 agent_id=None, lease_ttl=60.0, follow_ups=None):
+        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold,
+                         prompt_builder=prompt_builder, resource_manager=resource_manager,
+                         poll_interval=poll_interval, agent_id=agent_id, lease_ttl=lease_ttl)
+        self.ollama_client = ollama_client or OllamaClient(logger=self.logger) # share a client between agents so load balancing sees all requests
         if system_prompt:
             self.system_prompt = system_prompt
         else:
             self.system_prompt = self.DEFAULT_SYSTEM_PROMPT
+        self.follow_ups = self.DEFAULT_FOLLOW_UPS if follow_ups is None else follow_ups
 
     def run(self):
         """
@@ -30,8 +38,8 @@ class JuniorDevAgent(Agent):
                 # Get the first unassigned task
                 task = unassigned_tasks[0]
                 self.start_task(task['task_id'])
-                self.process_task(task) # pass the task to the processor
-            time.sleep(1)
+                self.handle_task(task) # pass the task to the processor
+            time.sleep(self.poll_interval)
 
     def process_task(self, task_details: Dict[str, Any]):
         """
@@ -49,21 +57,43 @@ class JuniorDevAgent(Agent):
         description = task_details['description']
         self.logger.info(f"Generating code for: {description[:30]}...") # log a short version of the description
         # Placeholder: Replace with actual code generation logic (LLM call here)
-        prompt = f"Generate python code to '{description}'. Respond with code only and make sure it is surrounded in triple backticks." # a simple prompt for now
         model_name = task_details.get('resource_requirements', {}).get('model', self.model) # Get model name from task, or use default
-        code = self.ollama_client.generate_text(model_name, prompt) # make ollama API call
+        prompt = self.build_prompt(model_name, "Generate python code to '{description}'. Respond with code only and make sure it is surrounded in triple backticks.",
+                                   system=self.system_prompt, description=description).prompt # a simple prompt for now
+        context_id = self.get_context_id(task_details)
+        handed_over = False # the conversation is released by the follow up stages once they are created
+        try:
+            code = self.generate_text(model_name, prompt, deadline=task_details.get('deadline'), agent=self.name,
+                                      system=self.system_prompt, context_key=context_id) # make ollama API call
 
-        if not code:
-             self.logger.error("Could not get a response from the ollama API")
-             self.fail_task("Could not generate code")
-             return
-        
-        confidence = 0.7 # Set confidence for this agent, in a real situation this would come from the model (can be determined by parsing the response as well)
-        if confidence >= self.confidence_threshold:
-            self.complete_task({'code': code}) # if confident, then pass on the code
-        else:
-             self.request_help("Confidence is low, I think this code needs help")
-             self.pause_task("Waiting for help generating code")
+            if not code:
+                 self.logger.error("Could not get a response from the ollama API")
+                 self.release_task("Could not generate code") # the backend may recover, let the scheduler retry
+                 return
+
+            confidence = 0.7 # Set confidence for this agent, in a real situation this would come from the model (can be determined by parsing the response as well)
+            if confidence >= self.confidence_threshold:
+                # Review and tests only need the code, so they are siblings that run at the same time.
+                # Each of them releases the conversation when done, it is kept until the last one finished.
+                if self.follow_ups:
+                    self.ollama_client.retain_context(context_id, len(self.follow_ups))
+                    handed_over = True
+                follow_up_ids = [self.create_task(
+                    description=description,
+                    dependencies=[task_details['task_id']],
+                    priority=task_details.get('priority', 1),
+                    resource_requirements={'model': model or model_name},
+                    output={'code': code},
+                    context_id=context_id,
+                    role=role
+                ) for role, model in self.follow_ups]
+                self.complete_task({'code': code, 'follow_ups': follow_up_ids}) # if confident, then pass on the code
+            else:
+                 self.request_help("Confidence is low, I think this code needs help")
+                 self.pause_task("Waiting for help generating code")
+        finally:
+            if not handed_over:
+                self.ollama_client.release_context(context_id) # no stage continues the conversation
 
 
 
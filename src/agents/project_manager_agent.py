@@ -1,5 +1,6 @@
 from agent import Agent
 import time
+from collections import deque
 from typing import Dict, Any
 import logging
 
@@ -9,13 +10,18 @@ class ProjectManagerAgent(Agent):
     Agent responsible for monitoring project status and providing updates.
     """
     DEFAULT_SYSTEM_PROMPT = ""
-    def __init__(self, name, model, message_pipeline, task_queue, resource_manager, logger=None, confidence_threshold=0.9, system_prompt=None):
-        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold)
-        self.resource_manager = resource_manager # Add the resource manager
+    def __init__(self, name, model, message_pipeline, task_queue, resource_manager, logger=None, confidence_threshold=0.9, system_prompt=None,
+                 reconcile_interval: float = 300.0, throughput_window: int = 60, agent_id: str = None):
+        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold,
+                         resource_manager=resource_manager, agent_id=agent_id) # Add the resource manager
         if system_prompt:
             self.system_prompt = system_prompt
         else:
             self.system_prompt = self.DEFAULT_SYSTEM_PROMPT
+        self.reconcile_interval = reconcile_interval # seconds between checks of the status counts against a full scan
+        self.last_reconcile = 0.0
+        self.progress = deque(maxlen=throughput_window) # (time, finished tasks) of recent reports, for throughput and ETA
+        self.last_report = {}
 
     def run(self):
         """
@@ -33,13 +39,34 @@ class ProjectManagerAgent(Agent):
         if task_details:
             self.logger.warning("Project manager cannot process a task assigned to it, please check config")
 
-        total_tasks = len(self.task_queue)
-        pending_tasks = len([task for task in self.task_queue.values() if task['status'] == 'pending'])
-        in_progress_tasks = len([task for task in self.task_queue.values() if task['status'] == 'in_progress'])
-        completed_tasks = len([task for task in self.task_queue.values() if task['status'] == 'completed'])
-        failed_tasks = len([task for task in self.task_queue.values() if task['status'] == 'failed'])
-        paused_tasks = len([task for task in self.task_queue.values() if task['status'] == 'paused'])
-        
+        now = time.time()
+        if now - self.last_reconcile >= self.reconcile_interval:
+            drift = self.task_queue.reconcile() # the first report also picks up tasks written before the counts existed
+            if drift:
+                self.logger.warning(f"Task status counts were off by {drift}, corrected from a full scan")
+            self.last_reconcile = now
+        counts = self.task_queue.status_counts()
+        total_tasks = sum(counts.values())
+        pending_tasks = counts.get('pending', 0)
+        in_progress_tasks = counts.get('in_progress', 0)
+        completed_tasks = counts.get('completed', 0)
+        failed_tasks = counts.get('failed', 0)
+        paused_tasks = counts.get('paused', 0)
+
+        # Throughput from how many tasks finished since the oldest report still in the window
+        finished = completed_tasks + failed_tasks
+        self.progress.append((now, finished))
+        first_time, first_finished = self.progress[0]
+        throughput = (finished - first_finished) / (now - first_time) if now > first_time else None
+        remaining = total_tasks - finished
+        eta = remaining / throughput if throughput and throughput > 0 else None
+        self.last_report = {
+            'status_counts': counts,
+            'total': total_tasks,
+            'throughput_per_minute': throughput * 60 if throughput is not None else None,
+            'eta_seconds': eta
+        }
+
         resources = self.resource_manager.get_status()
 
         status_report = f"""
@@ -50,13 +77,31 @@ class ProjectManagerAgent(Agent):
         Completed Tasks: {completed_tasks}
         Failed Tasks: {failed_tasks}
         Paused Tasks: {paused_tasks}
-        API calls made: {resources['api_calls_made']}/{resources['max_api_calls']}
+        Throughput: {f"{throughput * 60:.1f} tasks/min" if throughput is not None else "measuring"}
+        ETA: {f"{eta / 60:.1f} min for {remaining} tasks" if eta is not None else "unknown"}
+        LLM calls rate limited: {resources['rate_limits'].get('throttled', 0)} throttled, {resources['rate_limits'].get('rejected', 0)} rejected
         Total Memory: {resources['total_memory']:.2f} GB
-        Total VRAM: {resources['total_vram']:.2f} GB
+        Total VRAM: {resources['total_vram'] or 0:.2f} GB
         Available resources: {resources['available_resources']}
+        Usage by role: {self.format_role_usage(resources['roles'])}
         """
         self.logger.info(status_report)
 
+    @staticmethod
+    def format_role_usage(roles: Dict[str, Any]) -> str:
+        """
+        One line per role with the average cost of its recent tasks
+        """
+        lines = []
+        for role, summary in sorted(roles.items()):
+            averages = summary.get('averages', {})
+            if not averages:
+                continue
+            lines.append(f"{role}: {summary['tasks']} tasks, avg wall {averages['wall_time']:.1f}s, cpu {averages['cpu_time']:.2f}s, "
+                         f"llm wait {averages['llm_wait']:.1f}s, queue wait {averages['queue_wait']:.1f}s, "
+                         f"tokens {averages['prompt_tokens']:.0f} in / {averages['completion_tokens']:.0f} out")
+        return "\n        ".join([""] + lines) if lines else "none yet"
+
     def get_status(self):
         """
         Returns the status of the project manager.
@@ -66,5 +111,6 @@ class ProjectManagerAgent(Agent):
             'name': self.name,
             'model': self.model,
             'current_task_id': self.current_task_id,
-            'is_active': self.is_active
+            'is_active': self.is_active,
+            'project': self.last_report
         }
\ No newline at end of file
@@ -11,9 +11,12 @@ class SeniorDevAgent(Agent):
     DEFAULT_SYSTEM_PROMPT = "You are an expert software developer specialized in the review and optimization of code. After assessing \
         and/or improving the code if needed, provide a confidence score from 0-1 that the code will accomplish its purpose."
     
-    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold = 0.8, system_prompt = None):
-        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold)
-        self.ollama_client = OllamaClient(logger=self.logger)
+    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold = 0.8, system_prompt = None, ollama_client=None, prompt_builder=None, resource_manager=None, poll_interval=1.0,
+                 agent_id=None, lease_ttl=60.0):
+        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold,
+                         prompt_builder=prompt_builder, resource_manager=resource_manager,
+                         poll_interval=poll_interval, agent_id=agent_id, lease_ttl=lease_ttl)
+        self.ollama_client = ollama_client or OllamaClient(logger=self.logger) # share a client between agents so load balancing sees all requests
         if system_prompt:
             self.system_prompt = system_prompt
         else:
@@ -32,8 +35,8 @@ class SeniorDevAgent(Agent):
                 # Get the first task
                 task = unreviewed_tasks[0]
                 self.start_task(task['task_id'])
-                self.process_task(task)
-            time.sleep(1)
+                self.handle_task(task)
+            time.sleep(self.poll_interval)
 
     def process_task(self, task_details: Dict[str, Any]):
         """
@@ -60,30 +63,29 @@ class SeniorDevAgent(Agent):
         self.logger.info(f"Reviewing code for task {task_details['task_id']}: {description[:30]}...") # Log the task id being worked on, with a shorter version of the description
         # Placeholder: Replace with actual code review logic (LLM call here)
         model_name = task_details.get('resource_requirements', {}).get('model', self.model) # Get model name from task, or use default
-        prompt = f"{self.system_prompt} Review the following code for '{description}'.  Respond with what to improve, optimize or if the code is good: {code}"
-        feedback = self.ollama_client.generate_text(model_name, prompt) # make ollama API call
-        if not feedback:
-            self.logger.error("Could not get a response from the ollama API")
-            self.fail_task("Could not get a response for code review")
-            return
-        # If good enough confidence
-        confidence = 0.9 # Set confidence for this agent
-        if confidence >= self.confidence_threshold:
-             # create a test task
-             self.logger.info("Confidence is high, creating test task")
-             test_task_id = self.create_task(
-                 description = f"Create unit tests for '{description[:30]}'",
-                 dependencies = [task_details['task_id']],
-                 priority = task_details.get('priority', 1),
-                 resource_requirements={
-                     'model': 'llama-2-13b'
-                 },
-                output = code # send along the code so the test dev agent can read this
-             )
-             self.complete_task({'feedback': feedback, 'test_task_id': test_task_id})
-        else:
-             self.request_help("Confidence is low, I think this needs more help")
-             self.pause_task("Waiting for help with code review.")
+        context_id = self.get_context_id(task_details)
+        # Refers to the code in the conversation of the junior dev, the client sends the full prompt when it has none
+        prompt = self.build_prompt(model_name, "Review the code above for '{description}'.  Respond with what to improve, optimize or if the code is good.",
+                                   description=description).prompt
+        full_prompt = self.build_prompt(model_name, "Review the following code for '{description}'.  Respond with what to improve, optimize or if the code is good:",
+                                        code=code, system=self.system_prompt, description=description).prompt
+        try:
+            feedback = self.generate_text(model_name, prompt, deadline=task_details.get('deadline'), agent=self.name,
+                                          system=self.system_prompt, context_key=context_id, fallback_prompt=full_prompt) # make ollama API call
+            if not feedback:
+                self.logger.error("Could not get a response from the ollama API")
+                self.release_task("Could not get a response for code review") # the backend may recover, let the scheduler retry
+                return
+            # If good enough confidence
+            confidence = 0.9 # Set confidence for this agent
+            if confidence >= self.confidence_threshold:
+                 # the tests of the code are generated alongside the review, see JuniorDevAgent.follow_ups
+                 self.complete_task({'feedback': feedback})
+            else:
+                 self.request_help("Confidence is low, I think this needs more help")
+                 self.pause_task("Waiting for help with code review.")
+        finally:
+            self.ollama_client.release_context(context_id) # the conversation is kept until the test stage is done too
 
 
     def get_status(self):
@@ -2,6 +2,8 @@ from agent import Agent
 import time
 from typing import Dict, Any
 from api.ollama_client import OllamaClient
+from utils.prompt_builder import extract_code
+from core.test_runner import CANDIDATE_MODULE
 
 
 class TestDevAgent(Agent):
@@ -11,13 +13,17 @@ class TestDevAgent(Agent):
     DEFAULT_SYSTEM_PROMPT = "You are a highly experienced software developer with expertise in developing unit and system tests for python code.\
         Provide a confidence score from 0-1 that the code will accomplish its purpose."
     
-    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.7, system_prompt = None):
-        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold)
-        self.ollama_client = OllamaClient(logger=self.logger)
+    def __init__(self, name, model, message_pipeline, task_queue, logger=None, confidence_threshold=0.7, system_prompt = None, ollama_client=None, prompt_builder=None, resource_manager=None, poll_interval=1.0,
+                 agent_id=None, lease_ttl=60.0, test_runner=None):
+        super().__init__(name, model, message_pipeline, task_queue, logger=logger, confidence_threshold=confidence_threshold,
+                         prompt_builder=prompt_builder, resource_manager=resource_manager,
+                         poll_interval=poll_interval, agent_id=agent_id, lease_ttl=lease_ttl)
+        self.ollama_client = ollama_client or OllamaClient(logger=self.logger) # share a client between agents so load balancing sees all requests
         if system_prompt:
             self.system_prompt = system_prompt
         else:
             self.system_prompt = self.DEFAULT_SYSTEM_PROMPT
+        self.test_runner = test_runner # runs the generated tests against the code, without it confidence is a fixed guess
 
     def run(self):
         """
@@ -32,8 +38,8 @@ class TestDevAgent(Agent):
                 # Get the first task
                 task = untested_tasks[0]
                 self.start_task(task['task_id'])
-                self.process_task(task)
-            time.sleep(1)
+                self.handle_task(task)
+            time.sleep(self.poll_interval)
 
     def process_task(self, task_details: Dict[str, Any]):
         """
@@ -56,21 +62,53 @@ class TestDevAgent(Agent):
         description = task_details['description']
         self.logger.info(f"Generating test for {description[:30]}...")  # Log the task id being worked on, with a shorter version of the description
          # Placeholder: Replace with actual test generation logic (LLM call here)
-        prompt = f"{self.system_prompt} Create python unit test using pytest for '{description}'. Make sure the tests can be run with pytest, and return the tests within triple backticks: {code}"
         model_name = task_details.get('resource_requirements', {}).get('model', self.model) # Get model name from task, or use default
-        test_code = self.ollama_client.generate_text(model_name, prompt) # make ollama API call
+        context_id = self.get_context_id(task_details)
+        # Refers to the code in the conversation of the junior dev, the client sends the full prompt when it has none
+        prompt = self.build_prompt(model_name, "Create python unit test using pytest for '{description}' for the code above. Make sure the tests can be run with pytest, "
+                                   f"import the code from the module '{CANDIDATE_MODULE}', and return the tests within triple backticks.",
+                                   description=description).prompt
+        full_prompt = self.build_prompt(model_name, "Create python unit test using pytest for '{description}'. Make sure the tests can be run with pytest, "
+                                        f"import the code from the module '{CANDIDATE_MODULE}', and return the tests within triple backticks:",
+                                        code=code, system=self.system_prompt, description=description).prompt
+        try:
+            test_code = self.generate_text(model_name, prompt, deadline=task_details.get('deadline'), agent=self.name,
+                                           system=self.system_prompt, context_key=context_id, fallback_prompt=full_prompt) # make ollama API call
+            if not test_code:
+                self.logger.error("Could not get a response from the ollama API")
+                self.release_task("Could not generate tests") # the backend may recover, let the scheduler retry
+                return
+            if self.test_runner:
+                result = self.test_runner.run(extract_code(self.code_of(code)), extract_code(test_code))
+                self.annotate_task(test_result=result)
+                if result['status'] == 'error':
+                    self.release_task(f"Could not run the tests: {result['output'][-200:]}") # the runner failed, not the tests
+                    return
+                ran = result['tests_passed'] + result['tests_failed'] + result['tests_errored']
+                confidence = result['tests_passed'] / ran if result['status'] in ('passed', 'failed') and ran else 0.0 # share of tests passing
+            else:
+                result = None
+                confidence = 0.8 # Set confidence for this agent, in a real situation this would come from the model
 
-        if not test_code:
-            self.logger.error("Could not get a response from the ollama API")
-            self.fail_task("Could not generate tests")
-            return
-        confidence = 0.8 # Set confidence for this agent, in a real situation this would come from the model
+            if confidence >= self.confidence_threshold:
+                self.complete_task({'tests': test_code, 'passed': result['passed'] if result else None}) # if confident, then pass on the tests
+            else:
+                if result:
+                    self.request_help(f"Tests {result['status']}, {result['tests_passed']} passed and {result['tests_failed']} failed:\n{result['output'][-1000:]}")
+                else:
+                    self.request_help("Confidence is low, I think these tests need help")
+                self.pause_task("Waiting for help with tests")
+        finally:
+            self.ollama_client.release_context(context_id) # the conversation is kept until the review is done too
 
-        if confidence >= self.confidence_threshold:
-            self.complete_task({'tests': test_code}) # if confident, then pass on the tests
-        else:
-            self.request_help("Confidence is low, I think these tests need help")
-            self.pause_task("Waiting for help with tests")
+    @staticmethod
+    def code_of(output) -> str:
+        """
+        The code under test from the output of the task before, {'code': ...} from a junior dev or plain text
+        """
+        if isinstance(output, dict):
+            return output.get('code') or ''
+        return output or ''
 
 
     def get_status(self):
@@ -83,5 +121,6 @@ class TestDevAgent(Agent):
             'model': self.model,
             'current_task_id': self.current_task_id,
             'is_active': self.is_active,
-            'ollama_client': self.ollama_client.get_status()
+            'ollama_client': self.ollama_client.get_status(),
+            'test_runner': self.test_runner.get_status() if self.test_runner else None
         }
\ No newline at end of file
@@ -0,0 +1,152 @@
+import math
+import threading
+from collections import deque
+from typing import Dict, Any
+
+NANOSECONDS = 1e9
+
+def _percentile(sorted_values: list, percent: float) -> float | None:
+    """
+    Nearest rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RollingLLMStats:
+    """
+    Rolling statistics for a group of LLM calls (one model, or one agent).
+
+    Totals are kept since start, latency percentiles and token rates over the last `window` calls.
+    """
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0) # upper bounds in seconds
+
+    def __init__(self, window: int = 1000, cold_load_threshold: float = 0.5):
+        self.window = window
+        self.cold_load_threshold = cold_load_threshold # a load_duration above this means the model had to be loaded
+        self.calls = 0
+        self.failures = 0
+        self.cold_loads = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1) # last bucket is +Inf
+        self.latencies = deque(maxlen=window)
+        self.eval_rates = deque(maxlen=window) # completion tokens/sec
+        self.prompt_eval_rates = deque(maxlen=window) # prompt tokens/sec
+        self.prompt_eval_times = deque(maxlen=window)
+        self.load_times = deque(maxlen=window)
+
+    def record(self, latency: float, metrics: Dict[str, Any]):
+        """
+        Records a successful call, `metrics` is the metadata of the final Ollama response
+        """
+        self.calls += 1
+        self.latencies.append(latency)
+        for i, bound in enumerate(self.LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_histogram[i] += 1
+                break
+        else:
+            self.latency_histogram[-1] += 1
+
+        eval_count = metrics.get('eval_count') or 0
+        eval_duration = (metrics.get('eval_duration') or 0) / NANOSECONDS
+        prompt_eval_count = metrics.get('prompt_eval_count') or 0
+        prompt_eval_duration = (metrics.get('prompt_eval_duration') or 0) / NANOSECONDS
+        load_duration = (metrics.get('load_duration') or 0) / NANOSECONDS
+        self.completion_tokens += eval_count
+        self.prompt_tokens += prompt_eval_count
+        if eval_duration > 0:
+            self.eval_rates.append(eval_count / eval_duration)
+        if prompt_eval_duration > 0:
+            self.prompt_eval_rates.append(prompt_eval_count / prompt_eval_duration)
+        self.prompt_eval_times.append(prompt_eval_duration)
+        self.load_times.append(load_duration)
+        if load_duration > self.cold_load_threshold:
+            self.cold_loads += 1
+
+    def record_failure(self):
+        """
+        Records a failed call
+        """
+        self.failures += 1
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns a summary of the statistics
+        """
+        latencies = sorted(self.latencies)
+
+        def mean(values):
+            return sum(values) / len(values) if values else None
+
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'cold_loads': self.cold_loads,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'tokens_per_sec': mean(self.eval_rates),
+            'prompt_tokens_per_sec': mean(self.prompt_eval_rates),
+            'avg_prompt_eval_time': mean(self.prompt_eval_times),
+            'avg_load_time': mean(self.load_times),
+            'latency_p50': _percentile(latencies, 50),
+            'latency_p95': _percentile(latencies, 95),
+            'latency_p99': _percentile(latencies, 99),
+            'latency_histogram': {
+                **{f'le_{bound}': count for bound, count in zip(self.LATENCY_BUCKETS, self.latency_histogram)},
+                'le_inf': self.latency_histogram[-1]
+            }
+        }
+
+
+class LLMTelemetry:
+    """
+    Thread safe collection of LLM call statistics, grouped per model and per agent.
+    """
+    def __init__(self, window: int = 1000, cold_load_threshold: float = 0.5):
+        self.window = window
+        self.cold_load_threshold = cold_load_threshold
+        self.models: Dict[str, RollingLLMStats] = {}
+        self.agents: Dict[str, RollingLLMStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, group: Dict[str, RollingLLMStats], key: str) -> RollingLLMStats:
+        """
+        Gets or creates the stats for a key, must be called with the lock held
+        """
+        stats = group.get(key)
+        if stats is None:
+            stats = RollingLLMStats(self.window, self.cold_load_threshold)
+            group[key] = stats
+        return stats
+
+    def record_call(self, model: str, latency: float, metrics: Dict[str, Any], agent: str = None):
+        """
+        Records a successful call to a model, optionally attributed to an agent
+        """
+        with self._lock:
+            self._stats(self.models, model).record(latency, metrics)
+            if agent:
+                self._stats(self.agents, agent).record(latency, metrics)
+
+    def record_failure(self, model: str, agent: str = None):
+        """
+        Records a failed call to a model
+        """
+        with self._lock:
+            self._stats(self.models, model).record_failure()
+            if agent:
+                self._stats(self.agents, agent).record_failure()
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the statistics of every model and agent
+        """
+        with self._lock:
+            return {
+                'models': {model: stats.get_status() for model, stats in self.models.items()},
+                'agents': {agent: stats.get_status() for agent, stats in self.agents.items()}
+            }
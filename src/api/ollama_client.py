@@ -1,77 +1,750 @@
 import json
+import math
+import time
+import random
+import threading
 import requests
-import logging
-from typing import Dict, Any
+from collections import OrderedDict
+from typing import Dict, Any, List
+from api.llm_telemetry import LLMTelemetry
+from core.rate_limiter import RateLimiter
+from core.metrics import LLM_CALL_TIME, LLM_TOKENS
+from utils.logger import get_logger
+
+class CircuitBreaker:
+    """
+    Per host circuit breaker.
+
+    The breaker opens after `failure_threshold` consecutive failures and fails requests fast for `recovery_time`
+    seconds. After that it goes half open and lets a single probe request through, closing again if the probe succeeds.
+    Not thread safe on its own, the owning client guards it with its lock.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 3, recovery_time: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def can_attempt(self, now: float) -> bool:
+        """
+        Returns true if a request may be sent now, does not reserve anything
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.recovery_time
+        return not self.probe_in_flight
+
+    def on_attempt(self, now: float):
+        """
+        Called when a request is sent through the breaker
+        """
+        if self.state == self.OPEN and now - self.opened_at >= self.recovery_time:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.probe_in_flight = True
+
+    def record_success(self):
+        """
+        Records a successful request, closing the breaker
+        """
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def cancel_attempt(self):
+        """
+        Called when a request was reserved but never sent, frees the probe slot without recording an outcome
+        """
+        self.probe_in_flight = False
+
+    def record_failure(self, now: float) -> bool:
+        """
+        Records a failed request, returns true if the breaker has just opened
+        """
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self.opened_at = now
+            return True
+        return False
+
+
+class RetryBudget:
+    """
+    Global budget that limits retries to a fraction of the overall request rate.
+
+    Each request deposits `ratio` tokens, each retry withdraws one. A floor of `min_tokens` keeps low traffic
+    retryable, and the cap stops a quiet period from banking up a retry storm.
+    """
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.tokens = max(min_tokens, 0.0)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """
+        Deposits tokens for a first attempt
+        """
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """
+        Withdraws a token for a retry, returns false if the budget is exhausted
+        """
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the remaining retry budget
+        """
+        with self._lock:
+            return {'tokens': self.tokens, 'ratio': self.ratio, 'max_tokens': self.max_tokens}
+
+
+class OllamaHost:
+    """
+    Tracks the state of a single Ollama backend host.
+    """
+    def __init__(self, url: str, models: List[str] = None, failure_threshold: int = 3, recovery_time: float = 30.0):
+        self.url = url.rstrip('/')
+        self.models = set(models or []) # models this host is configured to serve, empty means any model
+        self.loaded_models = set() # models the host currently has loaded in memory
+        self.outstanding = 0 # number of requests in flight
+        self.total_requests = 0
+        self.total_failures = 0
+        self.breaker = CircuitBreaker(failure_threshold, recovery_time)
+        self.avg_latency = None # exponentially weighted moving average, in seconds
+        self.last_latency = None
+        self.last_health_check = None
+        self.healthy = True # result of the last health check, a host that fails it is skipped while another is up
+
+    def serves(self, model: str) -> bool:
+        """
+        Returns true if the host is configured to serve the model
+        """
+        return not self.models or model in self.models
+
+    def is_available(self, now: float) -> bool:
+        """
+        Returns true if the circuit breaker of the host lets a request through
+        """
+        return self.breaker.can_attempt(now)
+
+    def record_latency(self, latency: float, alpha: float = 0.2):
+        """
+        Updates the moving average latency of the host
+        """
+        self.last_latency = latency
+        if self.avg_latency is None:
+            self.avg_latency = latency
+        else:
+            self.avg_latency = alpha * latency + (1 - alpha) * self.avg_latency
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the load and latency of the host
+        """
+        return {
+            'url': self.url,
+            'models': sorted(self.models),
+            'loaded_models': sorted(self.loaded_models),
+            'outstanding': self.outstanding,
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+            'consecutive_failures': self.breaker.consecutive_failures,
+            'circuit_state': self.breaker.state,
+            'avg_latency': self.avg_latency,
+            'last_latency': self.last_latency,
+            'last_health_check': self.last_health_check,
+            'healthy': self.healthy
+        }
+
+
+class ConversationContexts:
+    """
+    Bounded LRU store of Ollama context tokens per (context key, model).
+
+    A context key is usually the id of the task a conversation belongs to. The host that processed the context is
+    remembered too, since only that host has the prefix cached. Contexts are per model, a stage only continues the
+    conversation of an earlier stage that ran on the same model.
+
+    Stages that run side by side hold a key with retain, the contexts are dropped once the last holder releases it.
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._holders = {} # key -> stages still using its contexts
+        self._lock = threading.Lock()
+
+    def get(self, key: str, model: str) -> Dict[str, Any] | None:
+        """
+        Returns the stored context for a key and model, or None
+        """
+        with self._lock:
+            entry = self._entries.get((key, model))
+            if entry is not None:
+                self._entries.move_to_end((key, model))
+            return entry
+
+    def put(self, key: str, model: str, context: List[int], host_url: str):
+        """
+        Stores the context returned by a call, evicting the least recently used entry when full
+        """
+        with self._lock:
+            self._entries[(key, model)] = {'context': context, 'host': host_url}
+            self._entries.move_to_end((key, model))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def retain(self, key: str, holders: int = 1):
+        """
+        Registers stages that will use the contexts of a key, each of them releases it once
+        """
+        with self._lock:
+            self._holders[key] = self._holders.get(key, 0) + holders
+            while len(self._holders) > self.max_entries: # holders that never released, forget the oldest
+                del self._holders[next(iter(self._holders))]
+
+    def release(self, key: str) -> bool:
+        """
+        Releases one holder of a key, once none are left the contexts of the key are dropped for every model.
+        Returns true if they were dropped.
+        """
+        with self._lock:
+            holders = self._holders.get(key, 0) - 1
+            if holders > 0:
+                self._holders[key] = holders
+                return False
+            self._holders.pop(key, None)
+            for entry_key in [k for k in self._entries if k[0] == key]:
+                del self._entries[entry_key]
+            return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class _GenerateCall:
+    """
+    State of a single generate_text call across its attempts.
+    """
+    def __init__(self, data: Dict[str, Any], deadline: float, agent: str = None, context_key: str = None, preferred_host: str = None,
+                 usage: Dict[str, Any] = None, wait_for_rate_limit: bool = True):
+        self.data = data
+        self.model = data['model']
+        self.stream = data['stream']
+        self.deadline = deadline
+        self.agent = agent
+        self.context_key = context_key
+        self.preferred_host = preferred_host # host that already processed the context of this call
+        self.usage = usage # caller's accounting dict, token counts are added to it
+        self.wait_for_rate_limit = wait_for_rate_limit
+        self.rate_limit_names = [] # rate limits the current attempt was taken from
+        self.reserved_tokens = 0 # tokens estimated and taken from the rate limits for the current attempt
+        self.started = time.time()
+
+
+class _RetryableError(Exception):
+    """
+    Raised internally for failures that are worth retrying on another attempt.
+    """
+    pass
+
 
 class OllamaClient:
     """
     A client for interacting with the Ollama API.
+
+    Requests are load balanced over one or more hosts. Each request is routed to the least loaded healthy host
+    that serves the model, preferring hosts that already have the model loaded. Every call is bounded by a deadline,
+    transient failures are retried with jittered backoff while the global retry budget allows, and a circuit breaker
+    per host fails requests fast while a backend is unhealthy.
+
+    With a rate limiter every request first takes from the limits of its model ('model:<name>') and of the host it
+    is sent to ('backend:<url>'), waiting for them or failing right away as the caller chooses.
     """
-    def __init__(self, host='http://localhost:11434', logger=None):
-        self.host = host
-        if logger:
-             self.logger = logger
-        else:
-             self.logger = logging.getLogger("ollama_client")
-             self.logger.setLevel(logging.DEBUG)
-             ch = logging.StreamHandler()
-             formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-             ch.setFormatter(formatter)
-             self.logger.addHandler(ch)
+    def __init__(self, host='http://localhost:11434', logger=None, hosts: List[Any] = None, health_check_interval: float = 10.0,
+                 max_failures: int = 3, ejection_time: float = 30.0, affinity_slack: int = 2, default_timeout: float = 300.0,
+                 connect_timeout: float = 5.0, max_retries: int = 2, backoff_base: float = 0.5, backoff_cap: float = 10.0,
+                 retry_budget: RetryBudget = None, telemetry: LLMTelemetry = None, max_contexts: int = 256,
+                 rate_limiter: RateLimiter = None, expected_completion_tokens: int = 256):
+        self.logger = get_logger("ollama_client", logger)
+        self.hosts = []
+        for host_config in hosts or [host]:
+            if isinstance(host_config, dict):
+                self.hosts.append(OllamaHost(host_config['url'], host_config.get('models'), max_failures, ejection_time))
+            else:
+                self.hosts.append(OllamaHost(host_config, None, max_failures, ejection_time))
+        self.host = self.hosts[0].url # the primary host
+        self.health_check_interval = health_check_interval
+        self.affinity_slack = affinity_slack # extra outstanding requests tolerated to stay on a host with the model loaded
+        self.default_timeout = default_timeout # seconds allowed for a call when no deadline is given
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_budget = retry_budget or RetryBudget()
+        self.fast_failures = 0 # calls rejected because every circuit was open
+        self.telemetry = telemetry or LLMTelemetry()
+        self.contexts = ConversationContexts(max_contexts)
+        self.rate_limiter = rate_limiter
+        self.expected_completion_tokens = expected_completion_tokens # completion size assumed when taking tokens before a call
+        self.rate_limited = 0 # calls given up because of the rate limits
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._health_stop = threading.Event()
+
+    def _select_host(self, model: str, exclude: set = None, preferred: str = None, reserve: bool = True) -> OllamaHost | None:
+        """
+        Picks the host for a request and reserves a slot on it, or only picks it when `reserve` is false.
+        Least outstanding requests, with affinity for the preferred host (which holds the conversation context)
+        and then for hosts that already have the model loaded.
+        Returns None if the circuit of every host serving the model is open.
+        """
+        with self._lock:
+            now = time.time()
+            serving = [h for h in self.hosts if h.serves(model)] or self.hosts
+            candidates = [h for h in serving if h.is_available(now)]
+            candidates = [h for h in candidates if h.healthy] or candidates # hosts down at the last health check go last
+            if exclude and len(candidates) > 1:
+                # Retry on a different host when there is one
+                candidates = [h for h in candidates if h.url not in exclude] or candidates
+            if not candidates:
+                return None
+
+            def load_key(h):
+                return (h.outstanding, h.avg_latency if h.avg_latency is not None else 0.0)
+
+            best = min(candidates, key=load_key)
+            loaded = [h for h in candidates if model in h.loaded_models]
+            if loaded:
+                best_loaded = min(loaded, key=load_key)
+                if best_loaded.outstanding <= best.outstanding + self.affinity_slack:
+                    best = best_loaded
+            for h in candidates:
+                if h.url == preferred and h.outstanding <= best.outstanding + self.affinity_slack:
+                    best = h
+            if reserve:
+                self._take_slot(best, now)
+            return best
 
-    def generate_text(self, model: str, prompt: str, stream: bool = False) -> str | None:
+    def _reserve_host(self, host: OllamaHost) -> bool:
+        """
+        Reserves a slot on a host picked earlier, returns false if its circuit no longer lets a request through
+        """
+        with self._lock:
+            now = time.time()
+            if not host.is_available(now):
+                return False
+            self._take_slot(host, now)
+            return True
+
+    @staticmethod
+    def _take_slot(host: OllamaHost, now: float):
+        """
+        Counts a request as outstanding on a host. Must be called with the lock held.
+        """
+        host.breaker.on_attempt(now)
+        host.outstanding += 1
+        host.total_requests += 1
+
+    def _release_host(self, host: OllamaHost, model: str, started: float, success: bool, served: bool = True):
+        """
+        Releases the slot reserved on a host and records the outcome of the request.
+        `served` is false when the host answered but rejected the request, so the model is not known to be loaded.
+        """
+        with self._lock:
+            host.outstanding -= 1
+            if success:
+                host.breaker.record_success()
+                if served:
+                    host.record_latency(time.time() - started)
+                    host.loaded_models.add(model) # Ollama keeps the model loaded after serving it
+            else:
+                self._record_failure(host)
+
+    def _cancel_host(self, host: OllamaHost):
+        """
+        Releases a slot reserved on a host for a request that was never sent
+        """
+        with self._lock:
+            host.outstanding -= 1
+            host.total_requests -= 1
+            host.breaker.cancel_attempt()
+
+    def _acquire_rate_limit(self, host: OllamaHost, call: _GenerateCall) -> bool:
+        """
+        Takes a request and the estimated tokens of the call from the limits of its model and host
+        """
+        if self.rate_limiter is None:
+            return True
+        names = [f"model:{call.model}", f"backend:{host.url}"]
+        prompt = call.data.get('prompt', '') + call.data.get('system', '')
+        tokens = math.ceil(len(prompt) / 4) + self.expected_completion_tokens # rough, corrected once the call returns
+        if not self.rate_limiter.acquire(names, tokens=tokens, block=call.wait_for_rate_limit, deadline=call.deadline):
+            return False
+        call.rate_limit_names = names
+        call.reserved_tokens = tokens
+        return True
+
+    def _settle_rate_limit(self, call: _GenerateCall, used_tokens: int = 0):
+        """
+        Replaces the estimated tokens of the attempt with the tokens it really used, none if it failed
+        """
+        if self.rate_limiter is None or not call.rate_limit_names:
+            return
+        self.rate_limiter.adjust(call.rate_limit_names, used_tokens, reserved=call.reserved_tokens)
+        call.rate_limit_names = []
+        call.reserved_tokens = 0
+
+    def _record_failure(self, host: OllamaHost):
+        """
+        Records a failed request or health check against the circuit breaker of the host.
+        Must be called with the lock held.
+        """
+        host.total_failures += 1
+        if host.breaker.record_failure(time.time()):
+            host.loaded_models.clear()
+            self.logger.warning(f"Circuit opened for ollama host {host.url} for {host.breaker.recovery_time}s after {host.breaker.consecutive_failures} failures")
+
+    def _backoff(self, attempt: int, deadline: float) -> bool:
+        """
+        Sleeps for a jittered exponential backoff, returns false if there is no time left before the deadline
+        """
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if time.time() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def generate_text(self, model: str, prompt: str, stream: bool = False, timeout: float = None, deadline: float = None,
+                      agent: str = None, system: str = None, context_key: str = None, usage: Dict[str, Any] = None,
+                      wait_for_rate_limit: bool = True, fallback_prompt: str = None) -> str | None:
         """
         Generates text using the Ollama API.
 
         Args:
             model (str): The name of the model to use.
             prompt (str): The prompt to provide to the model.
-            stream (bool): If true, return a generator for streaming the response.
-        
+            stream (bool): If true, return a generator for streaming the response. Nothing is sent until the caller
+                starts iterating it, it yields the text chunk by chunk and then the full text, or nothing if the call failed.
+            timeout (float): Seconds the call may take in total, defaults to `default_timeout`.
+            deadline (float): Absolute time (as from time.time()) by which the call must finish, takes precedence over timeout.
+            agent (str): Name of the calling agent, used to attribute the call in the telemetry.
+            system (str): System prompt of the call, sent on every call so each stage of a conversation keeps its own.
+            context_key (str): Conversation to continue, usually a task id. Follow up calls with the same key and model
+                reuse the context of the previous call, so the prefix is not processed again. Calls on another model
+                start their own conversation.
+            usage (dict): The prompt and completion token counts of the call are added to its 'prompt_tokens' and
+                'completion_tokens' entries, so a caller can account for several calls in one dict.
+            wait_for_rate_limit (bool): Wait for the rate limits until the deadline, otherwise fail right away if
+                the call would exceed them.
+            fallback_prompt (str): Prompt sent instead of `prompt` when no conversation is stored for the key and
+                model, e.g. one that includes the code a follow up prompt refers to. A stored context can be evicted
+                at any time, so this is decided as the call is made rather than by the caller checking first.
+
         Returns:
             str: The text generated by the model, or None if there was an issue
         """
-        url = f"{self.host}/api/generate"
+        stored = self.contexts.get(context_key, model) if context_key else None
+        if not stored and fallback_prompt is not None:
+            prompt = fallback_prompt
         data = {
             "model": model,
             "prompt": prompt,
             "stream": stream
         }
+        if stored:
+            data['context'] = stored['context']
+        if system:
+            data['system'] = system # replaces the system prompt of an earlier stage in the context
+        if deadline is None:
+            deadline = time.time() + (timeout if timeout is not None else self.default_timeout)
+        call = _GenerateCall(data, deadline, agent, context_key, stored['host'] if stored else None, usage, wait_for_rate_limit)
+        if stream:
+            return self._stream(call)
+        result = self._generate(call)
+        if result is None:
+            self._record_call_failure(call)
+        return result
+
+    def _record_call_failure(self, call: _GenerateCall):
+        """
+        Records a call that failed after all of its attempts
+        """
+        self.telemetry.record_failure(call.model, call.agent)
+        LLM_CALL_TIME.labels(call.model, 'failure').observe(time.time() - call.started)
+
+    def has_context(self, context_key: str, model: str) -> bool:
+        """
+        Returns true if there is a stored conversation for the key and model, so a follow up prompt can refer to it
+        """
+        return self.contexts.get(context_key, model) is not None
+
+    def retain_context(self, context_key: str, holders: int = 1):
+        """
+        Keeps the conversations of a key until `holders` more stages released them, e.g. follow up tasks running side by side
+        """
+        self.contexts.retain(context_key, holders)
+
+    def release_context(self, context_key: str) -> bool:
+        """
+        Releases the conversations of a key once a stage is finished with them, they are forgotten when no stage
+        holds them any more. Returns true if they were forgotten.
+        """
+        return self.contexts.release(context_key)
+
+    def _generate(self, call: _GenerateCall):
+        """
+        Sends a request, retrying transient failures until it succeeds, the retry budget runs out or the deadline passes.
+        """
+        model = call.model
+        self.retry_budget.record_request()
+        tried = set()
+        attempt = 0
+        while True:
+            remaining = call.deadline - time.time()
+            if remaining <= 0:
+                self.logger.error(f"Deadline exceeded calling ollama API for model {model}")
+                return None
+            reserve_now = self.rate_limiter is None # nothing to wait for, pick and reserve in one step
+            host = self._select_host(model, exclude=tried, preferred=call.preferred_host, reserve=reserve_now)
+            if host is None:
+                with self._lock:
+                    self.fast_failures += 1
+                self.logger.error(f"No healthy ollama host for model {model}, failing fast")
+                return None
+            if not reserve_now:
+                # The slot is reserved only after waiting for the rate limits, so a waiting call neither counts as
+                # outstanding on the host nor holds the probe of a half-open circuit
+                if not self._acquire_rate_limit(host, call):
+                    with self._lock:
+                        self.rate_limited += 1
+                    self.logger.error(f"Rate limit reached for model {model} on {host.url}, giving up")
+                    return None
+                if not self._reserve_host(host):
+                    # The circuit opened or another call took the probe meanwhile, pick again
+                    self._settle_rate_limit(call)
+                    continue
+            tried.add(host.url)
+            started = time.time()
+            remaining = call.deadline - started # waiting for the rate limit used up part of the time
+            if remaining <= 0:
+                self._cancel_host(host)
+                self._settle_rate_limit(call)
+                self.logger.error(f"Deadline exceeded calling ollama API for model {model}")
+                return None
+            try:
+                return self._call_host(host, call, started, remaining)
+            except _RetryableError as e:
+                self._release_host(host, model, started, False)
+                self._settle_rate_limit(call)
+                self.logger.warning(f'Error calling ollama API on {host.url} (attempt {attempt + 1}): {e}')
+            except requests.exceptions.RequestException as e:
+                # Client errors such as an unknown model will not succeed on a retry, the host itself is fine
+                self._release_host(host, model, started, True, served=False)
+                self._settle_rate_limit(call)
+                self.logger.error(f'Error calling ollama API on {host.url}: {e}')
+                return None
+
+            if attempt >= self.max_retries:
+                self.logger.error(f"Giving up on ollama API for model {model} after {attempt + 1} attempts")
+                return None
+            if not self.retry_budget.try_spend():
+                self.logger.error(f"Retry budget exhausted, giving up on ollama API for model {model}")
+                return None
+            if not self._backoff(attempt, call.deadline):
+                self.logger.error(f"Deadline exceeded calling ollama API for model {model}")
+                return None
+            attempt += 1
+
+    def _call_host(self, host: OllamaHost, call: _GenerateCall, started: float, remaining: float):
+        """
+        Sends a single request to a host. Raises _RetryableError for connection errors, timeouts and server errors.
+        A streamed call returns (host, started, response) once the server accepted it, the slot stays reserved
+        until _process_stream is done with the response.
+        """
+        url = f"{host.url}/api/generate"
         try:
-             response = requests.post(url, json=data, stream=stream)
-             response.raise_for_status() # raise an exception for error codes
-
-             if stream:
-                  return self._process_stream(response)
-             else:
-                  response_json = response.json()
-                  return response_json.get('response')
-        except requests.exceptions.RequestException as e:
-             self.logger.error(f'Error calling ollama API: {e}')
-             return None
+            response = requests.post(url, json=call.data, stream=call.stream, timeout=(min(self.connect_timeout, remaining), remaining))
+            if not response.ok:
+                response.close() # give the connection back to the pool, the body is not needed
+                if response.status_code >= 500:
+                    raise _RetryableError(f"server error {response.status_code}")
+                response.raise_for_status() # raise an exception for error codes
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            raise _RetryableError(str(e)) from e
+
+        if call.stream:
+            return host, started, response
+        try:
+            response_json = response.json()
+        except ValueError as e:
+            raise _RetryableError(f"invalid json in response: {e}") from e
+        self._release_host(host, call.model, started, True)
+        self._finish_call(host, call, response_json)
+        return response_json.get('response')
 
-    def _process_stream(self, response: requests.Response):
+    def _finish_call(self, host: OllamaHost, call: _GenerateCall, final_response: Dict[str, Any]):
+        """
+        Records a completed call, and keeps its context for the next call of the conversation
+        """
+        self.telemetry.record_call(call.model, time.time() - call.started, final_response, call.agent)
+        LLM_CALL_TIME.labels(call.model, 'success').observe(time.time() - call.started)
+        LLM_TOKENS.labels(call.model, 'prompt').inc(final_response.get('prompt_eval_count') or 0)
+        LLM_TOKENS.labels(call.model, 'completion').inc(final_response.get('eval_count') or 0)
+        self._settle_rate_limit(call, (final_response.get('prompt_eval_count') or 0) + (final_response.get('eval_count') or 0))
+        if call.usage is not None:
+            call.usage['prompt_tokens'] = call.usage.get('prompt_tokens', 0) + (final_response.get('prompt_eval_count') or 0)
+            call.usage['completion_tokens'] = call.usage.get('completion_tokens', 0) + (final_response.get('eval_count') or 0)
+        if call.context_key and final_response.get('context'):
+            self.contexts.put(call.context_key, call.model, final_response['context'], host.url)
+
+    def _stream(self, call: _GenerateCall):
+        """
+        Generator behind a streamed call. The host is picked and reserved only once the caller starts iterating,
+        so a stream that is never consumed holds nothing.
+        """
+        call.started = time.time()
+        opened = self._generate(call)
+        if opened is None:
+            self._record_call_failure(call)
+            return
+        host, started, response = opened
+        yield from self._process_stream(response, host, call, started)
+
+    def _process_stream(self, response: requests.Response, host: OllamaHost, call: _GenerateCall, started: float):
         """
          Process a streamed response from the ollama server
         """
         full_text = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    if 'done' in json_line and json_line['done'] is True:
-                         break # if done, then close the stream
-                    text_chunk = json_line.get('response', "")
-                    full_text += text_chunk
-                    yield text_chunk # Return chunk by chunk
-                except json.JSONDecodeError as e:
-                     self.logger.warning(f"Error parsing json: {line} - {e}")
+        final_response = None # the last line of the stream carries the timing metadata and the context
+        closed = False # the caller stopped iterating before the end of the stream
+        failed = False # the host failed while streaming
+        try:
+            for line in response.iter_lines():
+                if time.time() >= call.deadline:
+                    self.logger.error(f"Deadline exceeded streaming from ollama host {host.url} for model {call.model}")
+                    break
+                if line:
+                    try:
+                        json_line = json.loads(line)
+                        if 'done' in json_line and json_line['done'] is True:
+                             final_response = json_line
+                             break # if done, then close the stream
+                        text_chunk = json_line.get('response', "")
+                        full_text += text_chunk
+                        yield text_chunk # Return chunk by chunk
+                    except json.JSONDecodeError as e:
+                         self.logger.warning(f"Error parsing json: {line} - {e}")
+        except GeneratorExit:
+            closed = True
+            raise
+        except requests.exceptions.RequestException as e:
+            failed = True
+            self.logger.error(f'Error reading ollama stream from {host.url}: {e}')
+        finally:
+            # Release the host once the stream is exhausted, fails, runs past the deadline or is closed by the caller
+            response.close()
+            if final_response is not None:
+                self._release_host(host, call.model, started, True)
+                self._finish_call(host, call, final_response)
+            else:
+                if failed:
+                    self._release_host(host, call.model, started, False)
+                else: # the host was answering, the caller or the deadline cut the stream short
+                    self._release_host(host, call.model, started, True, served=False)
+                self._settle_rate_limit(call)
+                if not closed:
+                    self._record_call_failure(call)
         yield full_text # Return all of the text
 
+    def check_health(self):
+        """
+        Checks every host, refreshing its loaded models and marking it up or down.
+        The circuit breaker is left to the real requests, an open circuit recovers through its half open probe.
+        """
+        for host in self.hosts:
+            try:
+                with requests.get(f"{host.url}/api/ps", timeout=self.connect_timeout) as response:
+                    response.raise_for_status()
+                    models = response.json().get('models', [])
+                loaded = set()
+                for loaded_model in models:
+                    name = loaded_model.get('name', '')
+                    loaded.add(name)
+                    loaded.add(name.split(':')[0]) # also match requests that leave off the tag
+                with self._lock:
+                    if not host.healthy:
+                        self.logger.info(f"Ollama host {host.url} is healthy again")
+                    host.last_health_check = time.time()
+                    host.healthy = True
+                    host.loaded_models = loaded
+            except (requests.exceptions.RequestException, ValueError) as e:
+                with self._lock:
+                    host.last_health_check = time.time()
+                    host.healthy = False
+                    host.loaded_models.clear()
+                self.logger.warning(f"Health check failed for ollama host {host.url}: {e}")
+
+    def start_health_checks(self):
+        """
+        Starts checking the health of the hosts in a background thread
+        """
+        if self._health_thread and self._health_thread.is_alive():
+            self.logger.warning("Health checks already running, ignoring command")
+            return
+        self._health_stop.clear()
+        self._health_thread = threading.Thread(target=self._health_loop)
+        self._health_thread.daemon = True # so that the thread closes when the main program closes
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        """
+        Stops the background health checks
+        """
+        self._health_stop.set()
+        if self._health_thread:
+            self._health_thread.join()
+            self._health_thread = None
+
+    def _health_loop(self):
+        """
+        Background loop for the health checks
+        """
+        while not self._health_stop.is_set():
+            self.check_health()
+            self._health_stop.wait(self.health_check_interval)
+
     def get_status(self):
         """
         Returns the status of the ollama client
         """
+        with self._lock:
+            hosts = [host.get_status() for host in self.hosts]
+            fast_failures = self.fast_failures
         return {
-            'host': self.host
-        }
\ No newline at end of file
+            'host': self.host,
+            'hosts': hosts,
+            'fast_failures': fast_failures,
+            'rate_limited': self.rate_limited,
+            'retry_budget': self.retry_budget.get_status(),
+            'llm_stats': self.telemetry.get_status(),
+            'conversation_contexts': len(self.contexts)
+        }
@@ -0,0 +1,58 @@
+import threading
+from collections import deque
+from typing import Dict, Any
+
+# Per task measurements an agent reports, see Agent.handle_task
+USAGE_FIELDS = ('wall_time', 'cpu_time', 'llm_wait', 'queue_wait', 'prompt_tokens', 'completion_tokens')
+
+
+class RollingUsage:
+    """
+    Resource usage of the last `window` tasks of an agent or role.
+    Running totals are updated as tasks enter and leave the window, so reading the summary doesn't rescan the tasks.
+    """
+    def __init__(self, window: int = 100):
+        self.tasks = deque(maxlen=window)
+        self.totals = dict.fromkeys(USAGE_FIELDS, 0.0)
+        self.outcomes = {} # outcome -> number of tasks in the window
+        self.lifetime_tasks = 0
+        self.last_task_id = None
+        self.summary = self._summarise() # rebuilt on every record, readers get the last one without taking the lock
+        self._lock = threading.Lock()
+
+    def record(self, usage: Dict[str, Any]):
+        """
+        Add the usage of a finished task
+        """
+        entry = {field: float(usage.get(field) or 0) for field in USAGE_FIELDS}
+        entry['outcome'] = usage.get('outcome', 'unknown')
+        with self._lock:
+            if len(self.tasks) == self.tasks.maxlen:
+                evicted = self.tasks[0]
+                for field in USAGE_FIELDS:
+                    self.totals[field] -= evicted[field]
+                self.outcomes[evicted['outcome']] -= 1
+            self.tasks.append(entry)
+            for field in USAGE_FIELDS:
+                self.totals[field] += entry[field]
+            self.outcomes[entry['outcome']] = self.outcomes.get(entry['outcome'], 0) + 1
+            self.lifetime_tasks += 1
+            self.last_task_id = usage.get('task_id')
+            self.summary = self._summarise()
+
+    def _summarise(self) -> Dict[str, Any]:
+        """
+        Totals and per task averages over the window
+        """
+        count = len(self.tasks)
+        wall_time = self.totals['wall_time']
+        return {
+            'tasks': count,
+            'lifetime_tasks': self.lifetime_tasks,
+            'last_task_id': self.last_task_id,
+            'outcomes': {outcome: n for outcome, n in self.outcomes.items() if n},
+            'totals': dict(self.totals),
+            'averages': {field: total / count for field, total in self.totals.items()} if count else {},
+            'cpu_share': self.totals['cpu_time'] / wall_time if wall_time else None, # time spent computing rather than waiting
+            'llm_share': self.totals['llm_wait'] / wall_time if wall_time else None # time spent waiting on the LLM
+        }
@@ -0,0 +1,155 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict
+
+try:
+    import orjson # much faster than the standard library json, which is used when it is missing
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack # compact binary format, only needed for the msgpack codec
+except ImportError:
+    msgpack = None
+
+# Binary payloads start with a one byte format tag, so readers can decode whatever format a writer used and the
+# codec can be switched while data written with the old one is still around. JSON never starts with these bytes,
+# so JSON is written untagged and untagged payloads are read as JSON, including those written before codecs existed.
+JSON_TAG = 0x01
+MSGPACK_TAG = 0x02
+
+
+class Codec(ABC):
+    """
+    Serialises objects to bytes and back.
+    """
+    name = None
+    tag = None
+    content_type = None
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """
+        Encode an object, without the format tag
+        """
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes | bytearray | memoryview) -> Any:
+        """
+        Decode an object, without the format tag
+        """
+        pass
+
+    def encode(self, obj: Any) -> bytes:
+        """
+        Encode an object so that decode can tell the codec from the payload.
+        Joins the tag in front, a copy of the payload that codecs override when the format can avoid it.
+        """
+        return bytes((self.tag,)) + self.dumps(obj)
+
+
+class JSONCodec(Codec):
+    """
+    JSON, using orjson when it is installed and the standard library otherwise.
+    """
+    name = 'json'
+    tag = JSON_TAG
+    content_type = 'application/json'
+
+    def __init__(self, fast: bool = True):
+        self.fast = fast and orjson is not None
+
+    def dumps(self, obj: Any) -> bytes:
+        if self.fast:
+            return orjson.dumps(obj)
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def encode(self, obj: Any) -> bytes:
+        return self.dumps(obj) # untagged, JSON_TAG payloads from earlier writers are still decoded
+
+    def loads(self, data: bytes | bytearray | memoryview) -> Any:
+        if self.fast:
+            return orjson.loads(data) # reads bytes and memoryviews without a copy
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """
+    MessagePack, needs the msgpack package.
+    """
+    name = 'msgpack'
+    tag = MSGPACK_TAG
+    content_type = 'application/msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("The msgpack codec needs the 'msgpack' package, install it or use the json codec")
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def encode(self, obj: Any) -> bytes:
+        # The tag byte is the msgpack encoding of the small integer itself, so the packer writes it in the same buffer
+        packer = msgpack.Packer(use_bin_type=True, autoreset=False)
+        packer.pack(self.tag)
+        packer.pack(obj)
+        return packer.bytes()
+
+    def loads(self, data: bytes | bytearray | memoryview) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+_CODEC_TYPES = {
+    'json': JSONCodec,
+    'msgpack': MsgpackCodec
+}
+_codecs: Dict[str, Codec] = {}
+
+
+def get_codec(name: str = 'json') -> Codec:
+    """
+    Returns the codec with the given name, 'json' or 'msgpack'
+    """
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in _CODEC_TYPES:
+            raise ValueError(f"Unknown codec '{name}', expected one of {sorted(_CODEC_TYPES)}")
+        codec = _CODEC_TYPES[name]()
+        _codecs[name] = codec
+    return codec
+
+
+def codec_for_tag(tag: int) -> Codec | None:
+    """
+    Returns the codec for a format tag, or None if the byte is not a tag
+    """
+    if tag == JSON_TAG:
+        return get_codec('json')
+    if tag == MSGPACK_TAG:
+        return get_codec('msgpack')
+    return None
+
+
+def codec_for_content_type(content_type: str | None) -> Codec:
+    """
+    Returns the codec for an HTTP Content-Type header, JSON when missing or unknown
+    """
+    if content_type and content_type.split(';')[0].strip().lower() in ('application/msgpack', 'application/x-msgpack'):
+        return get_codec('msgpack')
+    return get_codec('json')
+
+
+def decode(data: bytes | bytearray | memoryview) -> Any:
+    """
+    Decode a tagged payload with whichever codec wrote it, untagged payloads are read as JSON
+    """
+    view = memoryview(data)
+    if not view:
+        raise ValueError("Cannot decode an empty payload")
+    codec = codec_for_tag(view[0])
+    if codec is None:
+        return get_codec('json').loads(data)
+    return codec.loads(view[1:]) # slicing the view skips the tag without copying the payload
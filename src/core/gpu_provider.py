@@ -0,0 +1,143 @@
+import importlib
+import importlib.util
+import shutil
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, Any
+from utils.logger import get_logger
+
+GPU_PROVIDERS = ('auto', 'torch', 'nvidia-smi', 'none')
+
+
+class GPUProvider(ABC):
+    """
+    Reports GPU memory. Providers do no work until they are first asked, so importing this module is free.
+    """
+    name = None
+
+    @abstractmethod
+    def is_available(self) -> bool:
+        """
+        Returns true if there is a GPU to monitor
+        """
+        pass
+
+    @abstractmethod
+    def memory_info(self) -> tuple[int, int] | None:
+        """
+        Returns (free, total) bytes of GPU memory, or None if there is no GPU
+        """
+        pass
+
+    def get_status(self) -> Dict[str, Any]:
+        return {'provider': self.name}
+
+
+class NoGPUProvider(GPUProvider):
+    """
+    For hosts without a GPU, never probes anything.
+    """
+    name = 'none'
+
+    def is_available(self) -> bool:
+        return False
+
+    def memory_info(self) -> tuple[int, int] | None:
+        return None
+
+
+class TorchGPUProvider(GPUProvider):
+    """
+    Reads CUDA memory through torch, which is imported on first use.
+    """
+    name = 'torch'
+
+    def __init__(self, device: int = 0, logger=None):
+        self.device = device
+        self.logger = get_logger("gpu_provider", logger)
+        self._torch = None
+        self._available = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_installed() -> bool:
+        return importlib.util.find_spec('torch') is not None
+
+    def _load(self):
+        """
+        Import torch and check for CUDA, once
+        """
+        with self._lock:
+            if self._available is not None:
+                return
+            if not self.is_installed():
+                self.logger.info("torch is not installed, skipping VRAM monitoring.")
+                self._available = False
+                return
+            self._torch = importlib.import_module('torch')
+            self._available = self._torch.cuda.is_available()
+            if not self._available:
+                self.logger.info("CUDA is not available on this system, skipping VRAM monitoring.")
+
+    def is_available(self) -> bool:
+        self._load()
+        return self._available
+
+    def memory_info(self) -> tuple[int, int] | None:
+        if not self.is_available():
+            return None
+        free, total = self._torch.cuda.mem_get_info(self.device) # free memory as the driver reports it, not only torch's own allocations
+        return free, total
+
+
+class NvidiaSMIGPUProvider(GPUProvider):
+    """
+    Reads GPU memory with the nvidia-smi command line tool, no python GPU libraries needed.
+    """
+    name = 'nvidia-smi'
+
+    def __init__(self, device: int = 0, timeout: float = 5.0, logger=None):
+        self.device = device
+        self.timeout = timeout
+        self.logger = get_logger("gpu_provider", logger)
+        self.executable = shutil.which('nvidia-smi')
+        self._available = None
+
+    def is_available(self) -> bool:
+        if self._available is None:
+            self._available = self.executable is not None and self.memory_info() is not None
+            if not self._available:
+                self.logger.info("nvidia-smi found no GPU on this system, skipping VRAM monitoring.")
+        return self._available
+
+    def memory_info(self) -> tuple[int, int] | None:
+        if self.executable is None or self._available is False:
+            return None
+        try:
+            output = subprocess.run(
+                [self.executable, '--query-gpu=memory.free,memory.total', '--format=csv,noheader,nounits', f'--id={self.device}'],
+                capture_output=True, text=True, timeout=self.timeout, check=True
+            ).stdout
+            free, total = (int(value) * 1024 ** 2 for value in output.strip().split(',')) # reported in MiB
+            return free, total
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            self.logger.warning('Error reading GPU memory with nvidia-smi: %s', e)
+            return None
+
+
+def get_gpu_provider(name: str = 'auto', logger=None) -> GPUProvider:
+    """
+    Returns the GPU provider with the given name.
+    'auto' uses nvidia-smi when it is on the PATH and no GPU otherwise, it never picks torch because importing it
+    costs seconds and hundreds of MB even on hosts without a GPU, select 'torch' explicitly for that.
+    """
+    if name not in GPU_PROVIDERS:
+        raise ValueError(f"Unknown GPU provider '{name}', expected one of {list(GPU_PROVIDERS)}")
+    if name == 'auto':
+        name = 'nvidia-smi' if shutil.which('nvidia-smi') else 'none'
+    if name == 'torch':
+        return TorchGPUProvider(logger=logger)
+    if name == 'nvidia-smi':
+        return NvidiaSMIGPUProvider(logger=logger)
+    return NoGPUProvider()
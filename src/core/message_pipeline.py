@@ -1,30 +1,282 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque, OrderedDict
+from urllib.parse import urlsplit, parse_qs
+import queue
+import time
 import threading
-import logging
-from typing import Dict, Any
+import re
+from typing import Dict, Any, Callable
+from core.codec import get_codec, codec_for_content_type
+from core.metrics import REGISTRY, MetricsRegistry
+from utils.logger import get_logger
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+
+def is_topic_pattern(topic: str) -> bool:
+    """
+    Returns true if a subscription topic is a wildcard pattern rather than an exact message type
+    """
+    return '*' in topic or '#' in topic
+
+
+def compile_topic_pattern(pattern: str) -> re.Pattern:
+    """
+    Compiles a topic pattern. '*' matches any characters except '.', so 'task_*' matches 'task_update' and
+    'agent.*.status' matches 'agent.senior.status'. '#' matches anything including '.', so 'task.#' matches every
+    topic under 'task.'.
+    """
+    regex = ''.join('[^.]*' if char == '*' else '.*' if char == '#' else re.escape(char) for char in pattern)
+    return re.compile(f'^{regex}$')
+
+
+class _Subscriber:
+    """
+    Delivers messages to one handler from a bounded queue on its own worker thread, in publish order.
+
+    When the queue is full the overflow policy decides what happens:
+        block: the publisher waits for space.
+        drop_oldest: the oldest queued message is dropped.
+        coalesce: a queued message with the same coalesce key (e.g. the same task_id) is replaced by the new one,
+            falling back to dropping the oldest message if there is none.
+
+    With a coalesce window, messages are always coalesced by key: each one is held for the window and later messages
+    with the same key replace its data, so a burst costs the handler one call per distinct key.
+    """
+    def __init__(self, handler: Callable, maxsize: int = 1000, overflow_policy: str = 'block', coalesce_key: str = 'task_id', logger=None,
+                 coalesce_window: float = 0.0):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+        self.coalesce_key = coalesce_key
+        self.coalesce_window = coalesce_window # seconds a message waits for newer updates with the same key
+        self.logger = logger
+        self.queue = deque() # entries are [message_type, data, enqueued_at, coalesce_id]
+        self.pending = {} # coalesce_id -> queued entry, to merge updates in place
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_lag = 0.0 # seconds the last delivered message spent in the queue
+
+    def _coalesce_id(self, message_type: str, data: Any):
+        """
+        Identifies messages that may replace each other, or None if the message cannot be coalesced
+        """
+        if isinstance(data, dict) and self.coalesce_key in data:
+            try:
+                return (message_type, data[self.coalesce_key])
+            except TypeError:
+                return None
+        return None
+
+    def start(self):
+        """
+        Start the worker thread
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"subscriber-{getattr(self.handler, '__name__', 'handler')}")
+        self.thread.daemon = True # so that the thread closes when the main program closes
+        self.thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop the worker thread once the queued messages have been delivered
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def put(self, message_type: str, data: Any) -> bool:
+        """
+        Queue a message for the handler, returns false if the message was dropped
+        """
+        with self.condition:
+            if not self.running:
+                return False
+            coalesce_id = None
+            if self.overflow_policy == 'coalesce' or self.coalesce_window:
+                coalesce_id = self._coalesce_id(message_type, data)
+            if self.coalesce_window and coalesce_id is not None and coalesce_id in self.pending:
+                # Still inside the window of a queued message with the same key, deliver the latest data instead
+                self.pending[coalesce_id][1] = data
+                self.coalesced += 1
+                return True
+            if len(self.queue) >= self.maxsize:
+                if self.overflow_policy == 'block':
+                    while len(self.queue) >= self.maxsize and self.running:
+                        self.condition.wait()
+                    if not self.running:
+                        return False
+                elif coalesce_id is not None and coalesce_id in self.pending:
+                    # Keep the position of the queued message, but deliver the latest data
+                    self.pending[coalesce_id][1] = data
+                    self.coalesced += 1
+                    return True
+                else:
+                    dropped = self.queue.popleft()
+                    if dropped[3] is not None and self.pending.get(dropped[3]) is dropped:
+                        del self.pending[dropped[3]]
+                    self.dropped += 1
+            entry = [message_type, data, time.time(), coalesce_id]
+            self.queue.append(entry)
+            if coalesce_id is not None:
+                self.pending[coalesce_id] = entry
+            self.condition.notify_all()
+            return True
+
+    def _run(self):
+        """
+        Worker loop, delivers queued messages until stopped and drained
+        """
+        while True:
+            with self.condition:
+                while True:
+                    if not self.queue:
+                        if not self.running:
+                            return # stopped and drained
+                        self.condition.wait()
+                        continue
+                    head = self.queue[0]
+                    if self.coalesce_window and head[3] is not None and self.running:
+                        # Hold the message until its window closes, so newer updates can replace it
+                        wait_for = head[2] + self.coalesce_window - time.time()
+                        if wait_for > 0:
+                            self.condition.wait(wait_for)
+                            continue
+                    break
+                entry = self.queue.popleft()
+                if entry[3] is not None and self.pending.get(entry[3]) is entry:
+                    del self.pending[entry[3]]
+                message_type, data, enqueued_at, _ = entry
+                self.condition.notify_all() # wake publishers blocked on a full queue
+            self.last_lag = time.time() - enqueued_at
+            try:
+                self.handler(data)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                if self.logger:
+                    self.logger.exception(f"Subscriber {getattr(self.handler, '__name__', self.handler)} failed on '{message_type}' message: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the queue depth and lag of the subscriber
+        """
+        with self.condition:
+            depth = len(self.queue)
+            oldest_age = time.time() - self.queue[0][2] if self.queue else 0.0
+        return {
+            'handler': getattr(self.handler, '__name__', repr(self.handler)),
+            'overflow_policy': self.overflow_policy,
+            'coalesce_window': self.coalesce_window,
+            'queue_depth': depth,
+            'max_queue_size': self.maxsize,
+            'oldest_message_age': oldest_age,
+            'last_lag': self.last_lag,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors
+        }
+
+class _EventStream:
+    """
+    Events waiting to be pushed to one streaming (Server-Sent Events) client.
+    Never blocks the publisher, when the client falls behind the oldest events are dropped.
+    """
+    def __init__(self, topics: set = None, task_ids: set = None, maxsize: int = 1000):
+        self.topics = topics # None means every topic
+        self.exact_topics = {topic for topic in topics if not is_topic_pattern(topic)} if topics is not None else None
+        self.topic_patterns = [compile_topic_pattern(topic) for topic in topics if is_topic_pattern(topic)] if topics is not None else []
+        self.task_ids = task_ids # None means every task
+        self.events = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def wants_topic(self, message_type: str) -> bool:
+        """
+        Returns true if the client subscribed to this message type
+        """
+        if self.topics is None or message_type in self.exact_topics:
+            return True
+        return any(pattern.match(message_type) for pattern in self.topic_patterns)
+
+    def matches(self, message_type: str, message_data: Any) -> bool:
+        """
+        Returns true if the client asked for this event
+        """
+        if not self.wants_topic(message_type):
+            return False
+        if self.task_ids is not None:
+            return isinstance(message_data, dict) and message_data.get('task_id') in self.task_ids
+        return True
+
+    def put(self, event: Dict[str, Any]):
+        """
+        Queue an event for the client
+        """
+        while True:
+            try:
+                self.events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.events.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float) -> Dict[str, Any] | None:
+        """
+        Wait up to timeout seconds for the next event
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
 
 class HTTPMessagePipeline:
     """
     Simple HTTP-based message pipeline.
     """
 
-    def __init__(self, host='localhost', port=8000, logger=None):
+    def __init__(self, host='localhost', port=8000, logger=None, dispatch_mode: str = 'sync', queue_size: int = 1000,
+                 overflow_policy: str = 'block', coalesce_key: str = 'task_id', max_task_states: int = 10000,
+                 metrics_registry: MetricsRegistry = None, task_queue=None):
          self.host = host
          self.port = port
+         if dispatch_mode not in ('sync', 'async'):
+             raise ValueError(f"Unknown dispatch mode '{dispatch_mode}', expected 'sync' or 'async'")
+         self.dispatch_mode = dispatch_mode # async gives each subscriber its own queue and worker thread
+         self.queue_size = queue_size
+         self.overflow_policy = overflow_policy
+         self.coalesce_key = coalesce_key
+         self.metrics_registry = metrics_registry or REGISTRY # served on GET /metrics
          self.server = None
          self.running = False
-         if logger:
-            self.logger = logger
-         else:
-            self.logger = logging.getLogger("http_message_pipeline")
-            self.logger.setLevel(logging.DEBUG) # Default log level can be changed as needed
-            ch = logging.StreamHandler()
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            ch.setFormatter(formatter)
-            self.logger.addHandler(ch)
+         self.logger = get_logger("http_message_pipeline", logger)
          self.message_handlers = {} # store handlers for messages
+         self.subscribers = {} # handler -> _Subscriber, for async dispatch and coalescing subscribers
+         self.topic_patterns = {} # wildcard subscription -> compiled pattern
+         self.routes = {} # message type -> handlers, resolved from exact and wildcard subscriptions on first publish
+         self._routes_lock = threading.Lock()
+         self._subscribers_lock = threading.Lock()
          self.server_thread = None # store the server thread
+         self.task_states = OrderedDict() # latest task_update per task, sent as the snapshot to new streaming clients
+         self.max_task_states = max_task_states
+         self.task_queue = task_queue # the task states are seeded from it at start, so the snapshot covers earlier tasks
+         self.event_streams = set() # connected streaming clients
+         self.event_sequence = 0 # id of the last event pushed to streaming clients
+         self._events_lock = threading.Lock()
 
     def start(self):
         """
@@ -33,9 +285,11 @@ class HTTPMessagePipeline:
         if self.running:
             self.logger.warning("Server already running, ignoring command")
             return
-        self.server = HTTPServer((self.host, self.port), _HTTPRequestHandler)
+        self.server = _PipelineHTTPServer((self.host, self.port), _HTTPRequestHandler)
         self.server.message_pipeline = self
         self.running = True
+        if self.task_queue is not None:
+            self.seed_task_states()
         self.logger.info(f"Message Pipeline listening on http://{self.host}:{self.port}")
         # Start the server in a new thread to not block the main program
         self.server_thread = threading.Thread(target=self.server.serve_forever)
@@ -54,16 +308,45 @@ class HTTPMessagePipeline:
         self.server.server_close()
         self.server_thread.join() # Wait for the server to close fully
         self.running = False
+        self.close_subscribers()
         self.logger.info("Message Pipeline stopped.")
 
-    def subscribe(self, message_type: str, handler):
+    def close_subscribers(self):
         """
-        Subscribe to a certain type of message
+        Stop the subscriber workers, delivering what is already queued
         """
-        if message_type in self.message_handlers:
-             self.message_handlers[message_type].append(handler)
-        else:
-             self.message_handlers[message_type] = [handler]
+        with self._subscribers_lock:
+            subscribers = list(self.subscribers.values())
+            self.subscribers = {}
+        for subscriber in subscribers:
+            subscriber.stop()
+
+    def subscribe(self, message_type: str, handler, overflow_policy: str = None, queue_size: int = None, coalesce_window: float = None):
+        """
+        Subscribe to a certain type of message, or to every type matching a pattern such as 'task_*' (see compile_topic_pattern).
+        In async dispatch mode the overflow policy and queue size of the handler's queue can be set per subscriber,
+        a handler subscribed to several message types shares one queue, so it sees them in publish order.
+        A coalesce window (in seconds) holds each message that long and delivers only the latest one per coalesce key,
+        it gives the handler a queue even in sync dispatch mode.
+        """
+        if self.dispatch_mode == 'async' or coalesce_window:
+            with self._subscribers_lock:
+                subscriber = self.subscribers.get(handler)
+                if subscriber is None:
+                    subscriber = _Subscriber(handler, queue_size or self.queue_size, overflow_policy or self.overflow_policy,
+                                             self.coalesce_key, self.logger, coalesce_window or 0.0)
+                    subscriber.start()
+                    self.subscribers[handler] = subscriber
+                elif coalesce_window:
+                    subscriber.coalesce_window = coalesce_window
+        with self._routes_lock:
+            if message_type in self.message_handlers:
+                 self.message_handlers[message_type].append(handler)
+            else:
+                 self.message_handlers[message_type] = [handler]
+                 if is_topic_pattern(message_type):
+                     self.topic_patterns[message_type] = compile_topic_pattern(message_type)
+            self.routes = {} # routes are resolved again on the next publish
         self.logger.info(f"Subscribed to message type: {message_type}")
 
 
@@ -71,23 +354,145 @@ class HTTPMessagePipeline:
         """
         Unsubscribe from message type
         """
-        if message_type in self.message_handlers and handler in self.message_handlers[message_type]:
-            self.message_handlers[message_type].remove(handler)
+        with self._routes_lock:
+            found = message_type in self.message_handlers and handler in self.message_handlers[message_type]
+            if found:
+                self.message_handlers[message_type].remove(handler)
+                if not self.message_handlers[message_type]:
+                    del self.message_handlers[message_type]
+                    self.topic_patterns.pop(message_type, None)
+                self.routes = {}
+                still_subscribed = any(handler in handlers for handlers in self.message_handlers.values())
+        if found:
             self.logger.info(f"Unsubscribed from message type: {message_type}")
+            if not still_subscribed:
+                with self._subscribers_lock:
+                    subscriber = self.subscribers.pop(handler, None)
+                if subscriber:
+                    subscriber.stop()
         else:
             self.logger.warning(f"No handler '{handler}' subscribed to message type: {message_type}")
 
+    def _resolve(self, message_type: str) -> tuple:
+        """
+        Returns the handlers for a message type, from exact and pattern subscriptions.
+        The result is cached per message type until the subscriptions change, so a publish costs one dict lookup.
+        """
+        routes = self.routes
+        handlers = routes.get(message_type)
+        if handlers is not None:
+            return handlers
+        with self._routes_lock:
+            matched = list(self.message_handlers.get(message_type, []))
+            for pattern, regex in self.topic_patterns.items():
+                if pattern != message_type and regex.match(message_type):
+                    matched.extend(self.message_handlers[pattern])
+            handlers = tuple(dict.fromkeys(matched)) # a handler matching several subscriptions gets the message once
+            self.routes[message_type] = handlers
+        return handlers
+
     def publish(self, message_type: str, message_data: Dict[str, Any]):
         """
         Publish a message to subscribers.
         """
-        if message_type in self.message_handlers:
-            for handler in self.message_handlers[message_type]:
-                handler(message_data)
-            self.logger.debug(f"Published message of type '{message_type}': {message_data}")
+        self._record_event(message_type, message_data)
+        handlers = self._resolve(message_type)
+        if handlers:
+            for handler in handlers:
+                subscriber = self.subscribers.get(handler)
+                if subscriber:
+                    subscriber.put(message_type, message_data) # publishers only pay for the enqueue
+                else:
+                    handler(message_data)
+            self.logger.debug("Published message of type '%s': %s", message_type, message_data)
         else:
-            self.logger.debug(f"No subscribers for message type: {message_type}, message not sent.")
-        
+            self.logger.debug("No subscribers for message type: %s, message not sent.", message_type)
+
+    def _record_event(self, message_type: str, message_data: Any):
+        """
+        Keep the latest state of each task and push the event to the streaming clients that asked for it
+        """
+        if message_type != 'task_update' and not self.event_streams:
+            return
+        with self._events_lock:
+            if message_type == 'task_update' and isinstance(message_data, dict) and 'task_id' in message_data:
+                task_id = message_data['task_id']
+                self.task_states[task_id] = message_data
+                self.task_states.move_to_end(task_id)
+                while len(self.task_states) > self.max_task_states:
+                    self.task_states.popitem(last=False)
+            if not self.event_streams:
+                return
+            self.event_sequence += 1
+            event = {'id': self.event_sequence, 'type': message_type, 'data': message_data}
+            for stream in self.event_streams:
+                if stream.matches(message_type, message_data):
+                    stream.put(event)
+
+    def seed_task_states(self):
+        """
+        Fills the task states from the task queue in one scan, so streaming clients get tasks that changed before
+        this process started. Events keep them current afterwards, and a task that already has an event keeps it.
+        """
+        try:
+            tasks = self.task_queue.values()
+        except Exception as e:
+            self.logger.warning(f"Could not seed the task states from the task queue: {e}")
+            return
+        tasks.sort(key=lambda task: task.get('finished_at') or task.get('created_at') or 0) # the most recent are kept
+        with self._events_lock:
+            for task in reversed(tasks[-self.max_task_states:]): # newest first, each goes in front of the ones after it
+                task_id = task.get('task_id')
+                if task_id is None or task_id in self.task_states:
+                    continue
+                self.task_states[task_id] = {
+                    'task_id': task_id,
+                    'status': task.get('status'),
+                    'agent_id': task.get('assigned_agent'),
+                    'role': task.get('role')
+                }
+                self.task_states.move_to_end(task_id, last=False) # before the events that arrived meanwhile
+            while len(self.task_states) > self.max_task_states:
+                self.task_states.popitem(last=False)
+        self.logger.info(f"Seeded the states of {len(tasks)} tasks from the task queue")
+
+    def open_event_stream(self, topics: set = None, task_ids: set = None, maxsize: int = 1000):
+        """
+        Register a streaming client, returns the stream and a snapshot of the current task states.
+        Both are taken under the same lock, so every later change arrives as a live event.
+        """
+        stream = _EventStream(topics, task_ids, maxsize)
+        with self._events_lock:
+            self.event_streams.add(stream)
+            if stream.wants_topic('task_update'):
+                snapshot = [state for task_id, state in self.task_states.items() if task_ids is None or task_id in task_ids]
+            else:
+                snapshot = []
+            sequence = self.event_sequence
+        return stream, {'id': sequence, 'tasks': snapshot}
+
+    def close_event_stream(self, stream: _EventStream):
+        """
+        Unregister a streaming client
+        """
+        with self._events_lock:
+            self.event_streams.discard(stream)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the status of the pipeline, including the lag of each subscriber in async dispatch mode
+        """
+        with self._subscribers_lock:
+            subscribers = list(self.subscribers.values())
+        return {
+            'running': self.running,
+            'dispatch_mode': self.dispatch_mode,
+            'message_types': {message_type: len(handlers) for message_type, handlers in self.message_handlers.items()},
+            'subscribers': [subscriber.get_status() for subscriber in subscribers],
+            'event_streams': len(self.event_streams),
+            'tracked_tasks': len(self.task_states)
+        }
+
     def __enter__(self):
         self.start()
         return self
@@ -95,42 +500,154 @@ class HTTPMessagePipeline:
     def __exit__(self):
         self.stop()
 
+class _PipelineHTTPServer(ThreadingHTTPServer):
+    """
+    HTTP server that handles each connection on its own thread.
+    """
+    daemon_threads = True # don't hold up shutdown on idle keep-alive connections
+    request_queue_size = 128 # listen backlog for bursts of producers
+
+
 class _HTTPRequestHandler(BaseHTTPRequestHandler):
     """
     Handler for incoming HTTP requests.
+
+    Speaks HTTP/1.1 so producers can keep a connection open, and accepts either a single {type, data} message
+    on any path or a JSON array of them on /batch.
+    GET /events streams task_update and request_help events to observers as Server-Sent Events, see _stream_events.
+    Only this pipeline serves it, there is no /events endpoint with the redis_streams message bus.
+    GET /metrics serves the metrics of the process in the Prometheus text format.
     """
+    protocol_version = 'HTTP/1.1' # keep connections alive between requests
+    heartbeat_interval = 15.0 # seconds between keep-alive comments on an idle event stream
+
+    def _send_json(self, status: int, response_message: Any):
+        """
+        Send a JSON response, with a Content-Length so the connection can be reused
+        """
+        body = get_codec('json').dumps(response_message)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _publish_message(self, message: Any) -> Dict[str, Any]:
+        """
+        Publish a single message, returns the result for it
+        """
+        if not isinstance(message, dict) or 'type' not in message or 'data' not in message:
+            return {'status': 'error', 'error': 'Request missing "type" or "data" property'}
+        try:
+            self.server.message_pipeline.publish(message['type'], message['data']) # Send the message to any subscribers
+            return {'status': 'ok'}
+        except Exception as e:
+            return {'status': 'error', 'error': f'Error publishing message: {e}'}
+
     def do_POST(self):
         """
         Handle incoming POST requests.
         """
-        content_length = int(self.headers['Content-Length'])
+        if self.headers.get('Content-Length') is None:
+            self._send_json(411, {'error': 'Content-Length required'})
+            self.close_connection = True # the body cannot be skipped without its length
+            return
+        try:
+            content_length = int(self.headers['Content-Length'])
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            self._send_json(400, {'error': 'Content-Length must be a non-negative integer'})
+            self.close_connection = True # the body cannot be skipped without its length
+            return
         post_data = self.rfile.read(content_length)
         try:
-            message = json.loads(post_data.decode('utf-8'))
-            if 'type' not in message or 'data' not in message:
-                 self.send_response(400)
-                 self.send_header("Content-Type", "application/json")
-                 self.end_headers()
-                 response_message = {'error': 'Request missing "type" or "data" property'}
-                 self.wfile.write(json.dumps(response_message).encode('utf-8'))
-                 return
-            
-            message_type = message['type']
-            message_data = message['data']
-            
-            self.server.message_pipeline.publish(message_type, message_data) # Send the message to any subscribers
+            # Parse straight from the request bytes, producers may send msgpack by setting the Content-Type
+            payload = codec_for_content_type(self.headers.get('Content-Type')).loads(post_data)
+        except ImportError as e:
+            self._send_json(415, {'error': str(e)})
+            return
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {'error': f'Error receiving message: {e}'})
+            return
+
+        if self.path.split('?')[0].rstrip('/') == '/batch':
+            if not isinstance(payload, list):
+                self._send_json(400, {'error': 'Batch request must be a JSON array of {"type", "data"} messages'})
+                return
+            results = [self._publish_message(message) for message in payload]
+            failed = sum(1 for result in results if result['status'] != 'ok')
+            # 207 tells the producer to look at the individual results
+            self._send_json(200 if not failed else 207, {'accepted': len(results) - failed, 'failed': failed, 'results': results})
+            return
+
+        result = self._publish_message(payload)
+        if result['status'] == 'ok':
+            self._send_json(200, {'message': 'Successfully sent message to subscribers'})
+        elif not isinstance(payload, dict) or 'type' not in payload or 'data' not in payload:
+            self._send_json(400, {'error': result['error']})
+        else:
+            self._send_json(500, {'error': result['error']})
+
+    def do_GET(self):
+        """
+        Handle incoming GET requests.
+        """
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') == '/events':
+            self._stream_events(parse_qs(url.query))
+        elif url.path.rstrip('/') == '/metrics':
+            body = self.server.message_pipeline.metrics_registry.render().encode('utf-8')
             self.send_response(200)
-            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            response_message = {'message': 'Successfully sent message to subscribers'}
-            self.wfile.write(json.dumps(response_message).encode('utf-8'))
-        except Exception as e:
-             self.send_response(500)
-             self.send_header("Content-Type", "application/json")
-             self.end_headers()
-             response_message = {'error': f'Error receiving message: {e}'}
-             self.wfile.write(json.dumps(response_message).encode('utf-8'))
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {'error': f'Unknown path {url.path}'})
+
+    def _stream_events(self, query: Dict[str, list]):
+        """
+        Push events to the client as Server-Sent Events until it disconnects or the pipeline stops.
+
+        Query parameters, both optional and comma separated or repeated:
+            topics: message types to receive, e.g. topics=task_update,request_help
+            task_id: only events about these tasks
+        The first event is a 'snapshot' with the latest known state of every matching task, followed by the live events.
+        """
+        def values(name):
+            found = [value for param in query.get(name, []) for value in param.split(',') if value]
+            return set(found) if found else None
+
+        pipeline = self.server.message_pipeline
+        stream, snapshot = pipeline.open_event_stream(values('topics'), values('task_id'))
+        self.close_connection = True # the stream ends by closing the connection
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self._write_event(snapshot['id'], 'snapshot', snapshot['tasks'])
+            while pipeline.running:
+                event = stream.get(self.heartbeat_interval)
+                if event is None:
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    continue
+                self._write_event(event['id'], event['type'], event['data'])
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client went away
+        finally:
+            pipeline.close_event_stream(stream)
+
+    def _write_event(self, event_id: int, event_type: str, data: Any):
+        """
+        Write a single Server-Sent Event
+        """
+        self.wfile.write(f"id: {event_id}\nevent: {event_type}\ndata: ".encode('utf-8') + get_codec('json').dumps(data) + b"\n\n")
+        self.wfile.flush()
 
     def log_message(self, format, *args):
         """Override default log_message to send output to our logger"""
-        self.server.message_pipeline.logger.info(f'{self.address_string()} - {format%args}')
\ No newline at end of file
+        self.server.message_pipeline.logger.debug('%s - ' + format, self.address_string(), *args)
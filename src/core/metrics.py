@@ -0,0 +1,288 @@
+import math
+import time
+import bisect
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Tuple
+
+# Bucket bounds in seconds, from sub-millisecond store round trips to multi-minute LLM calls and queue waits
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Shards:
+    """
+    Per thread arrays of values. Each thread only ever writes its own array, so recording takes no lock; readers
+    add the arrays up. Arrays of threads that have exited are folded into a base array when collected.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._shards = [] # (weak reference to the owning thread, values)
+        self._retired = [0] * size
+        self._lock = threading.Lock() # only taken when a thread records for the first time and when collecting
+
+    def get(self) -> list:
+        """
+        The values of the calling thread
+        """
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = [0] * self.size
+            self._local.values = values
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), values))
+        return values
+
+    def collect(self) -> list:
+        """
+        The sum over all threads
+        """
+        with self._lock:
+            totals = list(self._retired)
+            alive = []
+            for thread_ref, values in self._shards:
+                for i, value in enumerate(values):
+                    totals[i] += value
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    for i, value in enumerate(values): # the thread is gone, nothing writes to it any more
+                        self._retired[i] += value
+                else:
+                    alive.append((thread_ref, values))
+            self._shards = alive
+        return totals
+
+
+class _Timer:
+    """
+    Context manager that observes the seconds spent in its block
+    """
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class CounterChild:
+    """
+    A counter for one combination of label values.
+    """
+    def __init__(self):
+        self.shards = _Shards(1)
+
+    def inc(self, amount: float = 1):
+        self.shards.get()[0] += amount
+
+    def value(self) -> float:
+        return self.shards.collect()[0]
+
+
+class HistogramChild:
+    """
+    A histogram for one combination of label values, with fixed bucket bounds.
+    """
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.shards = _Shards(len(buckets) + 2) # one count per bucket, the +Inf bucket, then the sum
+
+    def observe(self, value: float):
+        values = self.shards.get()
+        values[bisect.bisect_left(self.buckets, value)] += 1 # bucket bounds are inclusive upper bounds
+        values[-1] += value
+
+    def time(self) -> _Timer:
+        """
+        Observe the duration of a with block
+        """
+        return _Timer(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Cumulative bucket counts, sum and count
+        """
+        values = self.shards.collect()
+        cumulative = []
+        running = 0
+        for count in values[:-1]:
+            running += count
+            cumulative.append(running)
+        return {'buckets': cumulative, 'sum': values[-1], 'count': running}
+
+
+class _Metric(ABC):
+    """
+    A named metric with children per combination of label values.
+    """
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    @abstractmethod
+    def _new_child(self):
+        """
+        A child holding the values of one combination of label values
+        """
+        pass
+
+    def labels(self, *values, **kwargs):
+        """
+        The child for the label values, given in order or by name
+        """
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def samples(self) -> List[tuple]:
+        """
+        (suffix, labels, value) of every sample, for the exposition format
+        """
+        pass
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, such as the number of tasks processed.
+    """
+    type = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def samples(self) -> List[tuple]:
+        return [('', dict(zip(self.labelnames, values)), child.value()) for values, child in list(self.children.items())]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, such as durations, counted into fixed buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def samples(self) -> List[tuple]:
+        samples = []
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelnames, values))
+            snapshot = child.snapshot()
+            for bound, count in zip(self.buckets + (math.inf,), snapshot['buckets']):
+                samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, count))
+            samples.append(('_sum', labels, snapshot['sum']))
+            samples.append(('_count', labels, snapshot['count']))
+        return samples
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(float(value))
+    return repr(float(value))
+
+
+def _escape_help(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, rendered in the Prometheus text exposition format.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered with a different type or labels")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """
+        Returns the counter with this name, creating it on first use
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Returns the histogram with this name, creating it on first use
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (version 0.0.4)
+        """
+        lines = []
+        for metric in sorted(list(self.metrics.values()), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(f'{name}="{_escape_label(str(label))}"' for name, label in labels.items())
+                    lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registry of the process, served on /metrics by HTTPMessagePipeline
+REGISTRY = MetricsRegistry()
+
+QUEUE_WAIT = REGISTRY.histogram('task_queue_wait_seconds', 'Time from a task being queued until an agent starts processing it', ('role',))
+SCHEDULING_DELAY = REGISTRY.histogram('task_scheduling_delay_seconds', 'Time from a task being queued until the scheduler assigns it', ('role',))
+STAGE_TIME = REGISTRY.histogram('task_stage_seconds', 'Time an agent spends processing a task, per stage', ('role', 'outcome'))
+LLM_CALL_TIME = REGISTRY.histogram('llm_call_seconds', 'Duration of LLM calls including retries', ('model', 'outcome'))
+LLM_TOKENS = REGISTRY.counter('llm_tokens_total', 'Tokens processed by the LLM backends', ('model', 'kind'))
+SCHEDULER_TICK = REGISTRY.histogram('scheduler_tick_seconds', 'Duration of one pass of the scheduler over the pending tasks')
+TASKS_ASSIGNED = REGISTRY.counter('scheduler_tasks_assigned_total', 'Tasks assigned to agents by the scheduler', ('role',))
+TASKS_RECLAIMED = REGISTRY.counter('scheduler_tasks_reclaimed_total', 'Tasks queued again after the lease of their agent expired')
+TEST_RUN_TIME = REGISTRY.histogram('test_run_seconds', 'Duration of sandboxed runs of generated tests', ('outcome',))
+TASK_STORE_TIME = REGISTRY.histogram('task_store_seconds', 'Duration of task store round trips', ('operation',))
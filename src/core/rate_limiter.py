@@ -0,0 +1,240 @@
+import time
+import random
+import threading
+from typing import Dict, Any, List
+from utils.logger import get_logger
+
+# Takes from several token buckets at once, either from all of them or from none.
+# KEYS are the buckets, ARGV[1] is 1 to take even when a bucket runs short (used for corrections), followed by
+# rate, capacity and amount for every key. Uses the server clock, so every process sees the same refill.
+# Returns the seconds to wait before the amounts are available, as a string to keep the fraction, '0' when taken.
+TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local force = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local amount = tonumber(ARGV[i * 3 + 1])
+    local state = redis.call('HMGET', KEYS[i], 'level', 'updated')
+    local level = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - updated) * rate)
+    levels[i] = level
+    if force == 0 and level < amount then
+        wait = math.max(wait, (amount - level) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local capacity = tonumber(ARGV[i * 3])
+    local amount = tonumber(ARGV[i * 3 + 1])
+    redis.call('HSET', KEYS[i], 'level', tostring(levels[i] - amount), 'updated', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+
+class _LocalBuckets:
+    """
+    Token buckets in this process.
+    """
+    def __init__(self):
+        self.buckets = {} # key -> [level, updated]
+        self._lock = threading.Lock()
+
+    def take(self, specs: List[tuple], force: bool = False) -> float:
+        """
+        Takes the amounts from the (key, rate, capacity, amount) buckets, returns the seconds to wait or 0 if taken
+        """
+        with self._lock:
+            now = time.monotonic()
+            levels = []
+            wait = 0.0
+            for key, rate, capacity, amount in specs:
+                level, updated = self.buckets.get(key, (capacity, now))
+                level = min(capacity, level + max(0.0, now - updated) * rate)
+                levels.append(level)
+                if not force and level < amount:
+                    wait = max(wait, (amount - level) / rate)
+            if wait > 0:
+                return wait
+            for (key, _, _, amount), level in zip(specs, levels, strict=True):
+                self.buckets[key] = [level - amount, now]
+            return 0.0
+
+    def level(self, key: str, rate: float, capacity: float) -> float:
+        with self._lock:
+            level, updated = self.buckets.get(key, (capacity, time.monotonic()))
+            return min(capacity, level + max(0.0, time.monotonic() - updated) * rate)
+
+
+class _RedisBuckets:
+    """
+    Token buckets in redis, shared by every process using the same keys.
+    """
+    def __init__(self, redis_client, key_prefix: str):
+        self.redis = redis_client
+        self.key_prefix = key_prefix
+        self.script = self.redis.register_script(TAKE_SCRIPT) # runs by hash, falls back to loading the script
+
+    def take(self, specs: List[tuple], force: bool = False) -> float:
+        keys = [f"{self.key_prefix}{key}" for key, _, _, _ in specs]
+        args = [1 if force else 0]
+        for _, rate, capacity, amount in specs:
+            args.extend((rate, capacity, amount))
+        result = self.script(keys=keys, args=args)
+        return float(result.decode('utf-8') if isinstance(result, bytes) else result)
+
+    def level(self, key: str, rate: float, capacity: float) -> float:
+        level, updated = self.redis.hmget(f"{self.key_prefix}{key}", 'level', 'updated')
+        if level is None:
+            return capacity
+        seconds, microseconds = self.redis.time()
+        elapsed = max(0.0, seconds + microseconds / 1e6 - float(updated))
+        return min(capacity, float(level) + elapsed * rate)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limits with a requests per second and a tokens per minute bucket per name, e.g. per model
+    or per backend.
+
+    `limits` maps a name to {'requests_per_second', 'tokens_per_minute', 'burst'}, names without limits are not
+    limited. With a redis client the buckets live in redis and are taken from by an atomic script, so every process
+    using the same redis shares the limits, otherwise they are local to this process.
+
+    Token counts are usually only known after a call, so callers take an estimate up front and correct it with
+    `adjust` once the real count is known. Corrections may leave a bucket in debt, which later callers wait out.
+    """
+    def __init__(self, limits: Dict[str, Dict[str, float]] = None, redis_client=None, key_prefix: str = 'rate_limit:', logger=None):
+        self.limits = {}
+        for name, limit in (limits or {}).items():
+            self.set_limit(name, **limit)
+        self.store = _RedisBuckets(redis_client, key_prefix) if redis_client is not None else _LocalBuckets()
+        self.shared = redis_client is not None
+        self.logger = get_logger("rate_limiter", logger)
+        self.acquired = 0
+        self.throttled = 0 # acquisitions that had to wait
+        self.rejected = 0 # acquisitions that gave up, because they would not wait or the deadline was too close
+        self.waited = 0.0 # total seconds spent waiting
+        self._lock = threading.Lock()
+
+    def set_limit(self, name: str, requests_per_second: float = None, tokens_per_minute: float = None, burst: float = None):
+        """
+        Set or replace the limits of a name, burst is the number of requests that may be made at once (default: one second's worth)
+        """
+        for value in (requests_per_second, tokens_per_minute, burst):
+            if value is not None and value <= 0:
+                raise ValueError(f"Rate limits of '{name}' must be positive")
+        self.limits[name] = {'requests_per_second': requests_per_second, 'tokens_per_minute': tokens_per_minute, 'burst': burst}
+
+    def _specs(self, names: List[str], requests: float, tokens: float) -> List[tuple]:
+        """
+        The (key, rate, capacity, amount) buckets to take from for the names
+        """
+        specs = []
+        for name in names:
+            limit = self.limits.get(name)
+            if not limit:
+                continue
+            rps = limit['requests_per_second']
+            if rps and requests:
+                capacity = limit['burst'] or max(1.0, rps)
+                specs.append((f"{name}:requests", rps, capacity, min(requests, capacity)))
+            tpm = limit['tokens_per_minute']
+            if tpm and tokens:
+                specs.append((f"{name}:tokens", tpm / 60, tpm, min(tokens, tpm))) # a call larger than the bucket waits for a full bucket
+        return specs
+
+    def acquire(self, names: List[str], tokens: float = 0, requests: float = 1, block: bool = True, deadline: float = None) -> bool:
+        """
+        Take one request and the estimated tokens from the buckets of all names, all or nothing.
+
+        Args:
+            names (list): The names to take from, e.g. the model and the backend.
+            tokens (float): Estimated tokens of the call.
+            requests (float): Requests to take, usually 1.
+            block (bool): Wait until the buckets have enough, otherwise return False right away.
+            deadline (float): Absolute time (as from time.time()) after which a blocking acquire gives up.
+
+        Returns:
+            bool: True if taken.
+        """
+        specs = self._specs(names, requests, tokens)
+        if not specs:
+            return True
+        throttled = False
+        while True:
+            try:
+                wait = self.store.take(specs)
+            except Exception as e:
+                # Better to run unthrottled for a moment than to stop every call while redis is unreachable
+                self.logger.warning(f"Rate limiter unavailable, letting the call through: {e}")
+                return True
+            if not wait:
+                with self._lock:
+                    self.acquired += 1
+                    self.throttled += throttled
+                return True
+            if not block or (deadline is not None and time.time() + wait > deadline):
+                with self._lock:
+                    self.rejected += 1
+                self.logger.debug("Rate limit reached for %s, %.2fs until available", names, wait)
+                return False
+            throttled = True
+            wait += random.uniform(0, min(0.05, wait)) # spread out waiters that would all wake at the same time
+            with self._lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def try_acquire(self, names: List[str], tokens: float = 0, requests: float = 1) -> bool:
+        """
+        Take from the buckets if they have enough right now, never waits
+        """
+        return self.acquire(names, tokens, requests, block=False)
+
+    def adjust(self, names: List[str], tokens: float, reserved: float = 0):
+        """
+        Correct the tokens taken for a call once the real count is known. `reserved` is the estimate that was
+        acquired, each bucket is settled against what was really taken from it, since acquire takes at most
+        a full bucket. Without a reservation `tokens` is added as is, negative values give tokens back.
+        """
+        specs = []
+        for key, rate, capacity, _ in self._specs(names, 0, 1):
+            amount = tokens - min(reserved, capacity)
+            if amount:
+                specs.append((key, rate, capacity, amount))
+        if not specs:
+            return
+        try:
+            self.store.take(specs, force=True)
+        except Exception as e:
+            self.logger.warning(f"Could not adjust rate limit tokens: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the limits, what is left in each bucket and how often calls were throttled
+        """
+        buckets = {}
+        for name in self.limits:
+            for key, rate, capacity, _ in self._specs([name], 1, 1):
+                try:
+                    buckets[key] = {'available': self.store.level(key, rate, capacity), 'capacity': capacity}
+                except Exception as e:
+                    buckets[key] = {'error': str(e)}
+        return {
+            'shared': self.shared,
+            'limits': self.limits,
+            'buckets': buckets,
+            'acquired': self.acquired,
+            'throttled': self.throttled,
+            'rejected': self.rejected,
+            'seconds_waited': self.waited
+        }
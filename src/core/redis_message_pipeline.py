@@ -0,0 +1,283 @@
+import redis
+import os
+import socket
+import threading
+from typing import Dict, Any, List
+from core.codec import get_codec, decode
+from utils.logger import get_logger
+
+class RedisStreamMessagePipeline:
+    """
+    Message pipeline backed by Redis Streams, with the same publish/subscribe API as HTTPMessagePipeline.
+
+    Every message type is a stream. This process reads the streams it subscribes to through a consumer group,
+    in batches, and acknowledges each batch once the handlers have run. Processes sharing a group split the events
+    between them, processes with their own group each get every event. Messages that were delivered but never
+    acknowledged, e.g. because the process crashed, are delivered again when it restarts, give the consumer a stable
+    name for that. Messages left pending by consumers that never came back are claimed once they have been idle
+    for `claim_idle_ms`. Both happen for a stream when it is first subscribed, whether before or after start.
+
+    There is no HTTP server, so the /events stream and /metrics of HTTPMessagePipeline are not available.
+    Observers can read the streams directly, e.g. with XREAD on messages:task_update.
+    """
+
+    def __init__(self, host='localhost', port=6379, db=0, group='agents', consumer=None, stream_prefix='messages:',
+                 batch_size=100, block_ms=1000, max_len=100000, start_id='$', claim_idle_ms=60000, logger=None, redis_client=None,
+                 codec: str = 'json'):
+        self.redis = redis_client or redis.Redis(host=host, port=port, db=db)
+        self.codec = get_codec(codec) # messages are tagged, so consumers read any codec a publisher used
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}" # unique name within the group
+        self.stream_prefix = stream_prefix
+        self.batch_size = batch_size # max messages per XREADGROUP call
+        self.block_ms = block_ms # how long a read waits for new messages
+        self.max_len = max_len # streams are trimmed to roughly this many messages
+        self.start_id = start_id # where a new group starts reading, '$' for new messages only, '0' for the whole stream
+        self.claim_idle_ms = claim_idle_ms # messages pending this long on another consumer are taken over at start
+        self.logger = get_logger("redis_message_pipeline", logger)
+        self.message_handlers = {} # store handlers for messages
+        self._recovering = set() # message types whose unacknowledged messages are still to be handled again
+        self._lock = threading.Lock() # guards message_handlers and _recovering, the consumer thread reads them
+        self.running = False
+        self.consumer_thread = None
+        self.delivered = 0
+        self.acknowledged = 0
+        self.errors = 0
+        self.last_ids = {} # message type -> id of the last message handled
+
+    def _stream(self, message_type: str) -> str:
+        return f"{self.stream_prefix}{message_type}"
+
+    def _ensure_group(self, message_type: str):
+        """
+        Create the consumer group for a message type if it doesn't exist yet
+        """
+        try:
+            self.redis.xgroup_create(self._stream(message_type), self.group, id=self.start_id, mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e): # the group already exists
+                raise
+
+    def start(self):
+        """
+        Start consuming the subscribed streams
+        """
+        if self.running:
+            self.logger.warning("Consumer already running, ignoring command")
+            return
+        self.running = True
+        with self._lock:
+            self._recovering.update(self.message_handlers) # a previous run may have stopped with messages pending
+        self.consumer_thread = threading.Thread(target=self._run)
+        self.consumer_thread.daemon = True # So that the thread closes when the main program closes
+        self.consumer_thread.start()
+        self.logger.info(f"Message Pipeline consuming redis streams as {self.group}/{self.consumer}")
+
+    def stop(self):
+        """
+        Stop consuming, the current batch is finished and acknowledged first
+        """
+        if not self.running:
+            self.logger.warning("Consumer not running, ignoring command")
+            return
+        self.running = False
+        self.consumer_thread.join()
+        self.logger.info("Message Pipeline stopped.")
+
+    def subscribe(self, message_type: str, handler):
+        """
+        Subscribe to a certain type of message
+        """
+        self._ensure_group(message_type)
+        with self._lock:
+            if message_type in self.message_handlers:
+                self.message_handlers[message_type].append(handler)
+            else:
+                self.message_handlers[message_type] = [handler]
+                self._recovering.add(message_type) # the consumer first handles what is pending on the stream
+        self.logger.info(f"Subscribed to message type: {message_type}")
+
+    def unsubscribe(self, message_type: str, handler):
+        """
+        Unsubscribe from message type
+        """
+        with self._lock:
+            subscribed = message_type in self.message_handlers and handler in self.message_handlers[message_type]
+            if subscribed:
+                self.message_handlers[message_type].remove(handler)
+                if not self.message_handlers[message_type]:
+                    del self.message_handlers[message_type]
+                    self._recovering.discard(message_type)
+        if subscribed:
+            self.logger.info(f"Unsubscribed from message type: {message_type}")
+        else:
+            self.logger.warning(f"No handler '{handler}' subscribed to message type: {message_type}")
+
+    def publish(self, message_type: str, message_data: Dict[str, Any]) -> str:
+        """
+        Publish a message to the stream of its type, returns the id of the message
+        """
+        message_id = self.redis.xadd(self._stream(message_type), {'data': self.codec.encode(message_data)}, maxlen=self.max_len, approximate=True)
+        self.logger.debug("Published message of type '%s'", message_type)
+        return message_id.decode('utf-8') if isinstance(message_id, bytes) else message_id
+
+    def publish_batch(self, messages: List[Dict[str, Any]]):
+        """
+        Publish a list of {type, data} messages in one round trip
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for message in messages:
+            pipe.xadd(self._stream(message['type']), {'data': self.codec.encode(message['data'])}, maxlen=self.max_len, approximate=True)
+        pipe.execute()
+
+    def replay_from(self, message_type: str, message_id: str = '0'):
+        """
+        Move the group back (or forward) to a message id, every message after it is delivered again.
+        Use '0' to replay the whole stream that is still retained.
+        """
+        self._ensure_group(message_type)
+        self.redis.xgroup_setid(self._stream(message_type), self.group, message_id)
+        self.logger.info(f"Replaying message type '{message_type}' from id {message_id}")
+
+    def _run(self):
+        """
+        Consumer loop, finishes the messages left unacknowledged on newly subscribed streams, then reads new ones
+        """
+        try:
+            while self.running:
+                self._recover()
+                self._read_batch('>')
+        except Exception as e:
+            self.logger.exception(f"Message Pipeline consumer stopped: {e}")
+            self.running = False
+
+    def _recover(self):
+        """
+        Handle the messages pending on the streams subscribed since the last pass, claimed from abandoned consumers
+        or left unacknowledged by a previous run of this one
+        """
+        with self._lock:
+            message_types = list(self._recovering)
+            self._recovering.clear()
+        for message_type in message_types:
+            self._claim_abandoned(message_type)
+            while self.running and self._read_batch('0', [message_type]):
+                pass
+            if not self.running: # stopped halfway, the next start picks it up again
+                with self._lock:
+                    self._recovering.add(message_type)
+
+    def _claim_abandoned(self, message_type: str):
+        """
+        Take over messages of a type that other consumers of the group received but never acknowledged
+        """
+        try:
+            cursor = '0-0'
+            while True:
+                # not justid, redis-py drops the cursor from that reply. The claimed messages are read again as pending.
+                result = self.redis.xautoclaim(self._stream(message_type), self.group, self.consumer, self.claim_idle_ms,
+                                               start_id=cursor, count=self.batch_size)
+                cursor = result[0].decode('utf-8') if isinstance(result[0], bytes) else result[0]
+                if cursor == '0-0': # scanned the whole pending list
+                    break
+        except redis.exceptions.ResponseError as e:
+            self.logger.warning(f"Could not claim abandoned messages of type '{message_type}': {e}")
+
+    def _read_batch(self, read_id: str, message_types: List[str] = None) -> int:
+        """
+        Read and handle one batch from the given or else every subscribed stream, returns the number of messages read.
+        `read_id` is '>' for new messages or '0' for messages this consumer has pending.
+        """
+        if message_types is None:
+            with self._lock:
+                message_types = list(self.message_handlers)
+        if not message_types:
+            threading.Event().wait(self.block_ms / 1000)
+            return 0
+        streams = {self._stream(message_type): read_id for message_type in message_types}
+        try:
+            response = self.redis.xreadgroup(self.group, self.consumer, streams, count=self.batch_size,
+                                             block=self.block_ms if read_id == '>' else None)
+        except redis.exceptions.ResponseError as e:
+            if 'NOGROUP' not in str(e):
+                raise
+            for message_type in message_types: # the stream was deleted, recreate the group
+                self._ensure_group(message_type)
+            return 0
+
+        read = 0
+        pipe = self.redis.pipeline(transaction=False)
+        for stream, messages in response or []:
+            stream = stream.decode('utf-8') if isinstance(stream, bytes) else stream
+            message_type = stream[len(self.stream_prefix):]
+            ids = []
+            for message_id, fields in messages:
+                ids.append(message_id)
+                if not fields: # the message was trimmed from the stream while pending
+                    continue
+                self._dispatch(message_type, fields)
+            if ids:
+                read += len(ids)
+                pipe.xack(stream, self.group, *ids)
+                last_id = ids[-1]
+                self.last_ids[message_type] = last_id.decode('utf-8') if isinstance(last_id, bytes) else last_id
+                self.acknowledged += len(ids)
+        if read:
+            pipe.execute() # acknowledge the whole batch in one round trip
+        return read
+
+    def _dispatch(self, message_type: str, fields: Dict[Any, Any]):
+        """
+        Decode a stream entry and pass it to the handlers.
+        A failing handler is logged and the message still acknowledged, so one bad message can't block the stream.
+        """
+        raw = fields.get(b'data', fields.get('data'))
+        try:
+            message_data = decode(raw)
+        except (TypeError, ValueError) as e:
+            self.errors += 1
+            self.logger.error(f"Could not decode message of type '{message_type}': {e}")
+            return
+        with self._lock:
+            handlers = list(self.message_handlers.get(message_type, []))
+        for handler in handlers:
+            try:
+                handler(message_data)
+            except Exception as e:
+                self.errors += 1
+                self.logger.exception(f"Handler {getattr(handler, '__name__', handler)} failed on '{message_type}' message: {e}")
+        self.delivered += 1
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the status of the pipeline, including how far behind the group is on each stream
+        """
+        streams = {}
+        with self._lock:
+            message_types = list(self.message_handlers)
+        for message_type in message_types:
+            try:
+                info = self.redis.xpending(self._stream(message_type), self.group)
+                streams[message_type] = {
+                    'pending': info.get('pending', 0) if isinstance(info, dict) else info[0],
+                    'length': self.redis.xlen(self._stream(message_type)),
+                    'last_id': self.last_ids.get(message_type)
+                }
+            except redis.exceptions.RedisError as e:
+                streams[message_type] = {'error': str(e)}
+        return {
+            'running': self.running,
+            'group': self.group,
+            'consumer': self.consumer,
+            'delivered': self.delivered,
+            'acknowledged': self.acknowledged,
+            'errors': self.errors,
+            'streams': streams
+        }
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
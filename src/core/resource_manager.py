@@ -1,33 +1,40 @@
 import psutil
-import torch
-import logging
+import threading
 from typing import Dict, Any
 from utils.config import get_config_value
+from core.resource_sampler import ResourceSampler
+from core.gpu_provider import get_gpu_provider
+from core.agent_usage import RollingUsage
+from utils.logger import get_logger
 
 class ResourceManager:
     """
     Manages system resources and agent availability.
+
+    Resources are sampled by a background thread (see `start_sampling`), readers get the latest snapshot and
+    scheduling decisions use the average over the last few samples, so neither costs a system call per task.
     """
 
-    def __init__(self, config: Dict[str, Any], logger=None):
+    def __init__(self, config: Dict[str, Any], logger=None, llm_telemetry=None, gpu_provider=None, rate_limiter=None):
          self.config = config
-         if logger:
-              self.logger = logger
-         else:
-              self.logger = logging.getLogger("resource_manager")
-              self.logger.setLevel(logging.DEBUG)
-              ch = logging.StreamHandler()
-              formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-              ch.setFormatter(formatter)
-              self.logger.addHandler(ch)
+         self.llm_telemetry = llm_telemetry # LLM call statistics, shared with the ollama client
+         self.logger = get_logger("resource_manager", logger)
+         self.usage_window = get_config_value(self.config, 'agent_usage_window', 100) # tasks kept in the rolling usage summaries
          self.agent_resources = {} # Track resource usage of agents by agent_id
-         self.api_limit = get_config_value(self.config, 'api_limit', 10)
-         self.api_count = 0 # track how many api calls have been made
+         self.role_resources = {} # and by role, e.g. all junior devs together
+         self._usage_lock = threading.Lock()
+         self.rate_limiter = rate_limiter # LLM rate limits, shared with the ollama client
+         # GPU memory is read through a provider, 'auto', 'torch', 'nvidia-smi' or 'none'
+         self.gpu_provider = gpu_provider or get_gpu_provider(get_config_value(self.config, 'gpu_provider', 'auto'), logger=self.logger)
          self.max_memory = self._get_total_memory()
          self.max_vram = self._get_total_vram()
          self.logger.info(f'Total Memory: {self.max_memory:.2f} GB')
          if self.max_vram:
               self.logger.info(f'Total VRAM: {self.max_vram:.2f} GB')
+         self.sample_interval = get_config_value(self.config, 'resource_sample_interval', 1.0) # seconds between samples
+         self.smoothing_samples = get_config_value(self.config, 'resource_smoothing_samples', 5) # samples averaged for scheduling
+         self.sampler = ResourceSampler(self._sample_resources, interval=self.sample_interval,
+                                        history_size=get_config_value(self.config, 'resource_history_size', 300), logger=self.logger)
          self.model_resource_map = {
              'llama-2-7b': {'memory': 2.0, 'vram': 2.0},
              'llama-2-13b': {'memory': 8.0, 'vram': 8.0},
@@ -47,38 +54,79 @@ class ResourceManager:
         """
         Get the total GPU memory (VRAM), will return none if there is no vram to monitor
         """
-        if torch.cuda.is_available():
-             try:
-                total_vram = torch.cuda.get_device_properties(0).total_memory
-                return total_vram / (1024 ** 3)
-             except Exception as e:
-                  self.logger.warning(f'Error getting VRAM: {e}')
-                  return None
-        else:
-            self.logger.info("CUDA is not available on this system, skipping VRAM monitoring.")
+        try:
+            memory = self.gpu_provider.memory_info()
+        except Exception as e:
+            self.logger.warning(f'Error getting VRAM: {e}')
             return None
+        if memory is None:
+            self.logger.info(f"No GPU found by the '{self.gpu_provider.name}' provider, skipping VRAM monitoring.")
+            return None
+        return memory[1] / (1024 ** 3)
+
     def track_agent_resource(self, agent_id, resource_usage: Dict[str, Any]):
         """
-        Track the resource usage of a specific agent.
+        Track the resource usage of a task run by a specific agent, see RollingUsage for the fields.
+        """
+        role = resource_usage.get('role', 'unknown')
+        with self._usage_lock:
+            if agent_id not in self.agent_resources:
+                self.agent_resources[agent_id] = RollingUsage(self.usage_window)
+            if role not in self.role_resources:
+                self.role_resources[role] = RollingUsage(self.usage_window)
+        self.agent_resources[agent_id].record(resource_usage)
+        self.role_resources[role].record(resource_usage)
+        self.logger.debug("Tracked resources for agent %s: %s", agent_id, resource_usage)
+
+    def get_agent_summaries(self) -> Dict[str, Any]:
         """
-        self.agent_resources[agent_id] = resource_usage
-        self.logger.debug(f"Tracked resources for agent {agent_id}: {resource_usage}")
+        Rolling usage summary of every agent, by agent_id
+        """
+        return {agent_id: usage.summary for agent_id, usage in list(self.agent_resources.items())}
 
-    def get_available_resources(self) -> Dict[str, Any]:
+    def get_role_summaries(self) -> Dict[str, Any]:
+        """
+        Rolling usage summary of every role
+        """
+        return {role: usage.summary for role, usage in list(self.role_resources.items())}
+
+    def get_role_resource_usage(self, role: str) -> Dict[str, Any]:
+        """
+        Get the rolling usage summary of a role.
+        """
+        if role in self.role_resources:
+            return self.role_resources[role].summary
+        return {}
+
+    def start_sampling(self):
+        """
+        Start sampling resources in the background
+        """
+        self.sampler.start()
+
+    def stop_sampling(self):
+        """
+        Stop the background sampling
+        """
+        self.sampler.stop()
+
+    def _sample_resources(self) -> Dict[str, Any]:
         """
-        Get available system resources.
+        Read the current system resources, called by the sampler
         """
-        cpu_percent = psutil.cpu_percent()
+        cpu_percent = psutil.cpu_percent() # usage since the previous call, i.e. over the last sample interval
         memory_usage = psutil.virtual_memory()
         memory_percent = memory_usage.percent
         available_memory = (memory_usage.available / (1024 ** 3))
         vram_percent = 0
         available_vram = 0
-        if torch.cuda.is_available():
+        if self.max_vram:
              try:
-                vram = torch.cuda.memory_summary()
-                vram_percent = vram['reserved_max'] / vram['total'] * 100
-                available_vram = (vram['total']-vram['reserved_max'])/(1024**3)
+                memory = self.gpu_provider.memory_info()
+                if memory:
+                    free, total = memory
+                    vram_percent = (total - free) / total * 100
+                    available_vram = free / (1024 ** 3)
              except Exception as e:
                   self.logger.warning(f'Error getting available vram: {e}')
 
@@ -87,17 +135,46 @@ class ResourceManager:
             'memory_percent': memory_percent,
             'available_memory': available_memory,
             'vram_percent': vram_percent,
-            'available_vram': available_vram,
-            'agents': self.agent_resources # Add the agent resources
+            'available_vram': available_vram
         }
 
+    def _snapshot(self) -> Dict[str, Any]:
+        """
+        Latest sample, sampled on the spot if the sampler has not produced one yet
+        """
+        snapshot = self.sampler.snapshot
+        if snapshot is None or not self.sampler.running:
+            snapshot = self.sampler.sample_now()
+        return snapshot
+
+    def get_available_resources(self) -> Dict[str, Any]:
+        """
+        Get available system resources, from the latest sample.
+        """
+        return {
+            **self._snapshot(),
+            'agents': self.get_agent_summaries() # Add the agent resources
+        }
+
+    def get_smoothed_resources(self) -> Dict[str, Any]:
+        """
+        Get available system resources averaged over the last `resource_smoothing_samples` samples
+        """
+        self._snapshot() # make sure there is at least one sample
+        return {column: self.sampler.history.mean(column, self.smoothing_samples) for column in self.sampler.COLUMNS}
+
+    def get_resource_trends(self, samples: int = 60) -> Dict[str, Any]:
+        """
+        Get how fast each resource is changing over the last samples, in units per second
+        """
+        return {column: self.sampler.history.slope(column, samples) for column in self.sampler.COLUMNS}
 
     def get_agent_resource_usage(self, agent_id: str) -> Dict[str, Any]:
         """
         Get the resource usage for a particular agent.
         """
         if agent_id in self.agent_resources:
-            return self.agent_resources[agent_id]
+            return self.agent_resources[agent_id].summary
         return {}
 
 
@@ -107,22 +184,24 @@ class ResourceManager:
         """
         resource_requirements = task_details.get("resource_requirements", {}) # Default empty dict
         if not resource_requirements:
-            self.logger.info(f"Task {task_details.get('task_id', 'Unknown')} has no resource requirements")
+            self.logger.info("Task %s has no resource requirements", task_details.get('task_id', 'Unknown'))
             return True # no resource requirements
 
         model = resource_requirements.get('model', 'default')  # Default small model
         required_resources = self.get_model_resources(model)
-        available_resources = self.get_available_resources()
+        available_resources = self.get_smoothed_resources() # a single spike or dip shouldn't decide the schedule
 
         if available_resources['available_memory'] < required_resources['memory']:
-            self.logger.warning(f"Not enough memory for task {task_details.get('task_id', 'Unknown')}: Required {required_resources['memory']:.2f} GB, available {available_resources['available_memory']:.2f} GB")
+            self.logger.warning("Not enough memory for task %s: Required %.2f GB, available %.2f GB",
+                                task_details.get('task_id', 'Unknown'), required_resources['memory'], available_resources['available_memory'])
             return False
         
-        if torch.cuda.is_available() and available_resources['available_vram'] < required_resources['vram']: # Check vram if available
-            self.logger.warning(f"Not enough VRAM for task {task_details.get('task_id', 'Unknown')}: Required {required_resources['vram']:.2f} GB, available {available_resources['available_vram']:.2f} GB")
+        if self.max_vram and available_resources['available_vram'] < required_resources['vram']: # Check vram if available
+            self.logger.warning("Not enough VRAM for task %s: Required %.2f GB, available %.2f GB",
+                                task_details.get('task_id', 'Unknown'), required_resources['vram'], available_resources['available_vram'])
             return False
 
-        self.logger.info(f"Resources available for task {task_details.get('task_id', 'Unknown')}")
+        self.logger.debug("Resources available for task %s", task_details.get('task_id', 'Unknown'))
         return True
 
     def get_model_resources(self, model_size: str) -> Dict[str, float]:
@@ -131,27 +210,20 @@ class ResourceManager:
          """
          return self.model_resource_map.get(model_size, self.model_resource_map.get('default'))
 
-    def check_api_usage(self) -> bool:
-         """
-         Checks if there are more api calls available, returns true if there are
-         """
-         return self.api_count < self.api_limit
-
-    def increment_api_usage(self):
-         """
-         Increments the number of api calls
-         """
-         self.api_count += 1
-
     def get_status(self) -> Dict[str, Any]:
         """
         Returns the current status of the resource manager.
         """
         return {
-            'api_calls_made': self.api_count,
-            'max_api_calls': self.api_limit,
+            'rate_limits': self.rate_limiter.get_status() if self.rate_limiter else {},
             'total_memory': self.max_memory,
             'total_vram': self.max_vram,
+            'gpu': self.gpu_provider.get_status(),
             'available_resources': self.get_available_resources(),
-            'model_resource_map': self.model_resource_map # return the current models, and resource usage
+            'smoothed_resources': self.get_smoothed_resources(),
+            'resource_trends': self.get_resource_trends(),
+            'sampler': self.sampler.get_status(),
+            'roles': self.get_role_summaries(),
+            'model_resource_map': self.model_resource_map, # return the current models, and resource usage
+            'llm_stats': self.llm_telemetry.get_status() if self.llm_telemetry else {}
         }
\ No newline at end of file
@@ -0,0 +1,168 @@
+import time
+import threading
+from array import array
+from typing import Dict, Any, Callable
+from utils.logger import get_logger
+
+class RingBuffer:
+    """
+    Fixed size time series of float samples, stored column wise in preallocated arrays.
+    Appending overwrites the oldest sample once the buffer is full.
+    """
+    def __init__(self, capacity: int, columns: tuple):
+        self.capacity = capacity
+        self.columns = columns
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.data = {column: array('d', bytes(8 * capacity)) for column in columns}
+        self.next_index = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp: float, values: Dict[str, float]):
+        """
+        Add a sample, missing columns are stored as 0
+        """
+        with self._lock:
+            index = self.next_index
+            self.timestamps[index] = timestamp
+            for column in self.columns:
+                self.data[column][index] = values.get(column) or 0.0
+            self.next_index = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def _indexes(self, last: int) -> range:
+        """
+        Buffer indexes of the last n samples, oldest first, must be called with the lock held
+        """
+        n = min(last, self.count)
+        start = (self.next_index - n) % self.capacity
+        return range(start, start + n)
+
+    def window(self, column: str, last: int) -> list:
+        """
+        The last n values of a column, oldest first
+        """
+        with self._lock:
+            values = self.data[column]
+            return [values[i % self.capacity] for i in self._indexes(last)]
+
+    def mean(self, column: str, last: int) -> float | None:
+        """
+        Mean of the last n values of a column
+        """
+        values = self.window(column, last)
+        return sum(values) / len(values) if values else None
+
+    def slope(self, column: str, last: int) -> float | None:
+        """
+        Least squares trend of the last n values of a column, in units per second
+        """
+        with self._lock:
+            indexes = [i % self.capacity for i in self._indexes(last)]
+            xs = [self.timestamps[i] for i in indexes]
+            ys = [self.data[column][i] for i in indexes]
+        if len(xs) < 2:
+            return None
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        denominator = sum((x - mean_x) ** 2 for x in xs)
+        if not denominator:
+            return None
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+
+    def to_dict(self, last: int = None) -> Dict[str, list]:
+        """
+        The samples as lists per column, oldest first
+        """
+        with self._lock:
+            indexes = [i % self.capacity for i in self._indexes(last or self.capacity)]
+            result = {'timestamp': [self.timestamps[i] for i in indexes]}
+            for column in self.columns:
+                result[column] = [self.data[column][i] for i in indexes]
+        return result
+
+    def __len__(self):
+        return self.count
+
+
+class ResourceSampler:
+    """
+    Samples system resources on a background thread.
+
+    Readers get the latest snapshot without sampling themselves, and recent samples are kept in a ring buffer so
+    callers can use smoothed values and trends instead of a single noisy reading.
+    """
+    COLUMNS = ('cpu_percent', 'memory_percent', 'available_memory', 'vram_percent', 'available_vram')
+
+    def __init__(self, sample_function: Callable[[], Dict[str, Any]], interval: float = 1.0, history_size: int = 300, logger=None):
+        self.sample_function = sample_function
+        self.interval = interval
+        self.history = RingBuffer(history_size, self.COLUMNS)
+        self.logger = get_logger("resource_sampler", logger)
+        self.snapshot = None # latest sample, replaced as a whole so readers never see a partial update
+        self.samples_taken = 0
+        self.last_sample_duration = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample_now(self) -> Dict[str, Any]:
+        """
+        Take a sample on the calling thread and record it
+        """
+        started = time.time()
+        sample = self.sample_function()
+        sample['timestamp'] = started
+        self.history.append(started, sample)
+        self.snapshot = sample
+        self.samples_taken += 1
+        self.last_sample_duration = time.time() - started
+        return sample
+
+    def start(self):
+        """
+        Start sampling in the background, the first sample is taken right away so a snapshot is always available
+        """
+        if self._thread and self._thread.is_alive():
+            self.logger.warning("Resource sampler already running, ignoring command")
+            return
+        self.sample_now()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler")
+        self._thread.daemon = True # so that the thread closes when the main program closes
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background sampling
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        """
+        Background sampling loop
+        """
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample_now()
+            except Exception as e:
+                self.logger.warning("Error sampling resources: %s", e)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the state of the sampler
+        """
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples_taken': self.samples_taken,
+            'history_size': len(self.history),
+            'last_sample_duration': self.last_sample_duration,
+            'snapshot_age': time.time() - self.snapshot['timestamp'] if self.snapshot else None
+        }
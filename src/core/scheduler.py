@@ -0,0 +1,181 @@
+import time
+import threading
+from typing import Dict, Any, List
+from core import metrics
+from utils.logger import get_logger
+
+class Scheduler:
+    """
+    Assigns pending tasks to idle agents.
+
+    Agents are grouped in pools by the model prefix they serve, a task goes to the first idle agent of the first pool
+    whose prefix its model starts with ('' matches every model). A task with a 'role' goes to the agents of that role
+    instead, wherever they are pooled. A task is only assigned once all its dependencies are completed and the
+    resource manager reports enough resources for its model.
+
+    An assigned task is leased to its agent for `lease_ttl` seconds, the agent renews the lease while it works on the
+    task. Every pass first queues the tasks whose lease expired again, so a crashed agent holds up its task for at
+    most one lease period. A task queued again is published as a task_update, so agents that pick their own tasks,
+    like the architect, see it is open again.
+    """
+    def __init__(self, task_queue, resource_manager, pools: List[tuple], logger=None, interval: float = 1.0,
+                 task_deadlines: Dict[str, float] = None, default_task_deadline: float = 600, lease_ttl: float = 60.0,
+                 message_pipeline=None):
+        self.task_queue = task_queue
+        self.resource_manager = resource_manager
+        self.message_pipeline = message_pipeline
+        self.pools = pools # [(model prefix, [agents])], checked in order
+        self.interval = interval # seconds between passes over the pending tasks
+        # LLM call deadlines by task priority, e.g. {"1": 600, "2": 300}, so urgent work fails over sooner
+        self.task_deadlines = {str(priority): seconds for priority, seconds in (task_deadlines or {}).items()}
+        self.default_task_deadline = default_task_deadline
+        self.lease_ttl = lease_ttl # seconds an agent keeps a task without renewing its lease
+        self.logger = get_logger("scheduler", logger)
+        self.running = False
+        self.thread = None
+        self.ticks = 0
+        self.assigned = 0
+        self.reclaimed = 0
+        self.last_tick_duration = 0.0
+
+    def start(self):
+        """
+        Start scheduling in its own thread
+        """
+        if self.running:
+            self.logger.warning("Scheduler already running, ignoring command")
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop scheduling after the current pass
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Main function for scheduling tasks
+        """
+        while self.running:
+            started = time.perf_counter()
+            with metrics.SCHEDULER_TICK.time():
+                try:
+                    self.tick()
+                except Exception as e:
+                    self.logger.exception("Scheduler pass failed: %s", e)
+            self.last_tick_duration = time.perf_counter() - started
+            self.ticks += 1
+            time.sleep(self.interval)
+
+    def task_deadline(self, task: Dict[str, Any]) -> float:
+        """
+        Absolute deadline for the LLM calls of a task, derived from its priority
+        """
+        return time.time() + self.task_deadlines.get(str(task.get('priority', 1)), self.default_task_deadline)
+
+    def pool_for(self, task: Dict[str, Any]) -> list:
+        """
+        The agents that can run a task
+        """
+        if task.get('role'):
+            return [agent for _, agents in self.pools for agent in agents if agent.role == task['role']]
+        model = task.get('resource_requirements', {}).get('model', '')
+        for prefix, agents in self.pools:
+            if model.startswith(prefix):
+                return agents
+        return []
+
+    def dependencies_complete(self, task: Dict[str, Any]) -> bool:
+        """
+        Returns true if every dependency of the task has completed
+        """
+        for dep in task.get('dependencies') or []:
+            dep_task = self.task_queue.get(dep)
+            if not dep_task or dep_task['status'] != 'completed':
+                return False
+        return True
+
+    def tick(self):
+        """
+        One pass over the pending tasks
+        """
+        self.reclaim_expired()
+        pending_tasks = [task for task in self.task_queue.values() if task['status'] == 'pending']
+        for task in pending_tasks:
+            if task['assigned_agent']: # already waiting for its agent
+                continue
+            if not self.resource_manager.can_run_task(task):
+                self.logger.info("Skipping task %s, not enough resources", task['task_id'])
+                continue
+            if not self.dependencies_complete(task):
+                self.logger.debug("Skipping task %s, not all dependencies have been resolved.", task['task_id'])
+                continue
+            agent = next((agent for agent in self.pool_for(task) if agent.is_active is False), None)
+            if agent is None:
+                self.logger.debug("Skipping task %s, no idle agent for model %s", task['task_id'], task.get('resource_requirements', {}).get('model'))
+                continue
+            self.assign_task(task, agent)
+
+    def reclaim_expired(self):
+        """
+        Queues the tasks whose lease expired again, keeping their attempts and checkpoints
+        """
+        for task_id, owner in self.task_queue.expired_leases():
+            task = self.task_queue.get(task_id)
+            if not task or task['status'] not in ('pending', 'in_progress') or task.get('assigned_agent') != owner:
+                continue # finished, paused or handed to someone else since the lease was taken
+            self.logger.warning("Lease of agent %s on task %s expired, queueing it again", owner, task_id)
+            task['status'] = 'pending'
+            task['assigned_agent'] = None
+            task['queued_at'] = time.time()
+            task['reclaimed'] = task.get('reclaimed', 0) + 1
+            task.pop('deadline', None)
+            self.task_queue.set(task_id, task)
+            metrics.TASKS_RECLAIMED.inc()
+            self.reclaimed += 1
+            if self.message_pipeline:
+                self.message_pipeline.publish('task_update', {
+                    'task_id': task_id,
+                    'status': 'pending',
+                    'agent_id': None, # no agent holds it any more
+                    'role': task.get('role')
+                })
+
+    def assign_task(self, task: Dict[str, Any], agent):
+        """
+        Hand a task to an agent, leasing it to the agent until it starts work and takes over renewing the lease
+        """
+        if not self.task_queue.acquire_lease(task['task_id'], agent.id, self.lease_ttl):
+            self.logger.warning("Task %s is still leased to another agent, not assigning it", task['task_id'])
+            return
+        now = time.time()
+        task['assigned_agent'] = agent.id
+        task['deadline'] = self.task_deadline(task)
+        task['assigned_at'] = now
+        agent.start_task(task['task_id'])
+        self.task_queue.set(task['task_id'], task)
+        queued_at = task.get('queued_at') or task.get('created_at')
+        if queued_at:
+            metrics.SCHEDULING_DELAY.labels(agent.role).observe(max(0.0, now - queued_at))
+        metrics.TASKS_ASSIGNED.labels(agent.role).inc()
+        self.assigned += 1
+        self.logger.info("Assigned task '%s' to %s", task['task_id'], agent.name)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the status of the scheduler
+        """
+        return {
+            'running': self.running,
+            'ticks': self.ticks,
+            'assigned': self.assigned,
+            'reclaimed': self.reclaimed,
+            'last_tick_duration': self.last_tick_duration
+        }
@@ -1,46 +1,282 @@
 import redis
-import json
 from typing import Dict, Any
+from core.codec import get_codec, decode
+from core.metrics import TASK_STORE_TIME
+
+# Bookkeeping keys live under this prefix and are never returned as tasks
+META_PREFIX = 'meta:'
+STATUS_COUNTS_KEY = f'{META_PREFIX}task_status_counts' # status -> number of tasks
+STATUS_INDEX_KEY = f'{META_PREFIX}task_status' # task id -> status, so a write knows which count to move
+LEASES_KEY = f'{META_PREFIX}task_leases' # sorted set of task ids by lease expiry in ms
+LEASE_OWNERS_KEY = f'{META_PREFIX}task_lease_owners' # task id -> id of the agent holding the lease
+CHECKPOINT_PREFIX = f'{META_PREFIX}checkpoint:' # hash per task, step -> output saved while the task runs
+
+# Current time of the server in ms, so every client expires leases by the same clock
+_NOW = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+"""
+
+# Writes a task and moves it between the status counts in one step
+SET_SCRIPT = """
+local old = redis.call('HGET', KEYS[3], ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1])
+if old ~= ARGV[3] then
+    if old then
+        redis.call('HINCRBY', KEYS[2], old, -1)
+    end
+    redis.call('HINCRBY', KEYS[2], ARGV[3], 1)
+    redis.call('HSET', KEYS[3], ARGV[2], ARGV[3])
+end
+return old
+"""
+
+# Deletes a task and removes it from the status counts, along with its lease and checkpoints
+DELETE_SCRIPT = """
+local old = redis.call('HGET', KEYS[3], ARGV[1])
+redis.call('DEL', KEYS[1], KEYS[6])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[5], ARGV[1])
+if old then
+    redis.call('HINCRBY', KEYS[2], old, -1)
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+return old
+"""
+
+# Takes the lease of a task for an agent, unless another agent holds it and it hasn't expired. Returns 1 if taken.
+ACQUIRE_LEASE_SCRIPT = _NOW + """
+local owner = redis.call('HGET', KEYS[2], ARGV[1])
+if owner and owner ~= ARGV[2] then
+    local expiry = redis.call('ZSCORE', KEYS[1], ARGV[1])
+    if expiry and tonumber(expiry) > now then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+# Extends a lease if the agent still holds it. Returns 1 if extended.
+RENEW_LEASE_SCRIPT = _NOW + """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+# Gives up a lease if the agent still holds it. Returns 1 if released.
+RELEASE_LEASE_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Removes up to ARGV[1] expired leases and returns them as task id, owner pairs, so each is reclaimed only once
+EXPIRED_LEASES_SCRIPT = _NOW + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+local result = {}
+for _, task_id in ipairs(expired) do
+    result[#result + 1] = task_id
+    result[#result + 1] = redis.call('HGET', KEYS[2], task_id) or ''
+    redis.call('ZREM', KEYS[1], task_id)
+    redis.call('HDEL', KEYS[2], task_id)
+end
+return result
+"""
 
 class RedisTaskQueue:
     """
     Task queue using Redis.
+    Tasks are stored tagged with the codec that wrote them, so the codec can be changed on a live queue.
+    The number of tasks in each status is kept up to date on every write, so counting doesn't scan the tasks.
+    `reconcile` rebuilds the counts from a full scan, e.g. for tasks written before the counts existed. It runs when
+    the queue is created on a store without counts, so `len` and `status_counts` are right from the start.
+
+    Agents hold a time limited lease on the task they work on and renew it while they run. Leases that expire, e.g.
+    because the agent crashed, are handed out by `expired_leases` so the task can be queued again. Outputs saved
+    with `save_checkpoint` survive that, so the next attempt doesn't redo them.
     """
-    def __init__(self, host='localhost', port=6379, db=0):
-        self.redis = redis.Redis(host=host, port=port, db=db)
+    def __init__(self, host='localhost', port=6379, db=0, codec: str = 'json', scan_batch_size: int = 500, redis_client=None):
+        self.redis = redis_client or redis.Redis(host=host, port=port, db=db)
+        self.codec = get_codec(codec)
+        self.scan_batch_size = scan_batch_size # keys fetched per round trip when reading every task
+        self._set_script = self.redis.register_script(SET_SCRIPT)
+        self._delete_script = self.redis.register_script(DELETE_SCRIPT)
+        self._acquire_lease_script = self.redis.register_script(ACQUIRE_LEASE_SCRIPT)
+        self._renew_lease_script = self.redis.register_script(RENEW_LEASE_SCRIPT)
+        self._release_lease_script = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+        self._expired_leases_script = self.redis.register_script(EXPIRED_LEASES_SCRIPT)
+        self._timers = {operation: TASK_STORE_TIME.labels(operation)
+                        for operation in ('get', 'set', 'values', 'delete', 'status_counts', 'len', 'lease', 'checkpoint')}
+        if not self.redis.hlen(STATUS_INDEX_KEY):
+            self.reconcile() # a new store, or tasks written before the counts existed
+
+    def set_codec(self, codec: str):
+        """
+        Switch the codec new writes use, tasks written with the previous codec can still be read
+        """
+        self.codec = get_codec(codec)
 
     def set(self, task_id: str, task_details: Dict[str, Any]):
         """
         Adds/updates a task in the queue.
         """
-        self.redis.set(task_id, json.dumps(task_details))
+        with self._timers['set'].time():
+            self._set_script(keys=[task_id, STATUS_COUNTS_KEY, STATUS_INDEX_KEY],
+                             args=[self.codec.encode(task_details), task_id, task_details.get('status') or 'unknown'])
 
     def get(self, task_id: str) -> Dict[str, Any] | None:
          """
          Gets a task from the queue
          """
-         task_str = self.redis.get(task_id)
-         if task_str:
-             return json.loads(task_str)
+         with self._timers['get'].time():
+             task_bytes = self.redis.get(task_id)
+         if task_bytes:
+             return decode(task_bytes)
          return None
 
     def values(self):
         """
         Returns all of the tasks in the queue.
         """
-        all_keys = self.redis.keys('*')
+        with self._timers['values'].time():
+            return self._values()
+
+    def _values(self) -> list:
         all_values = []
-        for key in all_keys:
-            task = self.get(key.decode('utf-8')) # need to decode the key
-            if task:
-                 all_values.append(task)
+        batch = []
+        for key in self.redis.scan_iter(count=self.scan_batch_size):
+            if key.startswith(META_PREFIX.encode('utf-8')):
+                continue
+            batch.append(key)
+            if len(batch) >= self.scan_batch_size:
+                all_values.extend(self._get_many(batch))
+                batch = []
+        if batch:
+            all_values.extend(self._get_many(batch))
         return all_values
 
+    def _get_many(self, keys: list) -> list:
+        """
+        Reads a batch of tasks in one round trip.
+        MGET returns None for keys that don't hold a string, so other data in the database (e.g. streams) is skipped.
+        """
+        tasks = []
+        for task_bytes in self.redis.mget(keys):
+            if task_bytes:
+                try:
+                    tasks.append(decode(task_bytes))
+                except ValueError:
+                    continue # a string that isn't a task
+        return tasks
+
+    def status_counts(self) -> Dict[str, int]:
+        """
+        Returns the number of tasks in each status
+        """
+        with self._timers['status_counts'].time():
+            counts = self.redis.hgetall(STATUS_COUNTS_KEY)
+        return {status.decode('utf-8'): int(count) for status, count in counts.items() if int(count)}
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Rebuilds the status counts from a full scan of the tasks.
+        Returns how far off each count was, an empty dict if the counts were right.
+        Writes that land while the scan runs may be miscounted until the next reconcile.
+        """
+        index = {}
+        for task in self.values():
+            if 'task_id' in task:
+                index[task['task_id']] = task.get('status') or 'unknown'
+        counts = {}
+        for status in index.values():
+            counts[status] = counts.get(status, 0) + 1
+        previous = self.status_counts()
+        drift = {status: counts.get(status, 0) - previous.get(status, 0) for status in set(counts) | set(previous)}
+        drift = {status: delta for status, delta in drift.items() if delta}
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(STATUS_COUNTS_KEY, STATUS_INDEX_KEY)
+        if counts:
+            pipe.hset(STATUS_COUNTS_KEY, mapping=counts)
+        if index:
+            pipe.hset(STATUS_INDEX_KEY, mapping=index)
+        pipe.execute()
+        return drift
+
     def delete(self, task_id: str):
         """
         Removes a task from the queue.
         """
-        self.redis.delete(task_id)
+        with self._timers['delete'].time():
+            self._delete_script(keys=[task_id, STATUS_COUNTS_KEY, STATUS_INDEX_KEY, LEASES_KEY, LEASE_OWNERS_KEY, CHECKPOINT_PREFIX + task_id],
+                                args=[task_id])
+
+    def acquire_lease(self, task_id: str, owner: str, ttl: float) -> bool:
+        """
+        Leases a task to an agent for ttl seconds. Fails if another agent holds an unexpired lease on it.
+        """
+        with self._timers['lease'].time():
+            return bool(self._acquire_lease_script(keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[task_id, owner, int(ttl * 1000)]))
+
+    def renew_lease(self, task_id: str, owner: str, ttl: float) -> bool:
+        """
+        Extends the lease of an agent to ttl seconds from now. Fails if the agent lost the lease.
+        """
+        with self._timers['lease'].time():
+            return bool(self._renew_lease_script(keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[task_id, owner, int(ttl * 1000)]))
+
+    def release_lease(self, task_id: str, owner: str) -> bool:
+        """
+        Gives up the lease of an agent on a task, does nothing if the agent doesn't hold it
+        """
+        with self._timers['lease'].time():
+            return bool(self._release_lease_script(keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[task_id, owner]))
+
+    def expired_leases(self, limit: int = 100) -> list:
+        """
+        Removes up to `limit` expired leases and returns them as [(task id, owner)].
+        Every expired lease is returned to one caller only, so several schedulers don't reclaim a task twice.
+        """
+        with self._timers['lease'].time():
+            result = self._expired_leases_script(keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[limit])
+        pairs = [value.decode('utf-8') if isinstance(value, bytes) else value for value in result]
+        return list(zip(pairs[::2], pairs[1::2], strict=True))
+
+    def lease_count(self) -> int:
+        """
+        Returns the number of tasks currently leased
+        """
+        with self._timers['lease'].time():
+            return self.redis.zcard(LEASES_KEY)
+
+    def save_checkpoint(self, task_id: str, step: str, output: str):
+        """
+        Saves an intermediate output of a task, kept until the task is deleted or its checkpoints are cleared
+        """
+        with self._timers['checkpoint'].time():
+            self.redis.hset(CHECKPOINT_PREFIX + task_id, step, output)
+
+    def get_checkpoint(self, task_id: str, step: str) -> str | None:
+        """
+        Returns an output saved by an earlier attempt at a task, or None
+        """
+        with self._timers['checkpoint'].time():
+            output = self.redis.hget(CHECKPOINT_PREFIX + task_id, step)
+        return output.decode('utf-8') if output is not None else None
+
+    def clear_checkpoints(self, task_id: str):
+        """
+        Removes the saved outputs of a task once it is done
+        """
+        with self._timers['checkpoint'].time():
+            self.redis.delete(CHECKPOINT_PREFIX + task_id)
 
     def clear_all(self):
         """
@@ -49,4 +285,5 @@ class RedisTaskQueue:
         self.redis.flushdb()
 
     def __len__(self):
-        return len(self.redis.keys('*'))
\ No newline at end of file
+        with self._timers['len'].time():
+            return self.redis.hlen(STATUS_INDEX_KEY)
\ No newline at end of file
@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import time
+import signal
+import hashlib
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Any
+from core.metrics import TEST_RUN_TIME
+from utils.logger import get_logger
+
+# Run in the sandboxed interpreter: applies the resource limits, then hands over to pytest
+SANDBOX_BOOTSTRAP = """
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None # no rlimits on this platform, only the timeout applies
+if resource:
+    cpu_seconds, memory_bytes = int(sys.argv[1]), int(sys.argv[2])
+    for limit, value in ((resource.RLIMIT_CPU, cpu_seconds), (resource.RLIMIT_AS, memory_bytes),
+                         (resource.RLIMIT_FSIZE, 16 * 1024 * 1024), (resource.RLIMIT_CORE, 0)):
+        if value > 0:
+            resource.setrlimit(limit, (value, value))
+try:
+    import pytest
+except ImportError:
+    print("pytest is not installed for " + sys.executable)
+    sys.exit(6) # past the pytest exit codes, so it isn't taken for a broken candidate
+sys.exit(pytest.main(sys.argv[3:]))
+"""
+
+SUMMARY_LINE = re.compile(r"\bin [\d.]+s\b")
+SUMMARY_COUNT = re.compile(r"(\d+) (passed|failed|error)s?\b")
+SUMMARY_KINDS = {'passed': 'tests_passed', 'failed': 'tests_failed', 'error': 'tests_errored'}
+OUTPUT_LIMIT = 4000 # characters of pytest output kept in a result
+CANDIDATE_MODULE = 'candidate' # the code is importable under this name
+# Names models tend to import the code under test from, imports of them are pointed at the candidate module
+PLACEHOLDER_MODULES = ('solution', 'your_module', 'my_module', 'main', 'code_under_test')
+PLACEHOLDER_FROM_IMPORT = re.compile(rf"^(\s*)from\s+(?:{'|'.join(PLACEHOLDER_MODULES)})\s+import\b", re.MULTILINE)
+PLACEHOLDER_IMPORT = re.compile(rf"^(\s*)import\s+({'|'.join(PLACEHOLDER_MODULES)})(?:\s+as\s+(\w+))?[ \t]*$", re.MULTILINE)
+
+
+class TestRunner:
+    """
+    Runs generated pytest tests against generated code, each run in its own subprocess and temporary directory,
+    limited in CPU time, memory and wall time. Runs go through a pool, so several agents can verify at once.
+
+    Results are cached by a hash of the code and the tests, identical candidates are only run once, also when they
+    are submitted while the first run is still going. Tests that can't be collected or run (pytest exit codes 2 to 4,
+    status 'broken') are cached like failures, only errors of the runner itself are tried again.
+    """
+    def __init__(self, max_workers: int = None, timeout: float = 30.0, cpu_seconds: int = 10, memory_mb: int = 512,
+                 cache_size: int = 1024, python: str = None, logger=None):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.timeout = timeout # wall clock seconds before the run is killed
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb # address space limit of the sandbox
+        self.cache_size = cache_size
+        self.python = python or sys.executable
+        self.logger = get_logger("test_runner", logger)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="test_runner")
+        self.cache = OrderedDict() # hash -> result, least recently used first
+        self.in_flight = {} # hash -> future of the run in progress
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.cache_hits = 0
+        self.outcomes = {} # status -> runs
+
+    @staticmethod
+    def candidate_hash(code: str, tests: str) -> str:
+        return hashlib.sha256(f"{code}\0{tests}".encode('utf-8')).hexdigest()
+
+    def submit(self, code: str, tests: str) -> Future:
+        """
+        Queues a run of the tests against the code, returns a future of the result
+        """
+        key = self.candidate_hash(code, tests)
+        with self._lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                future = Future()
+                future.set_result({**cached, 'cached': True})
+                return future
+            if key in self.in_flight:
+                self.cache_hits += 1
+                return self.in_flight[key]
+            future = self.executor.submit(self._run, key, code, tests)
+            self.in_flight[key] = future
+            return future
+
+    def run(self, code: str, tests: str) -> Dict[str, Any]:
+        """
+        Runs the tests against the code and waits for the result
+        """
+        return self.submit(code, tests).result()
+
+    def _run(self, key: str, code: str, tests: str) -> Dict[str, Any]:
+        started = time.time()
+        try:
+            result = self._execute(code, tests)
+        except Exception as e:
+            self.logger.exception(f"Could not run tests: {e}")
+            result = {'status': 'error', 'output': str(e)}
+        result.update({
+            'passed': result['status'] == 'passed',
+            'hash': key,
+            'duration': time.time() - started,
+            'cached': False
+        })
+        for count in ('tests_passed', 'tests_failed', 'tests_errored'):
+            result.setdefault(count, 0)
+        TEST_RUN_TIME.labels(result['status']).observe(result['duration'])
+        with self._lock:
+            self.in_flight.pop(key, None)
+            self.runs += 1
+            self.outcomes[result['status']] = self.outcomes.get(result['status'], 0) + 1
+            if result['status'] != 'error': # errors of the runner itself may go away, don't keep them
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        self.logger.info("Test run %s: %s (%d passed, %d failed) in %.2fs",
+                         key[:12], result['status'], result['tests_passed'], result['tests_failed'], result['duration'])
+        return result
+
+    @staticmethod
+    def rewrite_imports(tests: str) -> str:
+        """
+        Points imports of placeholder modules such as `from solution import add` at the candidate module
+        """
+        tests = PLACEHOLDER_FROM_IMPORT.sub(rf"\1from {CANDIDATE_MODULE} import", tests)
+        return PLACEHOLDER_IMPORT.sub(lambda match: f"{match[1]}import {CANDIDATE_MODULE} as {match[3] or match[2]}", tests)
+
+    def _execute(self, code: str, tests: str) -> Dict[str, Any]:
+        """
+        Runs pytest on the candidate in a fresh directory. The code is also written as candidate.py for tests that
+        import it, the test file holds the code followed by the tests for tests that call it directly.
+        """
+        with tempfile.TemporaryDirectory(prefix="agent_squad_tests_") as workdir:
+            with open(os.path.join(workdir, f'{CANDIDATE_MODULE}.py'), 'w') as f:
+                f.write(code)
+            with open(os.path.join(workdir, f'test_{CANDIDATE_MODULE}.py'), 'w') as f:
+                f.write(f"{code}\n\n{self.rewrite_imports(tests)}\n")
+            command = [self.python, '-I', '-c', SANDBOX_BOOTSTRAP, str(self.cpu_seconds), str(self.memory_mb * 1024 * 1024),
+                       '-q', '-p', 'no:cacheprovider', f'test_{CANDIDATE_MODULE}.py']
+            env = {'PATH': os.environ.get('PATH', ''), 'HOME': workdir, 'PYTHONDONTWRITEBYTECODE': '1'}
+            process = subprocess.Popen(command, cwd=workdir, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, start_new_session=True) # own process group, to kill what the tests start
+            try:
+                output, _ = process.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self._kill(process)
+                output, _ = process.communicate()
+                return {'status': 'timeout', 'output': self._tail(output)}
+        output = self._tail(output)
+        if process.returncode == 0:
+            status = 'passed'
+        elif process.returncode == 1:
+            status = 'failed'
+        elif process.returncode in (2, 3, 4):
+            status = 'broken' # interrupted, e.g. by an import error while collecting, internal or usage error
+        elif process.returncode == 5:
+            status = 'no_tests'
+        elif process.returncode < 0:
+            status = 'killed' # by a signal, e.g. over the CPU limit
+        else:
+            status = 'error'
+        counts = {}
+        summary = [line for line in output.splitlines() if SUMMARY_LINE.search(line)]
+        if summary: # e.g. "1 failed, 2 passed in 0.03s"
+            for number, kind in SUMMARY_COUNT.findall(summary[-1]):
+                counts[SUMMARY_KINDS[kind]] = int(number)
+        return {'status': status, 'returncode': process.returncode, 'output': output, **counts}
+
+    @staticmethod
+    def _kill(process: subprocess.Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, AttributeError):
+            process.kill()
+
+    @staticmethod
+    def _tail(output: bytes) -> str:
+        text = (output or b'').decode('utf-8', errors='replace')
+        return text[-OUTPUT_LIMIT:]
+
+    def stop(self):
+        """
+        Waits for the runs in progress and stops the pool
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        Returns the status of the test runner
+        """
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'runs': self.runs,
+                'cache_hits': self.cache_hits,
+                'cached_results': len(self.cache),
+                'in_flight': len(self.in_flight),
+                'outcomes': dict(self.outcomes)
+            }
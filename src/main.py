@@ -1,14 +1,22 @@
 from core.task_queue import RedisTaskQueue
 from core.message_pipeline import HTTPMessagePipeline
+from core.redis_message_pipeline import RedisStreamMessagePipeline
 from core.resource_manager import ResourceManager 
+from core.scheduler import Scheduler
+from core.test_runner import TestRunner
 from agents.architect_agent import ArchitectAgent
 from agents.senior_dev_agent import SeniorDevAgent
 from agents.junior_dev_agent import JuniorDevAgent
 from agents.test_dev_agent import TestDevAgent
 from agents.project_manager_agent import ProjectManagerAgent
+from api.ollama_client import OllamaClient
+from api.llm_telemetry import LLMTelemetry
+from core.rate_limiter import RateLimiter
+from utils.prompt_builder import PromptBuilder
 from utils.config import load_config
-from utils.logger import get_project_logger
+from utils.logger import get_project_logger, stop_logging
 import time
+import socket
 import threading
 
 
@@ -21,23 +29,96 @@ if __name__ == "__main__":
     # Setup Task Queue and Message Pipeline
     redis_host = config.get('redis_host', 'localhost')
     redis_port = config.get('redis_port', 6379)
-    task_queue = RedisTaskQueue(host=redis_host, port=redis_port)
+    codec = config.get('codec', 'json') # format of new writes, payloads in either format are always read
+    task_queue = RedisTaskQueue(host=redis_host, port=redis_port, codec=codec)
 
     message_pipeline_host = config.get('message_pipeline_host', 'localhost')
     message_pipeline_port = config.get('message_pipeline_port', 8000)
-    message_pipeline = HTTPMessagePipeline(host=message_pipeline_host, port=message_pipeline_port, logger=logger)
+    if config.get('message_bus', 'http') == 'redis_streams':
+        # Events go through redis, so agents in other processes and hosts receive them too.
+        # There is no HTTP server in this mode, so no /events stream and no /metrics endpoint.
+        message_pipeline = RedisStreamMessagePipeline(
+            host=redis_host,
+            port=redis_port,
+            group=config.get('message_bus_group', 'agents'),
+            consumer=config.get('message_bus_consumer'), # set a stable name to pick up unacknowledged messages after a restart
+            batch_size=config.get('message_bus_batch_size', 100),
+            codec=codec,
+            logger=logger
+        )
+    else:
+        message_pipeline = HTTPMessagePipeline(
+            host=message_pipeline_host,
+            port=message_pipeline_port,
+            dispatch_mode=config.get('message_dispatch_mode', 'async'),
+            queue_size=config.get('message_queue_size', 1000),
+            overflow_policy=config.get('message_overflow_policy', 'block'),
+            task_queue=task_queue, # seeds the task states sent to /events clients
+            logger=logger
+        )
     message_pipeline.start()
 
+    # LLM call statistics, recorded by the ollama client and reported by the resource manager
+    llm_telemetry = LLMTelemetry(window=config.get('llm_stats_window', 1000))
+
+    # LLM rate limits per model and backend, kept in redis when several processes share the same limits
+    rate_limiter = RateLimiter(
+        limits=config.get('rate_limits'),
+        redis_client=task_queue.redis if config.get('rate_limit_backend', 'local') == 'redis' else None,
+        logger=logger
+    )
+
     # Setup Resource Manager
-    resource_manager = ResourceManager(config, logger=logger)
+    resource_manager = ResourceManager(config, logger=logger, llm_telemetry=llm_telemetry, rate_limiter=rate_limiter)
+    resource_manager.start_sampling() # the scheduler reads the sampled resources instead of querying the system per task
+
+    # Setup a single Ollama client shared by all agents, so requests are balanced over every inference host
+    ollama_client = OllamaClient(
+        hosts=config.get('ollama_hosts'),
+        health_check_interval=config.get('ollama_health_check_interval', 10.0),
+        default_timeout=config.get('ollama_timeout', 300.0),
+        max_retries=config.get('ollama_max_retries', 2),
+        telemetry=llm_telemetry,
+        rate_limiter=rate_limiter,
+        logger=logger
+    )
+    ollama_client.start_health_checks()
+
+    # Prompt builder shared by the agents, keeps prompts within the context window of each model
+    prompt_builder = PromptBuilder(
+        context_windows=config.get('model_context_windows'),
+        response_reserve=config.get('prompt_response_reserve', 1024)
+    )
+
+    # Agent ids stay the same across restarts, so an agent picks up the tasks assigned to it before a crash
+    agent_ids = config.get('agent_ids', {})
+    agent_id_prefix = config.get('agent_id_prefix') or socket.gethostname()
+    def agent_id(name):
+        return agent_ids.get(name) or f"{agent_id_prefix}:{name.lower().replace(' ', '-')}"
+    lease_ttl = config.get('task_lease_ttl', 60.0)
+
+    # Runs the generated tests against the generated code in sandboxed subprocesses
+    test_runner = TestRunner(
+        max_workers=config.get('test_runner_workers'),
+        timeout=config.get('test_timeout', 30.0),
+        cpu_seconds=config.get('test_cpu_seconds', 10),
+        memory_mb=config.get('test_memory_mb', 512),
+        cache_size=config.get('test_cache_size', 1024),
+        logger=logger
+    )
+
+    # (role, model) of the review and test stages after a junior dev. Only a stage on the model of the junior dev
+    # (a model of null) reuses its LLM conversation, a stage on another model gets the code in its prompt again.
+    follow_ups = config.get('junior_follow_ups')
 
     # Setup Agents, pass in the resource manager
-    architect = ArchitectAgent(name="Architect", model="gpt-4", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
-    senior_dev = SeniorDevAgent(name="Senior Dev", model="gpt-4", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
-    junior_dev1 = JuniorDevAgent(name="Junior Dev 1", model="llama-2-7b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
-    junior_dev2 = JuniorDevAgent(name="Junior Dev 2", model="llama-2-7b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
-    test_dev = TestDevAgent(name="Test Dev", model="llama-2-13b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
-    project_manager = ProjectManagerAgent(name="Project Manager", model="Qwen2.5-14b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger)
+    architect = ArchitectAgent(name="Architect", agent_id=agent_id("Architect"), lease_ttl=lease_ttl, rescan_interval=config.get('architect_rescan_interval', 300.0), model="gpt-4", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger, ollama_client=ollama_client, prompt_builder=prompt_builder, resource_manager=resource_manager)
+    senior_dev = SeniorDevAgent(name="Senior Dev", agent_id=agent_id("Senior Dev"), lease_ttl=lease_ttl, model="gpt-4", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger, ollama_client=ollama_client, prompt_builder=prompt_builder, resource_manager=resource_manager)
+    junior_dev1 = JuniorDevAgent(name="Junior Dev 1", agent_id=agent_id("Junior Dev 1"), lease_ttl=lease_ttl, follow_ups=follow_ups, model="llama-2-7b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger, ollama_client=ollama_client, prompt_builder=prompt_builder, resource_manager=resource_manager)
+    junior_dev2 = JuniorDevAgent(name="Junior Dev 2", agent_id=agent_id("Junior Dev 2"), lease_ttl=lease_ttl, follow_ups=follow_ups, model="llama-2-7b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger, ollama_client=ollama_client, prompt_builder=prompt_builder, resource_manager=resource_manager)
+    test_dev = TestDevAgent(name="Test Dev", agent_id=agent_id("Test Dev"), lease_ttl=lease_ttl, test_runner=test_runner, model="llama-2-13b", message_pipeline=message_pipeline, task_queue=task_queue, logger=logger, ollama_client=ollama_client, prompt_builder=prompt_builder, resource_manager=resource_manager)
+    project_manager = ProjectManagerAgent(name="Project Manager", model="Qwen2.5-14b", message_pipeline=message_pipeline, task_queue=task_queue, resource_manager=resource_manager, logger=logger,
+                                          reconcile_interval=config.get('task_count_reconcile_interval', 300.0), agent_id=agent_id("Project Manager"))
 
     # Subscribe agents to message pipeline events
     def handle_task_update(data):
@@ -56,76 +137,19 @@ if __name__ == "__main__":
         logger.warning(f"Help request: {data}")
     message_pipeline.subscribe('request_help', handle_help_request)
 
-     # Scheduler logic
-    def scheduler_run():
-        """
-        Main function for scheduling tasks
-        """
-        while True:
-            # Get pending tasks from the task queue
-            pending_tasks = [task for task in task_queue.values() if task['status'] == 'pending']
-            for task in pending_tasks:
-                if not task['assigned_agent']: # If the task is unassigned
-                     # Check if there are enough resources to run the task
-                     if resource_manager.can_run_task(task):
-                            # Assign based on dependencies and priority
-                            if 'dependencies' in task and task['dependencies']:
-                                 # check if dependencies are complete, if not skip
-                                 deps_complete = True
-                                 for dep in task['dependencies']:
-                                      dep_task = task_queue.get(dep)
-                                      if not dep_task or dep_task['status'] != 'completed':
-                                        deps_complete = False
-                                        break
-                                 if not deps_complete:
-                                      logger.debug(f"Skipping task {task['task_id']}, not all dependencies have been resolved.")
-                                      continue
-                            
-                            if task.get('resource_requirements', {}).get('model', '') == 'gpt-4':
-                                if resource_manager.can_run_task(task):
-                                     if architect.is_active is False:
-                                          task['assigned_agent'] = architect.id
-                                          architect.start_task(task['task_id'])
-                                          task_queue.set(task['task_id'], task)
-                                          logger.info(f"Assigned task '{task['task_id']}' to {architect.name}")
-                                     elif senior_dev.is_active is False:
-                                          task['assigned_agent'] = senior_dev.id
-                                          senior_dev.start_task(task['task_id'])
-                                          task_queue.set(task['task_id'], task)
-                                          logger.info(f"Assigned task '{task['task_id']}' to {senior_dev.name}")
-                                     else:
-                                          logger.debug(f"Skipping task {task['task_id']}, gpt-4 agent active")
-                                else:
-                                      logger.info(f"Skipping task {task['task_id']}, not enough resources for gpt-4")
-                            elif task.get('resource_requirements', {}).get('model', '').startswith('llama'):
-                                if junior_dev1.is_active is False:
-                                     task['assigned_agent'] = junior_dev1.id
-                                     junior_dev1.start_task(task['task_id'])
-                                     task_queue.set(task['task_id'], task)
-                                     logger.info(f"Assigned task '{task['task_id']}' to {junior_dev1.name}")
-                                elif junior_dev2.is_active is False:
-                                     task['assigned_agent'] = junior_dev2.id
-                                     junior_dev2.start_task(task['task_id'])
-                                     task_queue.set(task['task_id'], task)
-                                     logger.info(f"Assigned task '{task['task_id']}' to {junior_dev2.name}")
-                                else:
-                                      logger.debug(f"Skipping task {task['task_id']}, llama agent active")
-                            else:
-                                 if test_dev.is_active is False:
-                                      task['assigned_agent'] = test_dev.id
-                                      test_dev.start_task(task['task_id'])
-                                      task_queue.set(task['task_id'], task)
-                                      logger.info(f"Assigned task '{task['task_id']}' to {test_dev.name}")
-                                 else:
-                                     logger.debug(f"Skipping task {task['task_id']}, test dev active")
-                     else:
-                          logger.info(f"Skipping task {task['task_id']}, not enough resources")
-
-            time.sleep(1)
-    # Start the scheduler in its own thread
-    scheduler_thread = threading.Thread(target=scheduler_run)
-    scheduler_thread.daemon = True
-    scheduler_thread.start()
+    # Scheduler, the senior dev takes gpt-4 tasks, the junior devs llama tasks and the test dev everything else.
+    # Tasks with a role hint go to the agents of that role. The architect picks its own tasks, it isn't pooled.
+    scheduler = Scheduler(
+        task_queue,
+        resource_manager,
+        pools=[('gpt-4', [senior_dev]), ('llama', [junior_dev1, junior_dev2]), ('', [test_dev])],
+        task_deadlines=config.get('task_deadlines'), # LLM call deadlines by task priority, e.g. {"1": 600, "2": 300}
+        default_task_deadline=config.get('default_task_deadline', 600),
+        lease_ttl=lease_ttl,
+        message_pipeline=message_pipeline, # announces reclaimed tasks
+        logger=logger
+    )
+    scheduler.start()
 
     # Start Agents
     agents = [architect, senior_dev, junior_dev1, junior_dev2, test_dev]
@@ -144,8 +168,11 @@ if __name__ == "__main__":
         'priority': 1,
         'resource_requirements': {
             'model': 'gpt-4'
-        }
+        },
+        'role': 'ArchitectAgent', # broken down by the architect
+        'created_at': time.time()
     })
+    message_pipeline.publish('task_update', {'task_id': 'task-0', 'status': 'pending', 'role': 'ArchitectAgent'}) # the architect picks it up from the event
 
 
     # Keep the main thread alive
@@ -155,4 +182,9 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     finally:
-        message_pipeline.stop()
\ No newline at end of file
+        scheduler.stop()
+        ollama_client.stop_health_checks()
+        resource_manager.stop_sampling()
+        message_pipeline.stop()
+        test_runner.stop()
+        stop_logging() # write out what is still queued
\ No newline at end of file
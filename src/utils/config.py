@@ -26,6 +26,47 @@ def get_config_value(config: Dict[str, Any], key: str, default: Any = None) -> A
 #     "redis_port": 6379,
 #     "message_pipeline_host": "localhost",
 #     "message_pipeline_port": 8000,
+#     "message_dispatch_mode": "async",
+#     "message_queue_size": 1000,
+#     "message_overflow_policy": "block",
+#     "message_bus": "http",
+#     "message_bus_group": "agents",
+#     "message_bus_consumer": "worker-1",
+#     "message_bus_batch_size": 100,
+#     "codec": "json",
 #      "log_level": "DEBUG",
-#      "api_limit": 10
+#      "log_format": "json",
+#      "log_queue_size": 10000,
+#      "log_rate_limit_interval": 10,
+#      "log_rate_limit_level": "DEBUG",
+#      "rate_limits": {
+#          "model:gpt-4": {"requests_per_second": 1, "tokens_per_minute": 40000},
+#          "backend:http://gpu-box-2:11434": {"requests_per_second": 4, "burst": 8}
+#      },
+#      "rate_limit_backend": "redis",
+#      "gpu_provider": "auto",
+#      "resource_sample_interval": 1.0,
+#      "resource_smoothing_samples": 5,
+#      "resource_history_size": 300,
+#      "agent_usage_window": 100,
+#      "task_count_reconcile_interval": 300,
+#      "task_lease_ttl": 60,
+#      "architect_rescan_interval": 300,
+#      "test_runner_workers": 4,
+#      "test_timeout": 30,
+#      "test_cpu_seconds": 10,
+#      "test_memory_mb": 512,
+#      "test_cache_size": 1024,
+#      "agent_id_prefix": "worker-1",
+#      "agent_ids": {"Senior Dev": "senior-dev-a"},
+#      "junior_follow_ups": [["SeniorDevAgent", "gpt-4"], ["TestDevAgent", null]],
+#      "ollama_hosts": [
+#          {"url": "http://gpu-box-1:11434", "models": ["gpt-4", "llama-2-13b"]},
+#          {"url": "http://gpu-box-2:11434", "models": ["llama-2-7b"]}
+#      ],
+#      "ollama_health_check_interval": 10.0,
+#      "task_deadlines": {"1": 600, "2": 300},
+#      "default_task_deadline": 600,
+#      "model_context_windows": {"gpt-4": 8192, "llama-2-7b": 4096},
+#      "prompt_response_reserve": 1024
 # }
\ No newline at end of file
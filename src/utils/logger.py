@@ -1,19 +1,241 @@
-import logging
 import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 from typing import Dict, Any
-from config import get_config_value
+from utils.config import get_config_value
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONTEXT_FIELDS = ('task_id', 'agent_id', 'agent') # set with log_context, written as fields of the JSON lines
+
+_context = threading.local()
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Tags the records this thread logs inside the block with the given fields, e.g. task_id and agent_id
+    """
+    previous = getattr(_context, 'fields', {})
+    _context.fields = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the fields of log_context onto a record, in the thread that logged it
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, value in getattr(_context, 'fields', {}).items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a repeated message through at most once every `interval` seconds, so polling loops don't flood the log.
+    Records up to `level` are limited, a repeat has the same logger, level and unformatted message. The next copy
+    that gets through carries the number dropped in between as `suppressed`.
+    """
+    MAX_KEYS = 10000 # messages remembered, the oldest are forgotten first
+
+    def __init__(self, interval: float = 10.0, level: int = logging.DEBUG):
+        super().__init__()
+        self.interval = interval
+        self.level = level
+        self.seen = {} # (logger, level, message) -> [time let through, dropped since]
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level or self.interval <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            seen = self.seen.get(key)
+            if seen and now - seen[0] < self.interval:
+                seen[1] += 1
+                self.suppressed += 1
+                return False
+            if len(self.seen) >= self.MAX_KEYS:
+                del self.seen[next(iter(self.seen))]
+            self.seen[key] = [now, 0]
+        if seen and seen[1]:
+            record.suppressed = seen[1]
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The usual text lines, noting how many copies of a message the rate limit dropped
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            line += f" ({suppressed} similar messages suppressed)"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the log_context fields of the record
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for field in CONTEXT_FIELDS + ('suppressed',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue without waiting, a record that doesn't fit is dropped and counted
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the message is rendered here, its arguments may change once the call returns.
+        # The writer thread adds the timestamp, the JSON and any traceback.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel) # wait for room, so stopping never loses the sentinel on a full queue
+
+
+class LogPipeline:
+    """
+    Hands log records to a single writer thread through a bounded queue, so a slow stdout never blocks the caller.
+    """
+    def __init__(self, stream=None, log_format: str = 'text', queue_size: int = 10000,
+                 rate_limit_interval: float = 10.0, rate_limit_level: int = logging.DEBUG):
+        self.queue = queue.Queue(queue_size)
+        self.rate_limiter = RateLimitFilter(rate_limit_interval, rate_limit_level)
+        self.handler = _NonBlockingQueueHandler(self.queue)
+        self.handler.addFilter(self.rate_limiter) # filters run in the logging thread, dropping a repeat costs no queue slot
+        self.handler.addFilter(ContextFilter())
+        self.output = logging.StreamHandler(stream or sys.stdout)
+        self.set_format(log_format)
+        self.listener = _Listener(self.queue, self.output, respect_handler_level=True)
+        self.listener.start()
+        self.running = True
+
+    def set_format(self, log_format: str):
+        """
+        'text' for the usual lines, 'json' for structured lines
+        """
+        self.output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter(TEXT_FORMAT))
+
+    def stop(self):
+        """
+        Writes out the queued records and stops the writer thread
+        """
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.handler.dropped,
+            'suppressed': self.rate_limiter.suppressed
+        }
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def setup_logging(config: Dict[str, Any] = None) -> LogPipeline:
+    """
+    Returns the log pipeline of the process, starting it on the first call.
+    Passing a config applies log_format, log_rate_limit_interval and log_rate_limit_level to it, log_queue_size only
+    takes effect if the config comes with the first call.
+    """
+    global _pipeline
+    config = config or {}
+    interval = get_config_value(config, 'log_rate_limit_interval', 10.0)
+    level = getattr(logging, str(get_config_value(config, 'log_rate_limit_level', 'DEBUG')).upper(), logging.DEBUG)
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline(log_format=get_config_value(config, 'log_format', 'text'),
+                                    queue_size=get_config_value(config, 'log_queue_size', 10000),
+                                    rate_limit_interval=interval, rate_limit_level=level)
+            atexit.register(_pipeline.stop)
+        elif config:
+            _pipeline.set_format(get_config_value(config, 'log_format', 'text'))
+            _pipeline.rate_limiter.interval = interval
+            _pipeline.rate_limiter.level = level
+    return _pipeline
+
+
+def stop_logging():
+    """
+    Writes out the queued records, call on shutdown
+    """
+    if _pipeline:
+        _pipeline.stop()
+
+
+def get_logger(name: str, logger: logging.Logger = None, log_level: int = logging.DEBUG) -> logging.Logger:
+    """
+    Returns `logger` if one is given, otherwise the named logger writing through the log pipeline.
+    For components that take an optional logger.
+    """
+    if logger:
+        return logger
+    logger = logging.getLogger(name)
+    handler = setup_logging().handler
+    if handler not in logger.handlers:
+        logger.setLevel(log_level)
+        logger.addHandler(handler)
+    return logger
+
 
 def get_project_logger(config: Dict[str, Any], name: str = 'project', log_level: int = logging.INFO) -> logging.Logger:
     """
-    Gets a basic project logger
+    Gets the project logger, writing through the log pipeline
     """
     logger = logging.getLogger(name) # create new logger if one does not exist
     log_level_str = get_config_value(config, 'log_level', 'INFO').upper()
     log_level = getattr(logging, log_level_str, logging.INFO) # default to INFO if something is wrong
     logger.setLevel(log_level)
-    if not logger.hasHandlers():
-        handler = logging.StreamHandler(sys.stdout)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
+    handler = setup_logging(config).handler
+    if handler not in logger.handlers:
         logger.addHandler(handler)
-    return logger
\ No newline at end of file
+    return logger
@@ -0,0 +1,195 @@
+import math
+import re
+import json
+from typing import Dict, Any, List
+
+# Context window of each model in tokens, can be overridden with 'model_context_windows' in the config
+DEFAULT_CONTEXT_WINDOWS = {
+    'llama-2-7b': 4096,
+    'llama-2-13b': 4096,
+    'gpt-4': 8192,
+    'default': 4096
+}
+
+# Rough characters per token, code tokenizes denser than prose so this errs on the side of overestimating
+DEFAULT_CHARS_PER_TOKEN = {
+    'default': 3.5
+}
+
+# Lines that describe the shape of the code, kept in preference to bodies when code has to be cut
+SIGNATURE_PATTERN = re.compile(r'^\s*(def |async def |class |@|import |from \S+ import )')
+
+FENCED_BLOCK = re.compile(r"```[ \t]*(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+def extract_code(text: str) -> str:
+    """
+    Returns the python in the fenced blocks of an LLM response, joined together, or the whole text if there are none
+    """
+    blocks = FENCED_BLOCK.findall(text or '')
+    if blocks:
+        return "\n\n".join(block.strip('\n') for block in blocks)
+    return (text or '').strip()
+
+
+class PromptResult:
+    """
+    A prompt assembled within the token budget of a model.
+    """
+    def __init__(self, prompt: str, estimated_tokens: int, budget: int, truncated_tokens: int = 0):
+        self.prompt = prompt
+        self.estimated_tokens = estimated_tokens
+        self.budget = budget
+        self.truncated_tokens = truncated_tokens # estimated tokens cut out of the prompt to fit the budget
+
+    @property
+    def truncated(self) -> bool:
+        return self.truncated_tokens > 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'estimated_tokens': self.estimated_tokens,
+            'budget': self.budget,
+            'truncated_tokens': self.truncated_tokens
+        }
+
+
+class PromptBuilder:
+    """
+    Assembles agent prompts that fit the context window of the target model.
+
+    The budget of a model is its context window minus the tokens reserved for the response. When embedded code does
+    not fit, whole lines are dropped, keeping signatures first, then as much of the rest as fits, in their original
+    order with markers where lines were left out.
+    """
+    def __init__(self, context_windows: Dict[str, int] = None, chars_per_token: Dict[str, float] = None, response_reserve: int = 1024,
+                 max_description_share: float = 0.25):
+        self.context_windows = {**DEFAULT_CONTEXT_WINDOWS, **(context_windows or {})}
+        self.chars_per_token = {**DEFAULT_CHARS_PER_TOKEN, **(chars_per_token or {})}
+        self.response_reserve = response_reserve # tokens left free for the model to answer in
+        self.max_description_share = max_description_share # share of the budget a task description may use
+
+    def estimate_tokens(self, text: str, model: str) -> int:
+        """
+        Estimates the number of tokens in a text for a model
+        """
+        if not text:
+            return 0
+        ratio = self.chars_per_token.get(model, self.chars_per_token['default'])
+        return math.ceil(len(text) / ratio)
+
+    def budget_for(self, model: str) -> int:
+        """
+        Returns the number of prompt tokens available for a model
+        """
+        window = self.context_windows.get(model, self.context_windows['default'])
+        return max(0, window - self.response_reserve)
+
+    def build(self, model: str, instruction: str, code: Any = None, system: str = None, description: str = None) -> PromptResult:
+        """
+        Builds a prompt from an instruction, optionally followed by a block of code.
+
+        Args:
+            model (str): The model the prompt is for.
+            instruction (str): The instruction, may contain a '{description}' placeholder.
+            code: Code to embed after the instruction, a task output dict is unwrapped to its 'code' entry and the code
+                is taken out of the fences of the LLM response it came in.
+            system (str): System prompt sent alongside, counted against the budget but not included in the prompt.
+            description (str): Task description, cut down to its share of the budget if it is very long.
+        """
+        budget = self.budget_for(model)
+        truncated_tokens = 0
+        if description is not None:
+            description, cut = self.truncate_text(description, int(budget * self.max_description_share), model)
+            truncated_tokens += cut
+            instruction = instruction.replace('{description}', description)
+        used = self.estimate_tokens(instruction, model) + self.estimate_tokens(system, model)
+
+        code_text = self._code_to_text(code)
+        if not code_text:
+            return PromptResult(instruction, used, budget, truncated_tokens)
+
+        fence_tokens = self.estimate_tokens("\n\n```python\n\n```", model)
+        code_budget = max(0, budget - used - fence_tokens)
+        code_text, cut = self.truncate_code(code_text, code_budget, model)
+        truncated_tokens += cut
+        prompt = f"{instruction}\n\n```python\n{code_text}\n```"
+        return PromptResult(prompt, used + fence_tokens + self.estimate_tokens(code_text, model), budget, truncated_tokens)
+
+    def truncate_text(self, text: str, max_tokens: int, model: str) -> tuple[str, int]:
+        """
+        Cuts plain text down to max_tokens, returns the text and the estimated tokens removed
+        """
+        tokens = self.estimate_tokens(text, model)
+        if tokens <= max_tokens:
+            return text, 0
+        ratio = self.chars_per_token.get(model, self.chars_per_token['default'])
+        kept = text[:int(max_tokens * ratio)].rstrip() + " ..."
+        return kept, tokens - self.estimate_tokens(kept, model)
+
+    def truncate_code(self, code: str, max_tokens: int, model: str) -> tuple[str, int]:
+        """
+        Cuts code down to max_tokens by dropping whole lines, returns the code and the estimated tokens removed
+        """
+        total = self.estimate_tokens(code, model)
+        if total <= max_tokens:
+            return code, 0
+
+        lines = code.splitlines()
+
+        def rank(index):
+            return 0 if SIGNATURE_PATTERN.match(lines[index]) else 1
+
+        # Pick lines by importance, and within the same importance from the top of the file down
+        order = sorted(range(len(lines)), key=lambda i: (rank(i), i))
+        marker_tokens = self.estimate_tokens("    # ... 0000 lines omitted ...\n", model)
+        selected = set()
+        used = 0
+        for index in order:
+            cost = self.estimate_tokens(lines[index] + "\n", model)
+            if used + cost + marker_tokens > max_tokens:
+                if rank(index) == 0:
+                    continue # a shorter line of the same importance may still fit
+                break
+            selected.add(index)
+            used += cost
+
+        kept_code = self._join_selected(lines, selected)
+        picked = [index for index in order if index in selected]
+        while picked and self.estimate_tokens(kept_code, model) > max_tokens:
+            # Omission markers pushed it over, drop the least important line that was kept
+            selected.discard(picked.pop())
+            kept_code = self._join_selected(lines, selected)
+        return kept_code, max(0, total - self.estimate_tokens(kept_code, model))
+
+    @staticmethod
+    def _join_selected(lines: List[str], selected: set) -> str:
+        """
+        Joins the selected lines in their original order, marking where lines were left out
+        """
+        kept = []
+        omitted = 0
+        for index, line in enumerate(lines):
+            if index in selected:
+                if omitted:
+                    kept.append(f"# ... {omitted} lines omitted ...")
+                    omitted = 0
+                kept.append(line)
+            else:
+                omitted += 1
+        if omitted:
+            kept.append(f"# ... {omitted} lines omitted ...")
+        return "\n".join(kept)
+
+    @staticmethod
+    def _code_to_text(code: Any) -> str:
+        """
+        Turns task output into the code text to embed, without the fences of the response it came in
+        """
+        if code is None:
+            return ""
+        if isinstance(code, dict):
+            if 'code' in code:
+                return extract_code(str(code['code']))
+            return json.dumps(code, indent=2)
+        return extract_code(str(code))
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'agents')) # the agents import their base class as a top level module
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks')) # the in-memory Redis and Ollama stand-ins
+
+
+def make_task(task_id, status='pending', **fields):
+    """
+    Task record with the fields the agents and the scheduler expect, `fields` override or add to them
+    """
+    return {'task_id': task_id, 'description': f"task {task_id}", 'dependencies': [], 'status': status,
+            'assigned_agent': None, 'priority': 1, 'resource_requirements': {}, **fields}
+
+
+@pytest.fixture(params=['fake_redis', 'fakeredis'])
+def redis_client(request):
+    """
+    The in-memory stand-in of the benchmarks, which mirrors the Lua scripts in Python, and fakeredis, which runs the
+    Lua scripts themselves when it is installed with lupa
+    """
+    if request.param == 'fake_redis':
+        from fake_redis import FakeRedis
+        return FakeRedis()
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis()
+
+
+class RecordingPipeline:
+    """
+    In-process message pipeline that delivers to its subscribers right away and keeps what was published
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.published = []
+
+    def subscribe(self, message_type, handler):
+        self.handlers.setdefault(message_type, []).append(handler)
+
+    def publish(self, message_type, data=None):
+        self.published.append((message_type, data))
+        for handler in self.handlers.get(message_type, []):
+            handler(data)
+
+
+@pytest.fixture
+def message_pipeline():
+    return RecordingPipeline()
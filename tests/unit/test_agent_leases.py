@@ -0,0 +1,108 @@
+import time
+import logging
+
+import pytest
+
+from agent import Agent
+from conftest import make_task
+from core.task_queue import RedisTaskQueue, CHECKPOINT_PREFIX
+
+LOGGER = logging.getLogger('test_agent_leases')
+
+
+class CountingOllamaClient:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_text(self, model, prompt, **kwargs):
+        self.calls += 1
+        return f"response {self.calls}"
+
+
+class LeaseAgent(Agent):
+    """
+    Runs `work(agent)` as its task
+    """
+    def __init__(self, work, agent_id, message_pipeline, task_queue, **kwargs):
+        super().__init__(name=agent_id, model='m', message_pipeline=message_pipeline, task_queue=task_queue, logger=LOGGER,
+                         agent_id=agent_id, **kwargs)
+        self.work = work
+        self.ollama_client = CountingOllamaClient()
+
+    def run(self):
+        pass
+
+    def process_task(self, task_details):
+        self.work(self)
+
+    def get_status(self):
+        return {'id': self.id}
+
+
+@pytest.fixture
+def task_queue(redis_client):
+    return RedisTaskQueue(redis_client=redis_client)
+
+
+def run_task(agent, task_id='a'):
+    agent.start_task(task_id)
+    agent.handle_task(agent.task_queue.get(task_id))
+
+
+def test_heartbeat_keeps_the_lease_while_the_task_runs(task_queue, message_pipeline):
+    held = []
+    def work(agent):
+        time.sleep(0.2) # several lease lifetimes
+        held.append(task_queue.acquire_lease('a', 'agent-2', 60))
+        agent.complete_task({'code': 'done'})
+    agent = LeaseAgent(work, 'agent-1', message_pipeline, task_queue, lease_ttl=0.06)
+    task_queue.set('a', make_task('a', assigned_agent='agent-1'))
+    run_task(agent)
+    assert held == [False]
+    assert task_queue.get('a')['status'] == 'completed'
+    assert task_queue.lease_count() == 0
+
+
+def test_task_leased_to_another_agent_is_skipped(task_queue, message_pipeline):
+    ran = []
+    agent = LeaseAgent(ran.append, 'agent-1', message_pipeline, task_queue)
+    task_queue.set('a', make_task('a'))
+    assert task_queue.acquire_lease('a', 'agent-2', 60)
+    run_task(agent)
+    assert ran == []
+    assert (agent.is_active, agent.current_task_id) == (False, None)
+    assert task_queue.get('a')['status'] == 'pending'
+
+
+def test_checkpointed_responses_are_reused_by_the_next_attempt(task_queue, message_pipeline, redis_client):
+    responses = []
+    def work(agent):
+        responses.append(agent.generate_text('m', 'write the code'))
+        if len(responses) == 1:
+            agent.release_task("backend timed out")
+        else:
+            agent.complete_task({'code': responses[-1]})
+    agent = LeaseAgent(work, 'agent-1', message_pipeline, task_queue)
+    task_queue.set('a', make_task('a', assigned_agent='agent-1', role='LeaseAgent'))
+    run_task(agent)
+    task = task_queue.get('a')
+    assert (task['status'], task['assigned_agent'], task['attempts']) == ('pending', None, 1)
+    assert ('task_update', {'task_id': 'a', 'status': 'pending', 'agent_id': 'agent-1', 'role': 'LeaseAgent'}) in message_pipeline.published
+
+    run_task(agent)
+    assert responses == ['response 1', 'response 1']
+    assert agent.ollama_client.calls == 1
+    assert task_queue.get('a')['status'] == 'completed'
+    assert not redis_client.hgetall(CHECKPOINT_PREFIX + 'a') # cleared with the finished task
+
+
+def test_released_task_fails_when_out_of_attempts(task_queue, message_pipeline):
+    agent = LeaseAgent(lambda agent: agent.release_task("backend timed out"), 'agent-1', message_pipeline, task_queue,
+                       max_task_attempts=2)
+    task_queue.set('a', make_task('a', assigned_agent='agent-1'))
+    run_task(agent)
+    assert task_queue.get('a')['status'] == 'pending'
+    run_task(agent)
+    task = task_queue.get('a')
+    assert task['status'] == 'failed'
+    assert 'gave up after 2 attempts' in task['output']
@@ -0,0 +1,78 @@
+import time
+import logging
+
+import pytest
+
+from core.agent_usage import RollingUsage
+from core.resource_manager import ResourceManager
+from core.task_queue import RedisTaskQueue
+from junior_dev_agent import JuniorDevAgent
+
+LOGGER = logging.getLogger('test_agent_usage')
+
+
+def test_rolling_usage_keeps_totals_over_the_window():
+    usage = RollingUsage(window=2)
+    usage.record({'task_id': 'a', 'wall_time': 4.0, 'cpu_time': 1.0, 'llm_wait': 2.0, 'outcome': 'completed'})
+    usage.record({'task_id': 'b', 'wall_time': 2.0, 'cpu_time': 1.0, 'llm_wait': 1.0, 'outcome': 'failed'})
+    usage.record({'task_id': 'c', 'wall_time': 2.0, 'cpu_time': 0.0, 'llm_wait': 1.0, 'prompt_tokens': 10, 'outcome': 'failed'})
+    summary = usage.summary
+    assert (summary['tasks'], summary['lifetime_tasks'], summary['last_task_id']) == (2, 3, 'c')
+    assert summary['totals']['wall_time'] == 4.0 # 'a' left the window
+    assert summary['averages']['prompt_tokens'] == 5.0
+    assert summary['outcomes'] == {'failed': 2}
+    assert summary['cpu_share'] == pytest.approx(0.25)
+    assert summary['llm_share'] == pytest.approx(0.5)
+
+
+def test_empty_usage_has_no_averages():
+    summary = RollingUsage().summary
+    assert summary['tasks'] == 0 and summary['averages'] == {} and summary['cpu_share'] is None
+
+
+def test_usage_is_kept_per_agent_and_per_role():
+    manager = ResourceManager({'gpu_provider': 'none'}, logger=LOGGER)
+    manager.track_agent_resource('junior-1', {'role': 'JuniorDevAgent', 'wall_time': 1.0})
+    manager.track_agent_resource('junior-2', {'role': 'JuniorDevAgent', 'wall_time': 3.0})
+    manager.track_agent_resource('senior', {'role': 'SeniorDevAgent', 'wall_time': 5.0})
+    assert manager.get_agent_resource_usage('junior-2')['totals']['wall_time'] == 3.0
+    assert manager.get_role_resource_usage('JuniorDevAgent')['totals']['wall_time'] == 4.0
+    assert set(manager.get_role_summaries()) == {'JuniorDevAgent', 'SeniorDevAgent'}
+    assert manager.get_agent_resource_usage('nobody') == {}
+
+
+class CountingOllamaClient:
+    """
+    Takes a while to answer and reports token counts like the real client
+    """
+    def generate_text(self, model, prompt, usage=None, **kwargs):
+        time.sleep(0.05)
+        if usage is not None:
+            usage['prompt_tokens'] = usage.get('prompt_tokens', 0) + 12
+            usage['completion_tokens'] = usage.get('completion_tokens', 0) + 34
+        return "```python\nprint('hello')\n```"
+
+    def retain_context(self, context_key, holders=1):
+        pass
+
+    def release_context(self, context_key):
+        return True
+
+
+def test_agent_reports_the_usage_of_each_task(redis_client, message_pipeline):
+    manager = ResourceManager({'gpu_provider': 'none'}, logger=LOGGER)
+    task_queue = RedisTaskQueue(redis_client=redis_client)
+    junior = JuniorDevAgent('junior', 'llama-2-7b', message_pipeline, task_queue, logger=LOGGER, ollama_client=CountingOllamaClient(),
+                            resource_manager=manager, agent_id='junior-1', follow_ups=())
+    task = {'task_id': 'task-1', 'description': 'print hello', 'dependencies': [], 'status': 'pending', 'assigned_agent': 'junior-1',
+            'priority': 1, 'resource_requirements': {}, 'queued_at': time.time() - 2.0}
+    task_queue.set('task-1', task)
+    junior.start_task('task-1')
+    junior.handle_task(task)
+    summary = manager.get_agent_resource_usage('junior-1')
+    assert summary['outcomes'] == {'completed': 1}
+    assert (summary['totals']['prompt_tokens'], summary['totals']['completion_tokens']) == (12, 34)
+    assert summary['totals']['llm_wait'] >= 0.05
+    assert summary['totals']['wall_time'] >= summary['totals']['llm_wait']
+    assert summary['totals']['queue_wait'] == pytest.approx(2.0, abs=0.5)
+    assert manager.get_role_resource_usage('JuniorDevAgent')['tasks'] == 1
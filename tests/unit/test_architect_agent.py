@@ -0,0 +1,115 @@
+import json
+import time
+import logging
+
+import pytest
+
+from architect_agent import ArchitectAgent
+from conftest import make_task
+from core.scheduler import Scheduler
+from core.task_queue import RedisTaskQueue
+
+LOGGER = logging.getLogger('test_architect_agent')
+
+
+class StubOllamaClient:
+    def __init__(self, response):
+        self.response = response
+
+    def generate_text(self, model, prompt, **kwargs):
+        return self.response
+
+    def get_status(self):
+        return {}
+
+
+@pytest.fixture
+def task_queue(redis_client):
+    return RedisTaskQueue(redis_client=redis_client)
+
+
+def make_architect(task_queue, message_pipeline, response=None, **kwargs):
+    return ArchitectAgent('architect', 'gpt-4', message_pipeline, task_queue, logger=LOGGER, agent_id='architect',
+                          ollama_client=StubOllamaClient(response), **kwargs)
+
+
+def test_subtasks_are_parsed_from_json():
+    response = "Here is the plan:\n" + json.dumps({'subtasks': [
+        {'id': 1, 'description': ' Parse the input ', 'depends_on': []},
+        {'id': 2, 'description': 'Write the output', 'depends_on': 1},
+        "Document it",
+        {'id': 2, 'description': 'Test it', 'depends_on': ['1', '2']},
+        {'id': 5, 'description': ''}
+    ]})
+    assert ArchitectAgent.parse_subtasks(response) == [
+        {'id': '1', 'description': 'Parse the input', 'depends_on': []},
+        {'id': '2', 'description': 'Write the output', 'depends_on': ['1']},
+        {'id': '2-2', 'description': 'Document it', 'depends_on': []}, # its index is taken as the id, which is taken
+        {'id': '2-3', 'description': 'Test it', 'depends_on': ['1', '2']}
+    ]
+
+
+def test_response_without_json_is_read_line_by_line():
+    response = "1. Parse the input\n- Write the output\n```python\nprint('not a subtask')\n```\n"
+    assert [subtask['description'] for subtask in ArchitectAgent.parse_subtasks(response)] == ['Parse the input', 'Write the output']
+
+
+def test_subtasks_are_ordered_after_their_dependencies():
+    subtasks = [
+        {'id': 'c', 'description': 'c', 'depends_on': ['a', 'b']},
+        {'id': 'b', 'description': 'b', 'depends_on': ['a', 'unknown']},
+        {'id': 'a', 'description': 'a', 'depends_on': ['a']}
+    ]
+    assert [subtask['id'] for subtask in ArchitectAgent.order_subtasks(subtasks)] == ['a', 'b', 'c']
+
+
+def test_dependency_cycle_is_rejected():
+    subtasks = [{'id': 'a', 'description': 'a', 'depends_on': ['b']}, {'id': 'b', 'description': 'b', 'depends_on': ['a']}]
+    assert ArchitectAgent.order_subtasks(subtasks) is None
+
+
+def test_breakdown_creates_code_tasks_with_their_dependencies(task_queue, message_pipeline):
+    response = json.dumps({'subtasks': [
+        {'id': 'b', 'description': 'Write the output', 'depends_on': ['a']},
+        {'id': 'a', 'description': 'Parse the input', 'depends_on': []}
+    ]})
+    architect = make_architect(task_queue, message_pipeline, response)
+    task_queue.set('feature', make_task('feature', role='ArchitectAgent', priority=2))
+    architect.start_task('feature')
+    architect.handle_task(task_queue.get('feature'))
+
+    feature = task_queue.get('feature')
+    assert feature['status'] == 'completed'
+    write_id, parse_id = feature['output']['subtasks']
+    parse, write = task_queue.get(parse_id), task_queue.get(write_id)
+    assert parse['dependencies'] == ['feature']
+    assert write['dependencies'] == ['feature', parse_id]
+    assert (write['role'], write['resource_requirements'], write['priority']) == ('JuniorDevAgent', {'model': 'llama-2-7b'}, 2)
+
+
+def test_backlog_takes_the_highest_priority_then_the_largest(task_queue, message_pipeline):
+    architect = make_architect(task_queue, message_pipeline)
+    task_queue.set('small', make_task('small', role='ArchitectAgent', description='x'))
+    task_queue.set('large', make_task('large', role='ArchitectAgent', description='x' * 100))
+    task_queue.set('urgent', make_task('urgent', role='ArchitectAgent', description='x', priority=3))
+    task_queue.set('other', make_task('other', role='JuniorDevAgent', priority=9))
+    assert [architect.next_task()['task_id'] for _ in range(3)] == ['urgent', 'large', 'small']
+    assert architect.next_task() is None
+
+
+def test_reclaimed_task_returns_to_the_backlog(task_queue, message_pipeline):
+    architect = make_architect(task_queue, message_pipeline, lease_ttl=0.001)
+    architect.last_rescan = time.time() # only events bring tasks in
+    task_queue.set('feature', make_task('feature', role='ArchitectAgent'))
+    message_pipeline.publish('task_update', {'task_id': 'feature', 'status': 'pending', 'role': 'ArchitectAgent'})
+    task = architect.next_task()
+    assert task_queue.acquire_lease('feature', architect.id, architect.lease_ttl)
+    task['assigned_agent'] = architect.id
+    task['status'] = 'in_progress'
+    task_queue.set('feature', task)
+    assert architect.next_task() is None
+    time.sleep(0.01) # the architect crashed and never renewed the lease
+
+    scheduler = Scheduler(task_queue, resource_manager=None, pools=[], logger=LOGGER, message_pipeline=message_pipeline)
+    scheduler.reclaim_expired()
+    assert architect.next_task()['task_id'] == 'feature'
@@ -0,0 +1,95 @@
+import random
+
+import pytest
+import requests
+
+from fake_ollama import FakeOllamaServer, parse_distribution
+from fake_redis import FakeRedis
+from pipeline_benchmark import percentile, lookup
+from project_generator import generate_project, parse_models
+
+
+def test_generated_project_is_a_layered_dag():
+    tasks = generate_project(width=3, depth=4, fan_in=2, models='a:1,b:1', seed=7)
+    assert len(tasks) == 12
+    seen = set()
+    for index, task in enumerate(tasks):
+        layer = index // 3
+        assert len(task['dependencies']) == (0 if layer == 0 else 2)
+        assert set(task['dependencies']) <= seen # dependency order
+        assert task['resource_requirements']['model'] in {'a', 'b'}
+        seen.add(task['task_id'])
+
+
+def test_same_seed_gives_the_same_project():
+    first, second = generate_project(seed=3), generate_project(seed=3)
+    assert [task['task_id'] for task in first] == [task['task_id'] for task in second]
+    assert [task['dependencies'] for task in first] == [task['dependencies'] for task in second]
+    assert [task['task_id'] for task in generate_project(seed=4)] != [task['task_id'] for task in first]
+
+
+def test_model_mix_weights_default_to_one():
+    assert parse_models('llama-2-7b:3, gpt-4') == [('llama-2-7b', 3.0), ('gpt-4', 1.0)]
+
+
+@pytest.mark.parametrize('spec, low, high', [
+    ('constant:0.05', 0.05, 0.05),
+    ('uniform:0.01:0.1', 0.01, 0.1),
+    ('exponential:0.05', 0.0, float('inf')),
+    ('lognormal:0.05:0.5', 0.0, float('inf'))
+])
+def test_latency_distributions(spec, low, high):
+    random.seed(1)
+    sample = parse_distribution(spec)
+    assert all(low <= sample() <= high for _ in range(100))
+
+
+def test_unknown_latency_distribution_is_rejected():
+    with pytest.raises(ValueError):
+        parse_distribution('gaussian:1')
+
+
+def test_fake_ollama_loads_a_model_once():
+    server = FakeOllamaServer(latency='constant:0', load_time=0.05, tokens_per_sec=1e6, completion_tokens=8).start()
+    try:
+        cold = requests.post(f"{server.url}/api/generate", json={'model': 'm', 'prompt': 'x' * 40, 'stream': False}, timeout=5).json()
+        warm = requests.post(f"{server.url}/api/generate", json={'model': 'm', 'prompt': 'x' * 40, 'context': cold['context'], 'stream': False}, timeout=5).json()
+    finally:
+        server.stop()
+    assert cold['load_duration'] > 0 and warm['load_duration'] == 0
+    assert (cold['prompt_eval_count'], cold['eval_count']) == (10, 8)
+    assert server.get_status() == {'requests': 2, 'errors': 0}
+    assert 'm' in server.loaded
+
+
+def test_fake_ollama_fails_at_its_error_rate():
+    server = FakeOllamaServer(latency='constant:0', error_rate=1.0).start()
+    try:
+        response = requests.post(f"{server.url}/api/generate", json={'model': 'm', 'prompt': 'x', 'stream': False}, timeout=5)
+    finally:
+        server.stop()
+    assert response.status_code == 500
+    assert server.get_status()['errors'] == 1
+
+
+def test_fake_redis_counts_round_trips_and_commands():
+    fake = FakeRedis()
+    fake.set('a', b'1')
+    fake.mget(['a', 'b'])
+    assert fake.round_trips == 2
+    assert dict(fake.commands) == {'SET': 1, 'MGET': 1}
+    fake.reset_stats()
+    assert fake.round_trips == 0 and not fake.commands
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 100)) == (50, 95, 100)
+    assert percentile([], 50) is None
+
+
+def test_lookup_of_nested_results():
+    results = {'scheduling_latency': {'p50': 0.1}}
+    assert lookup(results, 'scheduling_latency.p50') == 0.1
+    assert lookup(results, 'scheduling_latency.p99') is None
+    assert lookup(results, 'missing.p50') is None
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from core import codec
+from core.codec import Codec, JSONCodec, get_codec, decode, codec_for_content_type
+
+OBJECT = {'task_id': 'a', 'status': 'pending', 'priority': 2, 'dependencies': ['b', 'c'], 'output': None,
+          'description': 'café ☕', 'nested': {'ratio': 0.5, 'flag': True}}
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_json_round_trip(fast):
+    json_codec = JSONCodec(fast=fast)
+    encoded = json_codec.encode(OBJECT)
+    assert encoded == json_codec.dumps(OBJECT) # written untagged, without copying the payload behind a tag
+    assert decode(encoded) == OBJECT
+    assert decode(memoryview(encoded)) == OBJECT
+    assert decode(bytearray(encoded)) == OBJECT
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip('msgpack')
+    encoded = get_codec('msgpack').encode(OBJECT)
+    assert encoded == bytes((codec.MSGPACK_TAG,)) + get_codec('msgpack').dumps(OBJECT)
+    assert decode(encoded) == OBJECT
+
+
+def test_untagged_payload_is_read_as_json():
+    assert decode(json.dumps(OBJECT).encode('utf-8')) == OBJECT
+
+
+def test_tagged_json_is_still_read():
+    assert decode(bytes((codec.JSON_TAG,)) + json.dumps(OBJECT).encode('utf-8')) == OBJECT
+
+
+def test_codecs_read_each_others_payloads():
+    pytest.importorskip('msgpack')
+    payloads = [get_codec('json').encode(OBJECT), get_codec('msgpack').encode(OBJECT)]
+    assert [decode(payload) for payload in payloads] == [OBJECT, OBJECT]
+
+
+def test_empty_payload_is_rejected():
+    with pytest.raises(ValueError):
+        decode(b'')
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        get_codec('xml')
+
+
+def test_codec_for_content_type():
+    assert codec_for_content_type(None).name == 'json'
+    assert codec_for_content_type('application/json; charset=utf-8').name == 'json'
+    assert codec_for_content_type('text/plain').name == 'json'
+    pytest.importorskip('msgpack')
+    assert codec_for_content_type('application/x-msgpack').name == 'msgpack'
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
@@ -0,0 +1,128 @@
+import time
+import logging
+
+import pytest
+
+from core.task_queue import RedisTaskQueue
+from junior_dev_agent import JuniorDevAgent
+from senior_dev_agent import SeniorDevAgent
+from test_dev_agent import TestDevAgent as DevTestAgent # not collected as a test class
+
+LOGGER = logging.getLogger('test_dev_agents')
+
+
+class StubOllamaClient:
+    """
+    Answers every call with a fixed response and counts the holders of each context
+    """
+    def __init__(self, response="```python\ndef add(a, b):\n    return a + b\n```"):
+        self.response = response
+        self.calls = []
+        self.holders = {}
+        self.released = []
+
+    def generate_text(self, model, prompt, **kwargs):
+        self.calls.append((model, prompt, kwargs))
+        return self.response
+
+    def retain_context(self, context_key, holders=1):
+        self.holders[context_key] = self.holders.get(context_key, 0) + holders
+
+    def release_context(self, context_key):
+        self.released.append(context_key)
+        self.holders[context_key] = max(0, self.holders.get(context_key, 0) - 1)
+        return self.holders[context_key] == 0
+
+    def get_status(self):
+        return {}
+
+
+@pytest.fixture
+def task_queue(redis_client):
+    return RedisTaskQueue(redis_client=redis_client)
+
+
+def start(agent, task_queue, **fields):
+    task = {'task_id': 'task-1', 'description': 'add two numbers', 'dependencies': [], 'status': 'in_progress',
+            'assigned_agent': agent.id, 'priority': 1, 'resource_requirements': {}, 'created_at': time.time(), **fields}
+    task_queue.set(task['task_id'], task)
+    agent.start_task(task['task_id'])
+    return task
+
+
+def test_junior_hands_the_conversation_to_follow_ups_on_its_model(task_queue, message_pipeline):
+    client = StubOllamaClient()
+    junior = JuniorDevAgent('junior', 'llama-2-7b', message_pipeline, task_queue, logger=LOGGER, ollama_client=client)
+    junior.handle_task(start(junior, task_queue))
+    follow_ups = [task for task in task_queue.values() if task['task_id'] != 'task-1']
+    models = {task['role']: task['resource_requirements']['model'] for task in follow_ups}
+    assert models == {'SeniorDevAgent': 'gpt-4', 'TestDevAgent': 'llama-2-7b'}
+    assert all(task['context_id'] == 'task-1' for task in follow_ups)
+    assert client.holders == {'task-1': 2} and not client.released
+
+
+def test_junior_releases_the_conversation_when_it_does_not_finish(task_queue, message_pipeline):
+    client = StubOllamaClient(response=None)
+    junior = JuniorDevAgent('junior', 'llama-2-7b', message_pipeline, task_queue, logger=LOGGER, ollama_client=client)
+    junior.handle_task(start(junior, task_queue))
+    assert task_queue.get('task-1')['status'] == 'pending' # released for a retry
+    assert client.released == ['task-1']
+
+
+@pytest.mark.parametrize('response, confidence_threshold, status', [
+    ('looks good', 0.8, 'completed'),
+    ('looks good', 1.0, 'paused'),
+    (None, 0.8, 'pending')
+])
+def test_review_releases_the_conversation_however_it_ends(task_queue, message_pipeline, response, confidence_threshold, status):
+    client = StubOllamaClient(response=response)
+    client.retain_context('task-0', 2)
+    senior = SeniorDevAgent('senior', 'gpt-4', message_pipeline, task_queue, logger=LOGGER, ollama_client=client,
+                            confidence_threshold=confidence_threshold)
+    senior.handle_task(start(senior, task_queue, output={'code': 'def add(a, b): return a + b'}, context_id='task-0'))
+    assert task_queue.get('task-1')['status'] == status
+    assert client.holders == {'task-0': 1}
+
+
+def test_review_sends_the_code_when_the_conversation_is_gone(task_queue, message_pipeline):
+    client = StubOllamaClient(response='looks good')
+    senior = SeniorDevAgent('senior', 'gpt-4', message_pipeline, task_queue, logger=LOGGER, ollama_client=client)
+    senior.handle_task(start(senior, task_queue, output={'code': 'def add(a, b): return a + b'}))
+    _, prompt, kwargs = client.calls[0]
+    assert 'code above' in prompt and 'def add' not in prompt
+    assert 'def add' in kwargs['fallback_prompt']
+
+
+class StubTestRunner:
+    def __init__(self, result):
+        self.result = {'tests_passed': 0, 'tests_failed': 0, 'tests_errored': 0, 'output': '', **result}
+        self.runs = []
+
+    def run(self, code, tests):
+        self.runs.append((code, tests))
+        return {'passed': self.result['status'] == 'passed', **self.result}
+
+
+@pytest.mark.parametrize('result, status', [
+    ({'status': 'passed', 'tests_passed': 2}, 'completed'),
+    ({'status': 'failed', 'tests_passed': 1, 'tests_failed': 1}, 'paused'),
+    ({'status': 'broken', 'output': 'ModuleNotFoundError'}, 'paused'), # the tests are at fault, ask for help
+    ({'status': 'error', 'output': 'no python'}, 'pending') # the runner is at fault, try again
+])
+def test_tester_acts_on_the_test_result(task_queue, message_pipeline, result, status):
+    client = StubOllamaClient(response="```python\nfrom candidate import add\n\ndef test_add():\n    assert add(1, 2) == 3\n```")
+    runner = StubTestRunner(result)
+    tester = DevTestAgent('tester', 'llama-2-13b', message_pipeline, task_queue, logger=LOGGER, ollama_client=client, test_runner=runner)
+    tester.handle_task(start(tester, task_queue, output={'code': '```python\ndef add(a, b):\n    return a + b\n```'}))
+    assert task_queue.get('task-1')['status'] == status
+    assert task_queue.get('task-1')['test_result']['status'] == result['status']
+    assert runner.runs == [("def add(a, b):\n    return a + b", "from candidate import add\n\ndef test_add():\n    assert add(1, 2) == 3")]
+    assert client.released == ['task-1']
+
+
+def test_tester_names_the_module_to_import(task_queue, message_pipeline):
+    client = StubOllamaClient(response=None)
+    tester = DevTestAgent('tester', 'llama-2-13b', message_pipeline, task_queue, logger=LOGGER, ollama_client=client)
+    tester.handle_task(start(tester, task_queue, output={'code': 'def add(a, b): return a + b'}))
+    _, prompt, kwargs = client.calls[0]
+    assert "module 'candidate'" in prompt and "module 'candidate'" in kwargs['fallback_prompt']
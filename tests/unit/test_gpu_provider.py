@@ -0,0 +1,66 @@
+import shutil
+import logging
+import subprocess
+
+import pytest
+
+from core import gpu_provider
+from core.gpu_provider import GPUProvider, NoGPUProvider, NvidiaSMIGPUProvider, TorchGPUProvider, get_gpu_provider
+
+LOGGER = logging.getLogger('test_gpu_provider')
+
+
+@pytest.mark.parametrize('on_path, expected', [('/usr/bin/nvidia-smi', NvidiaSMIGPUProvider), (None, NoGPUProvider)])
+def test_auto_uses_nvidia_smi_when_it_is_on_the_path(monkeypatch, on_path, expected):
+    monkeypatch.setattr(shutil, 'which', lambda name: on_path)
+    assert type(get_gpu_provider('auto', logger=LOGGER)) is expected
+
+
+def test_providers_by_name():
+    assert type(get_gpu_provider('none')) is NoGPUProvider
+    assert type(get_gpu_provider('torch', logger=LOGGER)) is TorchGPUProvider
+    with pytest.raises(ValueError):
+        get_gpu_provider('rocm')
+
+
+def test_torch_is_not_imported_until_asked(monkeypatch):
+    monkeypatch.setattr(TorchGPUProvider, 'is_installed', staticmethod(lambda: False))
+    imported = []
+    monkeypatch.setattr(gpu_provider.importlib, 'import_module', imported.append)
+    provider = get_gpu_provider('torch', logger=LOGGER)
+    assert not imported
+    assert provider.memory_info() is None and not provider.is_available()
+    assert not imported # not installed, so never imported
+
+
+def test_nvidia_smi_memory_is_read_in_bytes(monkeypatch):
+    monkeypatch.setattr(shutil, 'which', lambda name: '/usr/bin/nvidia-smi')
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        return subprocess.CompletedProcess(args, 0, stdout="1024, 8192\n")
+    monkeypatch.setattr(subprocess, 'run', run)
+    provider = NvidiaSMIGPUProvider(logger=LOGGER)
+    assert provider.is_available()
+    assert provider.memory_info() == (1024 * 1024 ** 2, 8192 * 1024 ** 2)
+    assert '--id=0' in calls[0]
+
+
+def test_nvidia_smi_without_a_gpu_stops_probing(monkeypatch):
+    monkeypatch.setattr(shutil, 'which', lambda name: '/usr/bin/nvidia-smi')
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        raise subprocess.CalledProcessError(9, args)
+    monkeypatch.setattr(subprocess, 'run', run)
+    provider = NvidiaSMIGPUProvider(logger=LOGGER)
+    assert not provider.is_available()
+    assert provider.memory_info() is None
+    assert len(calls) == 1
+
+
+def test_gpu_provider_is_abstract():
+    with pytest.raises(TypeError):
+        GPUProvider()
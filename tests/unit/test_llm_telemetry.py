@@ -0,0 +1,47 @@
+import pytest
+
+from api.llm_telemetry import LLMTelemetry, RollingLLMStats, _percentile
+
+
+def test_nearest_rank_percentile():
+    values = list(range(1, 101))
+    assert _percentile(values, 50) == 50
+    assert _percentile(values, 95) == 95
+    assert _percentile(values, 99) == 99
+    assert _percentile(values, 100) == 100
+    assert _percentile([7], 99) == 7
+    assert _percentile([], 50) is None
+
+
+def test_percentiles_cover_the_last_window_only():
+    stats = RollingLLMStats(window=10)
+    for latency in [100.0] * 10 + [1.0] * 10:
+        stats.record(latency, {})
+    status = stats.get_status()
+    assert status['calls'] == 20
+    assert status['latency_p50'] == status['latency_p99'] == 1.0
+
+
+def test_histogram_and_rates():
+    stats = RollingLLMStats(cold_load_threshold=0.5)
+    stats.record(0.2, {'eval_count': 50, 'eval_duration': 1e9, 'prompt_eval_count': 200, 'prompt_eval_duration': 0.5e9,
+                       'load_duration': 2e9})
+    stats.record(500.0, {'eval_count': 10, 'eval_duration': 1e9})
+    status = stats.get_status()
+    assert status['latency_histogram']['le_0.25'] == 1
+    assert status['latency_histogram']['le_inf'] == 1
+    assert status['tokens_per_sec'] == pytest.approx(30.0)
+    assert status['prompt_tokens_per_sec'] == pytest.approx(400.0)
+    assert status['cold_loads'] == 1
+    assert (status['prompt_tokens'], status['completion_tokens']) == (200, 60)
+
+
+def test_calls_are_grouped_per_model_and_agent():
+    telemetry = LLMTelemetry()
+    telemetry.record_call('m', 1.0, {}, agent='junior')
+    telemetry.record_call('m', 2.0, {})
+    telemetry.record_failure('n', agent='junior')
+    status = telemetry.get_status()
+    assert status['models']['m']['calls'] == 2
+    assert status['models']['n']['failures'] == 1
+    assert (status['agents']['junior']['calls'], status['agents']['junior']['failures']) == (1, 1)
@@ -0,0 +1,102 @@
+import io
+import sys
+import json
+import logging
+
+import pytest
+
+from utils.logger import RateLimitFilter, JsonFormatter, LogPipeline, log_context
+
+
+def make_record(msg, *args, level=logging.DEBUG, name='test_logger'):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_repeats_are_let_through_once_per_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('utils.logger.time.monotonic', lambda: now[0])
+    limit = RateLimitFilter(interval=10.0)
+    assert limit.filter(make_record("Polling task %s", 'a'))
+    assert not limit.filter(make_record("Polling task %s", 'b')) # the same message with other arguments
+    assert not limit.filter(make_record("Polling task %s", 'c'))
+    assert limit.filter(make_record("Polling task %s", 'a', name='other')) # another logger
+    now[0] += 10
+    record = make_record("Polling task %s", 'd')
+    assert limit.filter(record)
+    assert record.suppressed == 2
+    assert limit.suppressed == 2
+
+
+def test_records_above_the_level_are_not_limited():
+    limit = RateLimitFilter(interval=10.0, level=logging.INFO)
+    assert all(limit.filter(make_record("Lost the lease on task %s", 'a', level=logging.WARNING)) for _ in range(3))
+    assert limit.filter(make_record("Assigned task %s", 'a', level=logging.INFO))
+    assert not limit.filter(make_record("Assigned task %s", 'b', level=logging.INFO))
+
+
+def test_zero_interval_disables_the_limit():
+    limit = RateLimitFilter(interval=0)
+    assert all(limit.filter(make_record("Polling")) for _ in range(3))
+
+
+def test_json_lines_carry_the_context_fields():
+    record = make_record("Task %s failed: %s", 'a', 'timeout', level=logging.ERROR)
+    record.task_id, record.agent_id, record.suppressed = 'a', 'agent-1', 3
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry['message'] == "Task a failed: timeout"
+    assert (entry['level'], entry['logger']) == ('ERROR', 'test_logger')
+    assert (entry['task_id'], entry['agent_id'], entry['suppressed']) == ('a', 'agent-1', 3)
+    assert 'agent' not in entry and 'exception' not in entry
+
+
+def test_json_lines_include_the_traceback():
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        record = logging.LogRecord('test_logger', logging.ERROR, __file__, 1, "Failed", None, sys.exc_info())
+    entry = json.loads(JsonFormatter().format(record))
+    assert 'ValueError: bad value' in entry['exception']
+
+
+@pytest.fixture
+def log_pipeline():
+    stream = io.StringIO()
+    pipeline = LogPipeline(stream=stream, log_format='json', rate_limit_interval=10.0)
+    logger = logging.getLogger('test_logger.pipeline')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(pipeline.handler)
+    yield pipeline, logger, stream
+    logger.removeHandler(pipeline.handler)
+    pipeline.stop()
+
+
+def test_pipeline_writes_tagged_lines_and_drops_repeats(log_pipeline):
+    pipeline, logger, stream = log_pipeline
+    with log_context(task_id='a', agent_id='agent-1'):
+        logger.info("Starting task: %s", 'a')
+        for attempt in range(3):
+            logger.debug("Polling attempt %s", attempt)
+    arguments = {'changed': False}
+    logger.info("Arguments %s", arguments)
+    arguments['changed'] = True # rendered when it was logged, not when it is written
+    pipeline.stop()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [line['message'] for line in lines] == ["Starting task: a", "Polling attempt 0", "Arguments {'changed': False}"]
+    assert lines[0]['task_id'] == 'a' and lines[0]['agent_id'] == 'agent-1'
+    assert 'task_id' not in lines[2]
+    assert pipeline.get_status()['suppressed'] == 2
+
+
+def test_full_queue_drops_instead_of_blocking():
+    pipeline = LogPipeline(stream=io.StringIO(), queue_size=1)
+    pipeline.listener.stop() # nothing drains the queue
+    logger = logging.getLogger('test_logger.full')
+    logger.propagate = False
+    logger.addHandler(pipeline.handler)
+    try:
+        for index in range(5):
+            logger.warning("Message %s", index)
+    finally:
+        logger.removeHandler(pipeline.handler)
+    assert pipeline.get_status()['dropped'] == 4 # one fits the queue
@@ -0,0 +1,352 @@
+import json
+import time
+import socket
+import logging
+import threading
+import http.client
+
+import pytest
+
+from core.metrics import MetricsRegistry
+from core.message_pipeline import HTTPMessagePipeline, _Subscriber, _HTTPRequestHandler, compile_topic_pattern
+
+LOGGER = logging.getLogger('test_message_pipeline')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class GatedHandler:
+    """
+    Handler that blocks until released, to fill a subscriber's queue
+    """
+    def __init__(self):
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.received = []
+
+    def __call__(self, data):
+        self.started.set()
+        self.gate.wait(5)
+        self.received.append(data)
+
+
+def test_async_dispatch_does_not_wait_for_the_handler():
+    pipeline = HTTPMessagePipeline(logger=LOGGER, dispatch_mode='async')
+    handler = GatedHandler()
+    pipeline.subscribe('task_update', handler)
+    started = time.time()
+    for i in range(3):
+        pipeline.publish('task_update', {'task_id': str(i)})
+    assert time.time() - started < 1.0
+    handler.gate.set()
+    wait_for(lambda: len(handler.received) == 3)
+    assert [data['task_id'] for data in handler.received] == ['0', '1', '2'] # publish order
+    pipeline.close_subscribers()
+
+
+def test_a_handler_on_several_types_shares_one_queue():
+    pipeline = HTTPMessagePipeline(logger=LOGGER, dispatch_mode='async')
+    received = []
+    pipeline.subscribe('a', received.append)
+    pipeline.subscribe('b', received.append)
+    for i in range(20):
+        pipeline.publish('a' if i % 2 else 'b', {'n': i})
+    wait_for(lambda: len(received) == 20)
+    assert [data['n'] for data in received] == list(range(20))
+    assert len(pipeline.get_status()['subscribers']) == 1
+    pipeline.close_subscribers()
+
+
+def fill(subscriber, handler, messages):
+    """
+    Puts the first message in the handler and queues the rest behind it
+    """
+    subscriber.start()
+    subscriber.put('task_update', messages[0])
+    assert handler.started.wait(5)
+    for message in messages[1:]:
+        subscriber.put('task_update', message)
+
+
+def test_drop_oldest_keeps_the_newest_messages():
+    handler = GatedHandler()
+    subscriber = _Subscriber(handler, maxsize=2, overflow_policy='drop_oldest', logger=LOGGER)
+    fill(subscriber, handler, [{'task_id': str(i)} for i in range(5)])
+    handler.gate.set()
+    subscriber.stop()
+    assert [data['task_id'] for data in handler.received] == ['0', '3', '4']
+    assert subscriber.dropped == 2
+
+
+def test_coalesce_replaces_the_queued_message_of_the_same_key():
+    handler = GatedHandler()
+    subscriber = _Subscriber(handler, maxsize=2, overflow_policy='coalesce', logger=LOGGER)
+    fill(subscriber, handler, [{'task_id': 'x', 'status': 'pending'}, {'task_id': 'a', 'status': 'pending'},
+                               {'task_id': 'b', 'status': 'pending'}, {'task_id': 'a', 'status': 'completed'}])
+    handler.gate.set()
+    subscriber.stop()
+    # the update of 'a' took the place of its queued message instead of dropping anything
+    assert [(data['task_id'], data['status']) for data in handler.received] == [('x', 'pending'), ('a', 'completed'), ('b', 'pending')]
+    assert (subscriber.coalesced, subscriber.dropped) == (1, 0)
+
+
+def test_block_waits_for_space():
+    handler = GatedHandler()
+    subscriber = _Subscriber(handler, maxsize=1, overflow_policy='block', logger=LOGGER)
+    fill(subscriber, handler, [{'task_id': '0'}, {'task_id': '1'}])
+    done = threading.Event()
+    threading.Thread(target=lambda: subscriber.put('task_update', {'task_id': '2'}) and done.set(), daemon=True).start()
+    assert not done.wait(0.1) # the queue is full, the publisher waits
+    handler.gate.set()
+    assert done.wait(5)
+    subscriber.stop()
+    assert [data['task_id'] for data in handler.received] == ['0', '1', '2']
+    assert subscriber.dropped == 0
+
+
+def test_failing_handler_is_counted_and_does_not_stop_delivery():
+    received = []
+
+    def handler(data):
+        if data['n'] == 0:
+            raise RuntimeError('boom')
+        received.append(data)
+    subscriber = _Subscriber(handler, logger=LOGGER)
+    subscriber.start()
+    subscriber.put('a', {'n': 0})
+    subscriber.put('a', {'n': 1})
+    subscriber.stop()
+    assert received == [{'n': 1}] and subscriber.errors == 1
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        _Subscriber(print, overflow_policy='ignore')
+
+
+
+@pytest.mark.parametrize('pattern, topic, matches', [
+    ('task_*', 'task_update', True),
+    ('task_*', 'task.update', False),
+    ('agent.*.status', 'agent.senior.status', True),
+    ('agent.*.status', 'agent.senior.dev.status', False),
+    ('task.#', 'task.a.b', True),
+    ('task.#', 'tasks.a', False),
+    ('a+b*', 'a+bc', True) # other characters are literal
+])
+def test_topic_patterns(pattern, topic, matches):
+    assert bool(compile_topic_pattern(pattern).match(topic)) == matches
+
+
+def test_wildcard_and_exact_subscriptions_are_routed_once():
+    pipeline = HTTPMessagePipeline(logger=LOGGER)
+    received = []
+    pipeline.subscribe('task_*', received.append)
+    pipeline.subscribe('task_update', received.append)
+    other = []
+    pipeline.subscribe('request_*', other.append)
+    pipeline.publish('task_update', {'n': 1})
+    pipeline.publish('task_created', {'n': 2})
+    assert received == [{'n': 1}, {'n': 2}] # once each, although 'task_update' matches both subscriptions
+    assert not other
+    pipeline.unsubscribe('task_*', received.append)
+    pipeline.publish('task_created', {'n': 3}) # the cached route is resolved again
+    pipeline.publish('task_update', {'n': 4})
+    assert received == [{'n': 1}, {'n': 2}, {'n': 4}]
+
+
+def test_coalesce_window_delivers_the_latest_update_per_key():
+    pipeline = HTTPMessagePipeline(logger=LOGGER) # sync dispatch, the window gives the handler its own queue
+    received = []
+    pipeline.subscribe('task_update', received.append, coalesce_window=0.2)
+    for status in ('pending', 'in_progress', 'completed'):
+        pipeline.publish('task_update', {'task_id': 'a', 'status': status})
+    pipeline.publish('task_update', {'task_id': 'b', 'status': 'pending'})
+    time.sleep(0.05)
+    assert not received # still held for the window
+    wait_for(lambda: len(received) == 2)
+    time.sleep(0.25)
+    assert received == [{'task_id': 'a', 'status': 'completed'}, {'task_id': 'b', 'status': 'pending'}]
+    assert pipeline.get_status()['subscribers'][0]['coalesced'] == 2
+    pipeline.close_subscribers()
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = HTTPMessagePipeline(port=free_port(), logger=LOGGER)
+    pipeline.start()
+    yield pipeline
+    pipeline.stop()
+
+
+def post(pipeline, body: bytes, headers: dict, path: str = '/', connection: http.client.HTTPConnection = None) -> tuple:
+    """
+    Sends a POST with exactly the given headers, returns the status code and the JSON body of the answer.
+    A connection that is passed in is left open for the next request.
+    """
+    own = connection is None
+    if own:
+        connection = http.client.HTTPConnection(pipeline.host, pipeline.port, timeout=5)
+    try:
+        connection.putrequest('POST', path, skip_accept_encoding=True)
+        for name, value in headers.items():
+            connection.putheader(name, value)
+        connection.endheaders(body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b'null')
+    finally:
+        if own:
+            connection.close()
+
+
+def post_json(pipeline, payload, path: str = '/', connection: http.client.HTTPConnection = None) -> tuple:
+    body = json.dumps(payload).encode('utf-8')
+    return post(pipeline, body, {'Content-Length': len(body), 'Content-Type': 'application/json'}, path, connection)
+
+
+def test_publish_reaches_subscribers(pipeline):
+    received = []
+    pipeline.subscribe('task_update', received.append)
+    status, _ = post_json(pipeline, {'type': 'task_update', 'data': {'task_id': 'a'}})
+    assert status == 200
+    wait_for(lambda: received)
+    assert received == [{'task_id': 'a'}]
+
+
+def test_connection_is_kept_alive_between_messages(pipeline):
+    received = []
+    pipeline.subscribe('task_update', received.append)
+    connection = http.client.HTTPConnection(pipeline.host, pipeline.port, timeout=5)
+    try:
+        post_json(pipeline, {'type': 'task_update', 'data': {'task_id': 'a'}}, connection=connection)
+        sock = connection.sock
+        status, _ = post_json(pipeline, {'type': 'task_update', 'data': {'task_id': 'b'}}, connection=connection)
+        assert status == 200
+        assert connection.sock is sock # the same socket served both requests
+    finally:
+        connection.close()
+    assert received == [{'task_id': 'a'}, {'task_id': 'b'}]
+
+
+def test_batch_publishes_every_message_and_reports_failures(pipeline):
+    received = []
+    pipeline.subscribe('task_update', received.append)
+    status, body = post_json(pipeline, [
+        {'type': 'task_update', 'data': {'task_id': 'a'}},
+        {'data': {'task_id': 'no type'}},
+        {'type': 'task_update', 'data': {'task_id': 'b'}}
+    ], path='/batch')
+    assert status == 207
+    assert (body['accepted'], body['failed']) == (2, 1)
+    assert [result['status'] for result in body['results']] == ['ok', 'error', 'ok']
+    assert received == [{'task_id': 'a'}, {'task_id': 'b'}]
+    status, body = post_json(pipeline, [{'type': 'task_update', 'data': {'task_id': 'c'}}], path='/batch')
+    assert (status, body['accepted']) == (200, 1)
+
+
+def test_batch_must_be_an_array(pipeline):
+    status, _ = post_json(pipeline, {'type': 'task_update', 'data': {}}, path='/batch')
+    assert status == 400
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1.5'])
+def test_malformed_content_length_is_rejected(pipeline, length):
+    status, body = post(pipeline, b'{}', {'Content-Length': length})
+    assert status == 400
+    assert 'Content-Length' in body['error']
+
+
+def test_missing_content_length_is_rejected(pipeline):
+    status, _ = post(pipeline, b'', {})
+    assert status == 411
+
+
+def test_message_without_type_is_rejected(pipeline):
+    status, _ = post_json(pipeline, {'data': {}})
+    assert status == 400
+
+
+def read_event(response) -> tuple:
+    """
+    Reads the next Server-Sent Event, returns its type and data
+    """
+    fields = {}
+    while True:
+        line = response.fp.readline().decode('utf-8').rstrip('\n')
+        if not line:
+            if fields:
+                return fields['event'], json.loads(fields['data'])
+            continue
+        if not line.startswith(':'):
+            name, _, value = line.partition(': ')
+            fields[name] = value
+
+
+def open_events(pipeline, query: str = ''):
+    connection = http.client.HTTPConnection(pipeline.host, pipeline.port, timeout=5)
+    connection.request('GET', f'/events{query}')
+    response = connection.getresponse()
+    assert response.status == 200 and response.getheader('Content-Type') == 'text/event-stream'
+    return connection, response
+
+
+def test_event_stream_starts_with_a_snapshot_then_sends_deltas(pipeline, monkeypatch):
+    monkeypatch.setattr(_HTTPRequestHandler, 'heartbeat_interval', 0.05) # notices the client left on the next keep-alive
+    pipeline.publish('task_update', {'task_id': 'a', 'status': 'pending'})
+    pipeline.publish('task_update', {'task_id': 'a', 'status': 'in_progress'})
+    pipeline.publish('task_update', {'task_id': 'b', 'status': 'pending'})
+    connection, response = open_events(pipeline, '?topics=task_update&task_id=a')
+    try:
+        assert read_event(response) == ('snapshot', [{'task_id': 'a', 'status': 'in_progress'}])
+        pipeline.publish('task_update', {'task_id': 'b', 'status': 'completed'}) # another task
+        pipeline.publish('request_help', {'task_id': 'a', 'message': 'help'}) # another topic
+        pipeline.publish('task_update', {'task_id': 'a', 'status': 'completed'})
+        assert read_event(response) == ('task_update', {'task_id': 'a', 'status': 'completed'})
+    finally:
+        response.close()
+        connection.close()
+    wait_for(lambda: not pipeline.event_streams)
+
+
+def test_task_states_are_seeded_from_the_task_queue(redis_client):
+    from core.task_queue import RedisTaskQueue
+    task_queue = RedisTaskQueue(redis_client=redis_client)
+    for i, status in enumerate(['completed', 'in_progress', 'pending']):
+        task_queue.set(f'task-{i}', {'task_id': f'task-{i}', 'status': status, 'assigned_agent': 'agent-1' if i < 2 else None,
+                                     'role': 'JuniorDevAgent', 'created_at': float(i)})
+    pipeline = HTTPMessagePipeline(logger=LOGGER, task_queue=task_queue, max_task_states=2)
+    pipeline.publish('task_update', {'task_id': 'task-2', 'status': 'in_progress', 'agent_id': 'agent-2'}) # newer than the store
+    pipeline.seed_task_states()
+    _, snapshot = pipeline.open_event_stream({'task_update'})
+    assert snapshot['tasks'] == [
+        {'task_id': 'task-1', 'status': 'in_progress', 'agent_id': 'agent-1', 'role': 'JuniorDevAgent'},
+        {'task_id': 'task-2', 'status': 'in_progress', 'agent_id': 'agent-2'}
+    ]
+
+
+def test_metrics_are_served_in_the_text_format():
+    registry = MetricsRegistry()
+    registry.counter('tasks_total', 'Tasks finished', ('outcome',)).labels('completed').inc()
+    pipeline = HTTPMessagePipeline(port=free_port(), metrics_registry=registry, logger=LOGGER)
+    pipeline.start()
+    try:
+        connection = http.client.HTTPConnection(pipeline.host, pipeline.port, timeout=5)
+        connection.request('GET', '/metrics')
+        response = connection.getresponse()
+        assert response.status == 200
+        assert response.getheader('Content-Type').startswith('text/plain; version=0.0.4')
+        assert 'tasks_total{outcome="completed"} 1' in response.read().decode('utf-8').splitlines()
+        connection.close()
+    finally:
+        pipeline.stop()
@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+
+from core.metrics import MetricsRegistry
+
+
+def test_histogram_exposition():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('stage_seconds', 'Time per stage', ('role',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        histogram.labels('junior').observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP stage_seconds Time per stage', '# TYPE stage_seconds histogram']
+    assert 'stage_seconds_bucket{role="junior",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{role="junior",le="1"} 3' in lines
+    assert 'stage_seconds_bucket{role="junior",le="+Inf"} 4' in lines
+    assert 'stage_seconds_sum{role="junior"} 3.05' in lines
+    assert 'stage_seconds_count{role="junior"} 4' in lines
+
+
+def test_counter_labels_and_escaping():
+    registry = MetricsRegistry()
+    counter = registry.counter('tasks_total', 'Tasks "done"\nper role', ('role',))
+    counter.labels(role='a"b').inc()
+    counter.labels('a"b').inc(2)
+
+    text = registry.render()
+    assert '# HELP tasks_total Tasks "done"\\nper role' in text
+    assert 'tasks_total{role="a\\"b"} 3' in text
+
+
+def test_counts_from_many_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter('calls_total', 'Calls')
+
+    def work():
+        for _ in range(1000):
+            counter.inc()
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'calls_total 8000' in registry.render() # counts of exited threads are kept
+
+
+def test_registering_again_returns_the_metric():
+    registry = MetricsRegistry()
+    assert registry.counter('x_total', 'X', ('a',)) is registry.counter('x_total', 'X', ('a',))
+    with pytest.raises(ValueError):
+        registry.histogram('x_total', 'X', ('a',))
+
+
+def test_wrong_label_count_is_rejected():
+    registry = MetricsRegistry()
+    with pytest.raises(ValueError):
+        registry.counter('y_total', 'Y', ('a', 'b')).labels('only one')
@@ -0,0 +1,298 @@
+import json
+import time
+import logging
+import threading
+
+import pytest
+
+import requests
+
+from api.ollama_client import OllamaClient, ConversationContexts
+from core.rate_limiter import RateLimiter
+
+HOSTS = ['http://gpu-1:11434', 'http://gpu-2:11434']
+
+
+@pytest.fixture
+def client():
+    return OllamaClient(hosts=HOSTS, logger=logging.getLogger('test_ollama_client'), max_failures=2, ejection_time=30.0)
+
+
+def test_routes_to_least_outstanding_host(client):
+    first = client._select_host('m')
+    second = client._select_host('m')
+    assert {first.url, second.url} == set(HOSTS)
+    client._release_host(first, 'm', time.time(), True)
+    assert client._select_host('m') is first
+
+
+def test_prefers_host_with_model_loaded_within_slack(client):
+    loaded = client.hosts[1]
+    loaded.loaded_models.add('m')
+    loaded.outstanding = client.affinity_slack
+    assert client._select_host('m') is loaded
+    loaded.outstanding += 1 # now more than the slack over the idle host
+    assert client._select_host('m') is client.hosts[0]
+
+
+def test_only_hosts_serving_the_model():
+    client = OllamaClient(hosts=[{'url': HOSTS[0], 'models': ['a']}, {'url': HOSTS[1], 'models': ['b']}],
+                          logger=logging.getLogger('test_ollama_client'))
+    assert client._select_host('b').url == HOSTS[1]
+    assert client._select_host('b').url == HOSTS[1]
+
+
+def test_open_circuit_takes_host_out_and_half_open_lets_one_probe_through(client):
+    failing = client.hosts[0]
+    for _ in range(2):
+        client._take_slot(failing, time.time())
+        client._release_host(failing, 'm', time.time(), False)
+    assert failing.breaker.state == failing.breaker.OPEN
+    assert all(client._select_host('m') is client.hosts[1] for _ in range(3))
+
+    failing.breaker.opened_at -= 30.0 # recovery time is over
+    client.hosts[1].outstanding = 10
+    probe = client._select_host('m')
+    assert probe is failing and failing.breaker.state == failing.breaker.HALF_OPEN
+    assert client._select_host('m') is client.hosts[1] # the probe slot is taken
+    client._release_host(probe, 'm', time.time(), True)
+    assert failing.breaker.state == failing.breaker.CLOSED
+
+
+def test_fails_fast_when_every_circuit_is_open(client):
+    for host in client.hosts:
+        for _ in range(2):
+            client._take_slot(host, time.time())
+            client._release_host(host, 'm', time.time(), False)
+    assert client._select_host('m') is None
+    assert client.generate_text('m', 'hello', timeout=1) is None
+    assert client.fast_failures == 1
+
+
+class FakeResponse:
+    """
+    Stands in for a requests response, streaming the given lines
+    """
+    def __init__(self, status_code=200, lines=(), body=None, on_line=None):
+        self.status_code = status_code
+        self.lines = lines
+        self.body = body or {}
+        self.on_line = on_line
+        self.closed = False
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def iter_lines(self):
+        for line in self.lines:
+            if self.on_line:
+                self.on_line()
+            yield json.dumps(line).encode('utf-8')
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return self.body
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+CHUNKS = [{'response': 'a'}, {'response': 'b'}, {'response': '', 'done': True, 'prompt_eval_count': 1, 'eval_count': 2}]
+
+
+def test_stream_reserves_nothing_until_iterated(client, monkeypatch):
+    sent = []
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: sent.append(1) or FakeResponse(lines=CHUNKS))
+    stream = client.generate_text('m', 'hello', stream=True, timeout=5)
+    assert not sent and all(host.outstanding == 0 for host in client.hosts)
+    assert list(stream) == ['a', 'b', 'ab']
+    assert all(host.outstanding == 0 for host in client.hosts)
+
+
+def test_stream_closed_early_releases_the_host_and_the_probe(client, monkeypatch):
+    response = FakeResponse(lines=CHUNKS)
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: response)
+    host = client.hosts[0]
+    client.hosts[1].outstanding = 10
+    host.breaker.state, host.breaker.opened_at = host.breaker.OPEN, time.time() - 60 # the next request is the probe
+    stream = client.generate_text('m', 'hello', stream=True, timeout=5)
+    assert next(stream) == 'a'
+    assert host.outstanding == 1 and host.breaker.probe_in_flight
+    stream.close()
+    assert host.outstanding == 0 and not host.breaker.probe_in_flight
+    assert response.closed
+
+
+def test_stream_stops_at_the_deadline(client, monkeypatch):
+    clock = [time.time()]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    lines = [{'response': str(i)} for i in range(10)]
+    response = FakeResponse(lines=lines, on_line=lambda: clock.__setitem__(0, clock[0] + 1.0))
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: response)
+    chunks = list(client.generate_text('m', 'hello', stream=True, timeout=3.5))
+    assert chunks == ['0', '1', '2', '012'] # the full text of what arrived in time
+    assert all(host.outstanding == 0 for host in client.hosts)
+    assert response.closed
+
+
+def test_server_error_response_is_closed_before_retrying(client, monkeypatch):
+    responses = [FakeResponse(status_code=503), FakeResponse(body={'response': 'ok'})]
+    sent = []
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: sent.append(responses.pop(0)) or sent[-1])
+    monkeypatch.setattr(client, '_backoff', lambda attempt, deadline: True)
+    assert client.generate_text('m', 'hello', timeout=5) == 'ok'
+    assert sent[0].closed
+
+
+def test_health_check_marks_hosts_without_touching_the_circuit(client, monkeypatch):
+    down = client.hosts[1]
+    for _ in range(2):
+        client._take_slot(down, time.time())
+        client._release_host(down, 'm', time.time(), False)
+    assert down.breaker.state == down.breaker.OPEN
+
+    def get(url, **kwargs):
+        if url.startswith(HOSTS[0]):
+            raise requests.exceptions.ConnectionError('refused')
+        return FakeResponse(body={'models': [{'name': 'm:latest'}]})
+    monkeypatch.setattr(requests, 'get', get)
+    client.check_health()
+    assert not client.hosts[0].healthy and client.hosts[0].breaker.state == client.hosts[0].breaker.CLOSED
+    assert down.healthy and down.loaded_models == {'m:latest', 'm'}
+    assert down.breaker.state == down.breaker.OPEN # only a real request through the half open circuit closes it
+
+
+def test_retries_a_server_error_on_the_other_host(client, monkeypatch):
+    urls = []
+
+    def post(url, **kwargs):
+        urls.append(url)
+        return FakeResponse(status_code=500) if len(urls) == 1 else FakeResponse(body={'response': 'ok'})
+    monkeypatch.setattr(requests, 'post', post)
+    monkeypatch.setattr(client, '_backoff', lambda attempt, deadline: True)
+    assert client.generate_text('m', 'hello', timeout=5) == 'ok'
+    assert urls[0].split('/api')[0] != urls[1].split('/api')[0]
+    assert all(host.outstanding == 0 for host in client.hosts)
+
+
+def test_gives_up_after_max_retries(client, monkeypatch):
+    urls = []
+    monkeypatch.setattr(requests, 'post', lambda url, **kwargs: urls.append(url) or FakeResponse(status_code=500))
+    monkeypatch.setattr(client, '_backoff', lambda attempt, deadline: True)
+    assert client.generate_text('m', 'hello', timeout=5) is None
+    assert len(urls) == client.max_retries + 1
+
+
+def test_exhausted_retry_budget_stops_retrying(client, monkeypatch):
+    urls = []
+    monkeypatch.setattr(requests, 'post', lambda url, **kwargs: urls.append(url) or FakeResponse(status_code=500))
+    monkeypatch.setattr(client, '_backoff', lambda attempt, deadline: True)
+    client.retry_budget.tokens = 0.0
+    assert client.generate_text('m', 'hello', timeout=5) is None
+    assert len(urls) == 1
+
+
+def test_client_errors_are_not_retried(client, monkeypatch):
+    urls = []
+    monkeypatch.setattr(requests, 'post', lambda url, **kwargs: urls.append(url) or FakeResponse(status_code=404))
+    assert client.generate_text('m', 'hello', timeout=5) is None
+    assert len(urls) == 1
+    assert all(host.breaker.consecutive_failures == 0 for host in client.hosts)
+
+
+def test_backoff_does_not_sleep_past_the_deadline(client, monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, 'sleep', slept.append)
+    monkeypatch.setattr('random.uniform', lambda low, high: high)
+    assert not client._backoff(3, time.time() + 1.0) # 4s of backoff does not fit
+    assert client._backoff(0, time.time() + 10.0)
+    assert slept == [client.backoff_base]
+
+
+def test_expired_deadline_sends_nothing(client, monkeypatch):
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: pytest.fail('nothing should be sent'))
+    assert client.generate_text('m', 'hello', deadline=time.time() - 1) is None
+    assert client.telemetry.get_status()['models']['m']['failures'] == 1
+
+
+def test_contexts_are_kept_until_every_holder_released():
+    contexts = ConversationContexts()
+    contexts.put('task', 'm', [1, 2, 3], HOSTS[0])
+    contexts.retain('task', 2)
+    assert not contexts.release('task')
+    assert contexts.get('task', 'm')['context'] == [1, 2, 3]
+    assert contexts.release('task')
+    assert contexts.get('task', 'm') is None
+
+
+def test_contexts_without_holders_are_released_right_away():
+    contexts = ConversationContexts()
+    contexts.put('task', 'a', [1], HOSTS[0])
+    contexts.put('task', 'b', [2], HOSTS[1])
+    assert contexts.release('task')
+    assert len(contexts) == 0
+
+
+def test_contexts_evict_least_recently_used():
+    contexts = ConversationContexts(max_entries=2)
+    contexts.put('a', 'm', [1], HOSTS[0])
+    contexts.put('b', 'm', [2], HOSTS[0])
+    contexts.get('a', 'm')
+    contexts.put('c', 'm', [3], HOSTS[0])
+    assert contexts.get('b', 'm') is None
+    assert contexts.get('a', 'm') is not None
+
+
+def test_follow_up_prompt_falls_back_when_the_context_is_gone(client, monkeypatch):
+    prompts = []
+
+    def post(url, json=None, **kwargs):
+        prompts.append((json['prompt'], 'context' in json))
+        return FakeResponse(body={'response': 'ok', 'context': [1, 2]})
+    monkeypatch.setattr(requests, 'post', post)
+    client.generate_text('m', 'code', context_key='task', timeout=5)
+    client.generate_text('m', 'review the code above', context_key='task', fallback_prompt='review this code', timeout=5)
+    client.release_context('task')
+    client.generate_text('m', 'review the code above', context_key='task', fallback_prompt='review this code', timeout=5)
+    assert prompts[1:] == [('review the code above', True), ('review this code', False)]
+
+
+def test_waiting_for_rate_limit_holds_no_host_slot():
+    pytest.importorskip('requests')
+    from fake_ollama import FakeOllamaServer
+    server = FakeOllamaServer(latency='constant:0.01', load_time=0.0, completion_tokens=1).start()
+    try:
+        rate_limiter = RateLimiter({'model:m': {'requests_per_second': 5, 'burst': 1}}, logger=logging.getLogger('test_ollama_client'))
+        client = OllamaClient(host=server.url, logger=logging.getLogger('test_ollama_client'), rate_limiter=rate_limiter)
+        threads = [threading.Thread(target=client.generate_text, args=('m', 'hello'), kwargs={'timeout': 10}) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        peak = 0
+        while any(thread.is_alive() for thread in threads):
+            peak = max(peak, client.hosts[0].outstanding)
+            time.sleep(0.002)
+        assert peak <= 2 # one in flight, maybe one more just released by the limiter, not all four
+        assert client.hosts[0].outstanding == 0
+        assert client.hosts[0].total_requests == 4
+    finally:
+        server.stop()
+
+
+def test_rate_limit_is_settled_with_the_tokens_used(monkeypatch):
+    rate_limiter = RateLimiter({'model:m': {'tokens_per_minute': 600}}, logger=logging.getLogger('test_ollama_client'))
+    client = OllamaClient(hosts=HOSTS, logger=logging.getLogger('test_ollama_client'), rate_limiter=rate_limiter,
+                          expected_completion_tokens=1000) # more than the bucket holds
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: FakeResponse(body={'response': 'ok', 'prompt_eval_count': 50, 'eval_count': 50}))
+    assert client.generate_text('m', 'hello', timeout=5) == 'ok'
+    available = rate_limiter.get_status()['buckets']['model:m:tokens']['available']
+    assert available == pytest.approx(500, abs=1) # 600 taken up front, settled to the 100 used
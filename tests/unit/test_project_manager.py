@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+
+from conftest import make_task
+from core.resource_manager import ResourceManager
+from core.task_queue import RedisTaskQueue
+from project_manager_agent import ProjectManagerAgent
+
+LOGGER = logging.getLogger('test_project_manager')
+
+
+@pytest.fixture
+def project_manager(redis_client, message_pipeline):
+    task_queue = RedisTaskQueue(redis_client=redis_client)
+    resource_manager = ResourceManager({'gpu_provider': 'none'}, logger=LOGGER)
+    return ProjectManagerAgent(name="Project Manager", model="m", message_pipeline=message_pipeline, task_queue=task_queue,
+                               resource_manager=resource_manager, logger=LOGGER)
+
+
+def test_report_reads_the_counts_without_a_scan(project_manager, monkeypatch):
+    task_queue = project_manager.task_queue
+    for task_id, status in [('a', 'pending'), ('b', 'in_progress'), ('c', 'completed'), ('d', 'failed')]:
+        task_queue.set(task_id, make_task(task_id, status))
+    project_manager.last_reconcile = float('inf') # no reconcile due
+    monkeypatch.setattr(task_queue, 'values', lambda: pytest.fail("the report scanned the tasks"))
+    project_manager.process_task()
+    report = project_manager.last_report
+    assert report['status_counts'] == {'pending': 1, 'in_progress': 1, 'completed': 1, 'failed': 1}
+    assert report['total'] == 4
+    assert report['throughput_per_minute'] is None and report['eta_seconds'] is None # a single report, nothing to compare
+
+
+def test_throughput_and_eta_come_from_the_finished_count(project_manager, monkeypatch):
+    task_queue = project_manager.task_queue
+    for task_id in 'abcd':
+        task_queue.set(task_id, make_task(task_id))
+    now = [1000.0]
+    monkeypatch.setattr('project_manager_agent.time.time', lambda: now[0])
+    project_manager.process_task()
+    task_queue.set('a', make_task('a', 'completed'))
+    now[0] += 60
+    project_manager.process_task()
+    report = project_manager.last_report
+    assert report['throughput_per_minute'] == pytest.approx(1.0)
+    assert report['eta_seconds'] == pytest.approx(180.0) # three tasks left at one a minute
+
+
+def test_reconcile_runs_on_its_interval(project_manager, redis_client, monkeypatch):
+    task_queue = project_manager.task_queue
+    task_queue.set('a', make_task('a'))
+    redis_client.set('b', task_queue.codec.encode(make_task('b'))) # written behind the counts
+    now = [1000.0]
+    monkeypatch.setattr('project_manager_agent.time.time', lambda: now[0])
+    project_manager.process_task()
+    assert project_manager.last_report['total'] == 2 # the first report reconciles
+    redis_client.set('c', task_queue.codec.encode(make_task('c')))
+    now[0] += 10
+    project_manager.process_task()
+    assert project_manager.last_report['total'] == 2
+    now[0] += project_manager.reconcile_interval
+    project_manager.process_task()
+    assert project_manager.last_report['total'] == 3
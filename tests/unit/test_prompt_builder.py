@@ -0,0 +1,55 @@
+from utils.prompt_builder import PromptBuilder, extract_code
+
+CODE = "\n".join(
+    ["import math", "", "class Shape:"] +
+    [f"    value_{i} = {i} * math.pi # filler to make the body long" for i in range(40)] +
+    ["", "    def area(self):", "        return 0"]
+)
+
+
+def test_budget_is_the_window_minus_the_response_reserve():
+    builder = PromptBuilder(context_windows={'small': 512}, response_reserve=100)
+    assert builder.budget_for('small') == 412
+    assert builder.budget_for('unknown') == 4096 - 100
+    assert PromptBuilder(context_windows={'tiny': 50}, response_reserve=100).budget_for('tiny') == 0
+
+
+def test_short_prompt_is_left_alone():
+    result = PromptBuilder().build('llama-2-7b', "Review '{description}'", code="x = 1", description='a sum')
+    assert result.prompt == "Review 'a sum'\n\n```python\nx = 1\n```"
+    assert not result.truncated
+    assert result.estimated_tokens <= result.budget
+
+
+def test_long_code_keeps_signatures_and_marks_omissions():
+    builder = PromptBuilder(context_windows={'small': 300}, response_reserve=100)
+    result = builder.build('small', "Review this code:", code=CODE)
+    assert result.truncated
+    assert result.estimated_tokens <= result.budget
+    for signature in ("import math", "class Shape:", "    def area(self):"):
+        assert signature in result.prompt
+    assert "lines omitted ..." in result.prompt
+    kept = [line for line in result.prompt.splitlines() if 'value_' in line]
+    assert kept == sorted(kept, key=lambda line: int(line.split('_')[1].split()[0])) # original order
+
+
+def test_long_description_is_cut_to_its_share():
+    builder = PromptBuilder(context_windows={'small': 500}, response_reserve=100, max_description_share=0.25)
+    result = builder.build('small', "Do '{description}'", description="word " * 1000)
+    assert result.truncated
+    assert builder.estimate_tokens(result.prompt, 'small') <= 100 + builder.estimate_tokens("Do ''", 'small') + 2
+
+
+def test_system_prompt_counts_against_the_budget():
+    builder = PromptBuilder(context_windows={'small': 300}, response_reserve=100)
+    without = builder.build('small', "Review:", code=CODE)
+    with_system = builder.build('small', "Review:", code=CODE, system="s" * 350)
+    assert len(with_system.prompt) < len(without.prompt)
+    assert with_system.estimated_tokens <= with_system.budget
+
+
+def test_code_is_taken_out_of_the_response_fences():
+    response = "Here you go:\n```python\ndef f():\n    return 1\n```\nand\n```\nf()\n```"
+    assert extract_code(response) == "def f():\n    return 1\n\nf()"
+    assert extract_code("plain text ") == "plain text"
+    assert PromptBuilder().build('m', "Review:", code={'code': response}).prompt.count("```") == 2
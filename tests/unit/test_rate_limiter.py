@@ -0,0 +1,91 @@
+import time
+import logging
+
+import pytest
+
+from core.rate_limiter import RateLimiter
+
+LOGGER = logging.getLogger('test_rate_limiter')
+
+
+@pytest.fixture(params=['local', 'redis'])
+def make_limiter(request):
+    """
+    Limiters with buckets in this process, and in redis through TAKE_SCRIPT run by fakeredis with lupa
+    """
+    redis_client = None
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        redis_client = fakeredis.FakeRedis()
+    return lambda limits: RateLimiter(limits, redis_client=redis_client, logger=LOGGER)
+
+
+def level(limiter, key):
+    return limiter.get_status()['buckets'][key]['available']
+
+
+def test_burst_then_rejects_without_waiting(make_limiter):
+    limiter = make_limiter({'model:m': {'requests_per_second': 1, 'burst': 2}})
+    assert limiter.try_acquire(['model:m'])
+    assert limiter.try_acquire(['model:m'])
+    assert not limiter.try_acquire(['model:m'])
+    assert limiter.get_status()['rejected'] == 1
+
+
+def test_blocking_acquire_waits_for_the_refill(make_limiter):
+    limiter = make_limiter({'model:m': {'requests_per_second': 20, 'burst': 1}})
+    assert limiter.acquire(['model:m'])
+    started = time.time()
+    assert limiter.acquire(['model:m'])
+    assert 0.03 <= time.time() - started < 1.0
+    assert limiter.get_status()['throttled'] == 1
+
+
+def test_acquire_gives_up_when_the_wait_would_pass_the_deadline(make_limiter):
+    limiter = make_limiter({'model:m': {'requests_per_second': 0.1, 'burst': 1}})
+    assert limiter.acquire(['model:m'])
+    started = time.time()
+    assert not limiter.acquire(['model:m'], deadline=time.time() + 1.0)
+    assert time.time() - started < 0.5 # did not sleep toward a refill it could never get in time
+
+
+def test_takes_from_every_name_or_none(make_limiter):
+    limiter = make_limiter({'model:m': {'requests_per_second': 1, 'burst': 5}, 'backend:b': {'requests_per_second': 1, 'burst': 1}})
+    assert limiter.try_acquire(['model:m', 'backend:b'])
+    assert not limiter.try_acquire(['model:m', 'backend:b']) # the backend is empty
+    assert level(limiter, 'model:m:requests') == pytest.approx(4, abs=0.1) # so the model was not taken from either
+    assert limiter.try_acquire(['unlimited'])
+
+
+def test_adjust_settles_against_what_was_taken(make_limiter):
+    limiter = make_limiter({'model:m': {'tokens_per_minute': 600}, 'backend:b': {'tokens_per_minute': 6000}})
+    assert limiter.acquire(['model:m', 'backend:b'], tokens=1000, block=False) # the model bucket only holds 600
+    assert level(limiter, 'model:m:tokens') == pytest.approx(0, abs=1)
+    assert level(limiter, 'backend:b:tokens') == pytest.approx(5000, abs=5)
+    limiter.adjust(['model:m', 'backend:b'], 300, reserved=1000)
+    assert level(limiter, 'model:m:tokens') == pytest.approx(300, abs=1) # 600 taken, 300 used
+    assert level(limiter, 'backend:b:tokens') == pytest.approx(5700, abs=5) # 1000 taken, 300 used
+
+
+def test_adjust_can_leave_a_bucket_in_debt(make_limiter):
+    limiter = make_limiter({'model:m': {'tokens_per_minute': 60}})
+    assert limiter.try_acquire(['model:m'], tokens=10)
+    limiter.adjust(['model:m'], 100, reserved=10)
+    assert level(limiter, 'model:m:tokens') < 0
+    assert not limiter.try_acquire(['model:m'], tokens=1)
+
+
+def test_invalid_limits_are_rejected():
+    with pytest.raises(ValueError):
+        RateLimiter({'model:m': {'requests_per_second': 0}})
+
+
+def test_unreachable_redis_lets_calls_through():
+    class DownRedis:
+        def register_script(self, script):
+            def call(**kwargs):
+                raise ConnectionError('redis is down')
+            return call
+    limiter = RateLimiter({'model:m': {'requests_per_second': 1}}, redis_client=DownRedis(), logger=LOGGER)
+    assert all(limiter.try_acquire(['model:m']) for _ in range(3))
@@ -0,0 +1,76 @@
+import time
+import logging
+
+import pytest
+
+from core.redis_message_pipeline import RedisStreamMessagePipeline
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def make_pipeline(redis_client, consumer, **kwargs):
+    return RedisStreamMessagePipeline(redis_client=redis_client, consumer=consumer, block_ms=50,
+                                      logger=logging.getLogger('test_redis_message_pipeline'), **kwargs)
+
+
+def test_unacknowledged_messages_are_replayed_when_subscribed_after_start():
+    redis_client = fakeredis.FakeRedis()
+    crashed = make_pipeline(redis_client, 'worker-1')
+    crashed.subscribe('task_update', lambda data: None)
+    crashed.publish('task_update', {'n': 1})
+    crashed.publish('task_update', {'n': 2})
+    redis_client.xreadgroup('agents', 'worker-1', {'messages:task_update': '>'}) # delivered, then the process died
+
+    received = []
+    restarted = make_pipeline(redis_client, 'worker-1')
+    restarted.start() # started before subscribing, like main.py
+    try:
+        time.sleep(0.1)
+        restarted.subscribe('task_update', received.append)
+        restarted.publish('task_update', {'n': 3})
+        assert wait_for(lambda: len(received) == 3)
+    finally:
+        restarted.stop()
+    assert received == [{'n': 1}, {'n': 2}, {'n': 3}]
+    assert redis_client.xpending('messages:task_update', 'agents')['pending'] == 0
+
+
+def test_messages_of_abandoned_consumers_are_claimed():
+    redis_client = fakeredis.FakeRedis()
+    publisher = make_pipeline(redis_client, 'publisher')
+    publisher.subscribe('request_help', lambda data: None)
+    publisher.publish('request_help', {'n': 1})
+    redis_client.xreadgroup('agents', 'gone', {'messages:request_help': '>'}) # a consumer that never comes back
+
+    received = []
+    survivor = make_pipeline(redis_client, 'worker-2', claim_idle_ms=0)
+    survivor.subscribe('request_help', received.append)
+    survivor.start()
+    try:
+        assert wait_for(lambda: received == [{'n': 1}])
+    finally:
+        survivor.stop()
+
+
+def test_unsubscribed_stream_is_no_longer_dispatched():
+    redis_client = fakeredis.FakeRedis()
+    received = []
+    pipeline = make_pipeline(redis_client, 'worker-1')
+    pipeline.subscribe('task_update', received.append)
+    pipeline.start()
+    try:
+        pipeline.publish('task_update', {'n': 1})
+        assert wait_for(lambda: received == [{'n': 1}])
+        pipeline.unsubscribe('task_update', received.append)
+        pipeline.publish('task_update', {'n': 2})
+        time.sleep(0.2)
+    finally:
+        pipeline.stop()
+    assert received == [{'n': 1}]
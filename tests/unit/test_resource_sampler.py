@@ -0,0 +1,80 @@
+import time
+import logging
+
+import pytest
+
+from core.resource_sampler import RingBuffer, ResourceSampler
+
+LOGGER = logging.getLogger('test_resource_sampler')
+
+
+def test_ring_buffer_keeps_the_newest_samples_in_order():
+    buffer = RingBuffer(3, ('a',))
+    for i in range(5):
+        buffer.append(float(i), {'a': i * 10})
+    assert len(buffer) == 3
+    assert buffer.window('a', 10) == [20.0, 30.0, 40.0]
+    assert buffer.window('a', 2) == [30.0, 40.0]
+    assert buffer.to_dict() == {'timestamp': [2.0, 3.0, 4.0], 'a': [20.0, 30.0, 40.0]}
+
+
+def test_ring_buffer_mean_and_slope():
+    buffer = RingBuffer(10, ('a', 'b'))
+    assert buffer.mean('a', 5) is None and buffer.slope('a', 5) is None
+    for i in range(6):
+        buffer.append(100.0 + i * 2, {'a': 5.0 * i}) # 'b' is missing and stored as 0
+    assert buffer.mean('a', 2) == pytest.approx(22.5)
+    assert buffer.slope('a', 6) == pytest.approx(2.5) # 5 per sample, 2 seconds apart
+    assert buffer.mean('b', 6) == 0.0
+
+
+def test_sampler_takes_a_sample_at_start_and_keeps_sampling():
+    values = iter(range(1000))
+    sampler = ResourceSampler(lambda: {'cpu_percent': float(next(values))}, interval=0.01, history_size=5, logger=LOGGER)
+    sampler.start()
+    try:
+        assert sampler.snapshot['cpu_percent'] == 0.0 # available as soon as start returns
+        deadline = time.time() + 5
+        while sampler.samples_taken < 8 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sampler.stop()
+    assert not sampler.running
+    assert len(sampler.history) == 5
+    window = sampler.history.window('cpu_percent', 5)
+    assert window == sorted(window) and window[-1] == sampler.snapshot['cpu_percent']
+
+
+def test_a_failing_sample_does_not_stop_the_sampler():
+    calls = []
+
+    def sample():
+        calls.append(1)
+        if len(calls) == 2:
+            raise OSError('sensor gone')
+        return {'cpu_percent': 1.0}
+    sampler = ResourceSampler(sample, interval=0.01, logger=LOGGER)
+    sampler.start()
+    try:
+        deadline = time.time() + 5
+        while sampler.samples_taken < 3 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sampler.stop()
+    assert sampler.samples_taken >= 3
+
+
+def test_scheduling_uses_the_smoothed_resources():
+    from core.resource_manager import ResourceManager
+    manager = ResourceManager({'resource_smoothing_samples': 4, 'gpu_provider': 'none'}, logger=LOGGER)
+    available = [10.0]
+    manager.sampler.sample_function = lambda: {'available_memory': available[0]}
+    task = {'task_id': 'a', 'resource_requirements': {'model': 'llama-2-7b'}} # needs 2 GB
+    for _ in range(3):
+        manager.sampler.sample_now()
+    available[0] = 0.5
+    assert manager.can_run_task(task) # samples once more since the sampler isn't running, one dip in the last four
+    for _ in range(3):
+        manager.sampler.sample_now()
+    assert not manager.can_run_task(task)
+    assert manager.get_smoothed_resources()['available_memory'] == pytest.approx(0.5)
@@ -0,0 +1,107 @@
+import time
+import logging
+
+import pytest
+
+from conftest import make_task
+from core.scheduler import Scheduler
+from core.task_queue import RedisTaskQueue
+
+
+class StubAgent:
+    def __init__(self, agent_id, role='JuniorDevAgent'):
+        self.id = agent_id
+        self.name = agent_id
+        self.role = role
+        self.is_active = False
+        self.started = []
+
+    def start_task(self, task_id):
+        self.is_active = True
+        self.started.append(task_id)
+
+
+class StubResourceManager:
+    def can_run_task(self, task):
+        return True
+
+
+@pytest.fixture
+def task_queue(redis_client):
+    return RedisTaskQueue(redis_client=redis_client)
+
+
+def make_scheduler(task_queue, agents, lease_ttl=0.001, message_pipeline=None):
+    return Scheduler(task_queue, StubResourceManager(), pools=[('', agents)], logger=logging.getLogger('test_scheduler'),
+                     lease_ttl=lease_ttl, message_pipeline=message_pipeline)
+
+
+def test_assign_leases_task_to_agent(task_queue):
+    agent = StubAgent('agent-1')
+    scheduler = make_scheduler(task_queue, [agent], lease_ttl=60)
+    task_queue.set('a', make_task('a'))
+
+    scheduler.tick()
+    assert agent.started == ['a']
+    assert task_queue.get('a')['assigned_agent'] == 'agent-1'
+    assert not task_queue.acquire_lease('a', 'agent-2', 60)
+
+
+def test_expired_lease_is_reclaimed(task_queue, message_pipeline):
+    agent = StubAgent('agent-1')
+    scheduler = make_scheduler(task_queue, [agent], message_pipeline=message_pipeline)
+    task_queue.set('a', make_task('a', role='JuniorDevAgent'))
+    scheduler.tick()
+    task = task_queue.get('a')
+    task['status'] = 'in_progress'
+    task_queue.set('a', task)
+    time.sleep(0.01) # the agent never renewed the lease
+
+    scheduler.reclaim_expired()
+    task = task_queue.get('a')
+    assert task['status'] == 'pending'
+    assert task['assigned_agent'] is None
+    assert task['reclaimed'] == 1
+    assert scheduler.reclaimed == 1
+    assert task_queue.status_counts() == {'pending': 1}
+    assert message_pipeline.published == [('task_update', {'task_id': 'a', 'status': 'pending', 'agent_id': None, 'role': 'JuniorDevAgent'})]
+
+
+def test_finished_or_reassigned_tasks_are_not_reclaimed(task_queue, message_pipeline):
+    scheduler = make_scheduler(task_queue, [], message_pipeline=message_pipeline)
+    task_queue.set('done', make_task('done', 'completed', assigned_agent='agent-1'))
+    task_queue.set('moved', make_task('moved', 'in_progress', assigned_agent='agent-2'))
+    task_queue.acquire_lease('done', 'agent-1', 0.001)
+    task_queue.acquire_lease('moved', 'agent-1', 0.001)
+    time.sleep(0.01)
+
+    scheduler.reclaim_expired()
+    assert task_queue.get('done')['status'] == 'completed'
+    assert task_queue.get('moved')['assigned_agent'] == 'agent-2'
+    assert scheduler.reclaimed == 0
+    assert message_pipeline.published == []
+
+
+def test_role_hint_overrides_model_pool(task_queue):
+    junior = StubAgent('junior', 'JuniorDevAgent')
+    tester = StubAgent('tester', 'TestDevAgent')
+    scheduler = Scheduler(task_queue, StubResourceManager(), pools=[('llama', [junior]), ('', [tester])],
+                          logger=logging.getLogger('test_scheduler'))
+    task_queue.set('a', make_task('a', resource_requirements={'model': 'llama-2-13b'}, role='TestDevAgent'))
+
+    scheduler.tick()
+    assert tester.started == ['a']
+    assert junior.started == []
+
+
+def test_waits_for_dependencies(task_queue):
+    agent = StubAgent('agent-1')
+    scheduler = make_scheduler(task_queue, [agent], lease_ttl=60)
+    task_queue.set('a', make_task('a', 'in_progress'))
+    task_queue.set('b', make_task('b', dependencies=['a']))
+
+    scheduler.tick()
+    assert agent.started == []
+    task_queue.set('a', make_task('a', 'completed'))
+    scheduler.tick()
+    assert agent.started == ['b']
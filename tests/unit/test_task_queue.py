@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from conftest import make_task
+from core.task_queue import RedisTaskQueue, CHECKPOINT_PREFIX
+
+
+@pytest.fixture
+def task_queue(redis_client):
+    return RedisTaskQueue(redis_client=redis_client)
+
+
+def test_status_counts_follow_writes(task_queue):
+    task_queue.set('a', make_task('a'))
+    task_queue.set('b', make_task('b'))
+    assert task_queue.status_counts() == {'pending': 2}
+
+    task_queue.set('a', make_task('a', 'in_progress'))
+    task_queue.set('a', make_task('a', 'in_progress')) # same status again, counted once
+    assert task_queue.status_counts() == {'pending': 1, 'in_progress': 1}
+
+    task_queue.set('a', make_task('a', 'completed'))
+    task_queue.delete('b')
+    assert task_queue.status_counts() == {'completed': 1}
+    assert len(task_queue) == 1
+
+
+def test_delete_of_missing_task_leaves_counts(task_queue):
+    task_queue.set('a', make_task('a'))
+    task_queue.delete('missing')
+    assert task_queue.status_counts() == {'pending': 1}
+
+
+def test_reconcile_repairs_drift(task_queue, redis_client):
+    task_queue.set('a', make_task('a'))
+    task_queue.set('b', make_task('b', 'completed'))
+    redis_client.set('c', task_queue.codec.encode(make_task('c'))) # written without the counts, as before they existed
+
+    assert task_queue.reconcile() == {'pending': 1}
+    assert task_queue.status_counts() == {'pending': 2, 'completed': 1}
+    assert task_queue.reconcile() == {}
+
+
+def test_values_skip_bookkeeping_keys(task_queue):
+    task_queue.set('a', make_task('a'))
+    task_queue.acquire_lease('a', 'agent-1', 60)
+    task_queue.save_checkpoint('a', 'step', 'output')
+    assert [task['task_id'] for task in task_queue.values()] == ['a']
+
+
+def test_counts_are_built_for_tasks_stored_before_them(redis_client):
+    codec = RedisTaskQueue(redis_client=redis_client).codec
+    redis_client.set('a', codec.encode(make_task('a')))
+    redis_client.set('b', codec.encode(make_task('b', 'completed')))
+    task_queue = RedisTaskQueue(redis_client=redis_client)
+    assert len(task_queue) == 2
+    assert task_queue.status_counts() == {'pending': 1, 'completed': 1}
+
+
+def test_lease_is_exclusive_until_released(task_queue):
+    assert task_queue.acquire_lease('a', 'agent-1', 60)
+    assert task_queue.acquire_lease('a', 'agent-1', 60) # the holder may take it again
+    assert not task_queue.acquire_lease('a', 'agent-2', 60)
+    assert not task_queue.renew_lease('a', 'agent-2', 60)
+    assert not task_queue.release_lease('a', 'agent-2')
+    assert task_queue.lease_count() == 1
+
+    assert task_queue.renew_lease('a', 'agent-1', 60)
+    assert task_queue.release_lease('a', 'agent-1')
+    assert task_queue.lease_count() == 0
+    assert task_queue.acquire_lease('a', 'agent-2', 60)
+
+
+def test_expired_lease_is_handed_out_once(task_queue):
+    assert task_queue.acquire_lease('a', 'agent-1', 0.001)
+    assert task_queue.acquire_lease('b', 'agent-2', 60)
+    time.sleep(0.01)
+
+    assert task_queue.expired_leases() == [('a', 'agent-1')]
+    assert task_queue.expired_leases() == []
+    assert not task_queue.renew_lease('a', 'agent-1', 60) # the agent lost it
+    assert task_queue.acquire_lease('a', 'agent-3', 60)
+    assert task_queue.lease_count() == 2
+
+
+def test_expired_lease_can_be_taken_over(task_queue):
+    assert task_queue.acquire_lease('a', 'agent-1', 0.001)
+    time.sleep(0.01)
+    assert task_queue.acquire_lease('a', 'agent-2', 60)
+    assert not task_queue.release_lease('a', 'agent-1')
+
+
+def test_expired_leases_limit(task_queue):
+    for task_id in 'abc':
+        task_queue.acquire_lease(task_id, 'agent-1', 0.001)
+    time.sleep(0.01)
+    assert len(task_queue.expired_leases(limit=2)) == 2
+    assert len(task_queue.expired_leases(limit=2)) == 1
+
+
+def test_delete_drops_lease_and_checkpoints(task_queue, redis_client):
+    task_queue.set('a', make_task('a'))
+    task_queue.acquire_lease('a', 'agent-1', 60)
+    task_queue.save_checkpoint('a', 'llm:1', 'saved output')
+    assert task_queue.get_checkpoint('a', 'llm:1') == 'saved output'
+
+    task_queue.delete('a')
+    assert task_queue.get('a') is None
+    assert task_queue.lease_count() == 0
+    assert task_queue.get_checkpoint('a', 'llm:1') is None
+    assert not redis_client.hgetall(CHECKPOINT_PREFIX + 'a')
@@ -0,0 +1,83 @@
+import logging
+
+import pytest
+
+from core.test_runner import TestRunner as Runner # not collected as a test class
+
+LOGGER = logging.getLogger('test_test_runner')
+
+CODE = "def add(a, b):\n    return a + b\n"
+PASSING = "def test_add():\n    assert add(1, 2) == 3\n"
+FAILING = "def test_add():\n    assert add(1, 2) == 4\n\ndef test_add_zero():\n    assert add(0, 0) == 0\n"
+
+
+@pytest.fixture
+def runner():
+    runner = Runner(max_workers=2, timeout=20.0, logger=LOGGER)
+    yield runner
+    runner.stop()
+
+
+def test_passing_and_failing_tests_are_counted(runner):
+    result = runner.run(CODE, PASSING)
+    assert (result['status'], result['passed'], result['tests_passed']) == ('passed', True, 1)
+    result = runner.run(CODE, FAILING)
+    assert (result['status'], result['passed'], result['tests_passed'], result['tests_failed']) == ('failed', False, 1, 1)
+    assert 'assert 3 == 4' in result['output']
+
+
+@pytest.mark.parametrize('imports', [
+    "from candidate import add",
+    "from solution import add",
+    "import solution\nadd = solution.add",
+    "import your_module as m\nadd = m.add",
+])
+def test_tests_can_import_the_code(runner, imports):
+    result = runner.run(CODE, f"{imports}\n\n{PASSING}")
+    assert result['status'] == 'passed', result['output']
+
+
+def test_rewrite_leaves_other_imports_alone():
+    tests = "import os\nfrom solutions import add\nimport main_helpers\n    from solution import add\nimport solution as s\n"
+    assert Runner.rewrite_imports(tests) == \
+        "import os\nfrom solutions import add\nimport main_helpers\n    from candidate import add\nimport candidate as s\n"
+
+
+def test_broken_tests_are_cached_like_failures(runner):
+    first = runner.run(CODE, "from missing_module import add\n\n" + PASSING) # fails to collect, pytest exits 2
+    assert (first['status'], first['returncode'], first['cached']) == ('broken', 2, False)
+    second = runner.run(CODE, "from missing_module import add\n\n" + PASSING)
+    assert second['status'] == 'broken' and second['cached']
+    assert runner.get_status()['runs'] == 1
+
+
+def test_errors_of_the_runner_are_not_cached(tmp_path):
+    runner = Runner(max_workers=1, python=str(tmp_path / 'no_python'), logger=LOGGER)
+    try:
+        assert runner.run(CODE, PASSING)['status'] == 'error'
+        assert not runner.run(CODE, PASSING)['cached']
+        assert runner.get_status()['runs'] == 2
+    finally:
+        runner.stop()
+
+
+def test_no_tests(runner):
+    assert runner.run(CODE, "")['status'] == 'no_tests'
+
+
+def test_runs_over_the_timeout_are_killed():
+    runner = Runner(max_workers=1, timeout=1.0, logger=LOGGER)
+    try:
+        result = runner.run(CODE, "import time\n\ndef test_slow():\n    time.sleep(30)\n")
+    finally:
+        runner.stop()
+    assert result['status'] == 'timeout'
+    assert result['duration'] < 10
+
+
+def test_identical_candidates_run_once(runner):
+    futures = [runner.submit(CODE, PASSING) for _ in range(3)]
+    assert all(future.result()['passed'] for future in futures)
+    assert runner.run(CODE, PASSING)['cached']
+    status = runner.get_status()
+    assert (status['runs'], status['cache_hits'], status['outcomes']) == (1, 3, {'passed': 1})